@@ -1,492 +1,525 @@
 import streamlit as st
 import pandas as pd
-import io
+import os
+import tracemalloc
 import plotly.express as px
 import plotly.graph_objects as go
+import plotly.io as pio
+
+from actualizacion import Actualizador
+from fuentes import ARCHIVOS, CACHE_DESCARGAS, URL_BASE, cargar_fuentes, rutas_fuentes, rutas_snapshot
+from cache_vistas import CacheVistas
+from consultas_duckdb import (
+    DIRECTORIO_PARQUET,
+    DUCKDB_DISPONIBLE,
+    consultar_duckdb,
+    consultar_duckdb_por_grupo,
+    escribir_parquet_datos,
+    exportar_duckdb,
+    top_5_gastos_duckdb,
+)
+from exportacion import EXPORTACIONES, FORMATOS, archivo_exportado, exportar_filas
+from cubo import consultar_cubo, consultar_cubo_por_grupo
+from instrumentacion import etapa, exportar_json, registrar_log, tabla_registro
+from procesamiento import huella_datos, vista_compartida
+from reportes import (
+    OPCIONES_FAM_CUENTA,
+    construir_datos,
+    cumplimiento_por_grupo,
+    gasto_acumulado,
+    preparar_gasto,
+    tabla_gasto_vs_presupuesto,
+    tabla_tipos_orden,
+    top_5_gastos,
+)
+
+# Los datos procesados se guardan una sola vez por proceso y cada sesión trabaja
+# sobre vistas; con copy-on-write una vista no copia los datos hasta que se
+# modifica, y la modificación no afecta a las demás sesiones.
+pd.set_option('mode.copy_on_write', True)
 
 # Título de la aplicación
 st.markdown("<h1 style='text-align: center; color: black; font-size: 24px;'>MONITOR GESTIÓN PRESUPUESTARIA</h1>", unsafe_allow_html=True)
 
-# Definimos las URLs de los archivos de referencia
-DATA0_URL = 'https://streamlitmaps.s3.amazonaws.com/Data_0624.csv'
-BUDGET_URL = 'https://streamlitmaps.s3.amazonaws.com/Base_Presupuesto_2.csv'
-ORDERS_URL = 'https://streamlitmaps.s3.amazonaws.com/Base_Ordenes_0624.csv'
-BASE_UTEC_URL = 'https://streamlitmaps.s3.amazonaws.com/Base_UTEC_BudgetVersion.csv'
-BASE_CECO_URL = 'https://streamlitmaps.s3.amazonaws.com/Base_Ceco_3.csv'
-
-# Función para cargar el archivo de referencia
-@st.cache_data
-def load_data(url):
-    data = pd.read_csv(url, encoding='ISO-8859-1', sep=';')
-        
-    if 'Valor/mon.inf.' in data.columns:
-        data['Valor/mon.inf.'] = pd.to_numeric(data['Valor/mon.inf.'].str.replace(',', ''), errors='coerce').fillna(0)
-        
-    return data
-
-# Función para eliminar filas con valores específicos en "Grupo_Ceco"
-def eliminar_filas_grupo_ceco(data):
-    valores_excluir = ["Abastecimiento y contratos", "Finanzas", "Servicios generales"]
-    return data[~data['Grupo_Ceco'].isin(valores_excluir)]
-
-# Función para identificar y eliminar pares de valores opuestos
-def eliminar_pares_opuestos(data):
-    filtered_df = pd.DataFrame()
-    removed_df = pd.DataFrame()
-    groups = data.groupby(['Clase de coste', 'Centro de coste'])
-    
-    for name, group in groups:
-        seen_values = {}
-        rows_to_remove = set()
-        
-        # Ordenar el grupo por 'Período' de forma ascendente para procesar en orden temporal
-        group = group.sort_values(by='Período')
-        
-        for index, row in group.iterrows():
-            value = row['Valor/mon.inf.']
-            period = row['Período']
-            
-            if value < 0:
-                # Buscar coincidencia en el mismo período
-                if (period, -value) in seen_values:
-                    opposite_index = seen_values[(period, -value)]
-                    rows_to_remove.add(index)
-                    rows_to_remove.add(opposite_index)
-                    del seen_values[(period, -value)]
-                else:
-                    # Buscar coincidencia en períodos anteriores
-                    for past_period in range(period - 1, 0, -1):
-                        if (past_period, -value) in seen_values:
-                            opposite_index = seen_values[(past_period, -value)]
-                            rows_to_remove.add(index)
-                            rows_to_remove.add(opposite_index)
-                            del seen_values[(past_period, -value)]
-                            break
-                    else:
-                        # No se encontró coincidencia, mantener el valor negativo
-                        seen_values[(period, value)] = index
-            else:
-                seen_values[(period, value)] = index
-        
-        # Convertir el set a una lista para indexar
-        rows_to_remove_list = list(rows_to_remove)
-        
-        # Eliminar las filas identificadas y almacenar en removed_df
-        group_filtered = group.drop(rows_to_remove_list)
-        removed_rows = group.loc[rows_to_remove_list]
-        removed_df = pd.concat([removed_df, removed_rows])
-        filtered_df = pd.concat([filtered_df, group_filtered])
-    
-    return filtered_df, removed_df
-
-# Función para convertir DataFrame a CSV
-def convertir_a_csv(df):
-    buffer = io.StringIO()
-    df.to_csv(buffer, index=False, sep=';')
-    buffer.seek(0)
-    return buffer.getvalue()
-
-# Cargar los datos
-data0 = load_data(DATA0_URL)
-data0['id'] = range(1, len(data0) + 1)
-budget_data = load_data(BUDGET_URL)
-orders_data = load_data(ORDERS_URL)
-base_utec_data = load_data(BASE_UTEC_URL)
-base_ceco_data = load_data(BASE_CECO_URL)
-
-# Verificar que las columnas necesarias están presentes en los DataFrames cargados
-assert 'Orden' in orders_data.columns, "La columna 'Orden' no está presente en orders_data"
-assert 'Utec' in orders_data.columns, "La columna 'Utec' no está presente en orders_data"
-assert 'Utec' in base_utec_data.columns, "La columna 'Utec' no está presente en base_utec_data"
-assert 'Proceso' in base_utec_data.columns, "La columna 'Proceso' no está presente en base_utec_data"
-assert 'Recinto' in base_utec_data.columns, "La columna 'Recinto' no está presente en base_utec_data"
-assert 'Ceco' in base_ceco_data.columns, "La columna 'Ceco' no está presente en base_ceco_data"
-assert 'Proceso' in base_ceco_data.columns, "La columna 'Proceso' no está presente en base_ceco_data"
-assert 'Recinto' in base_ceco_data.columns, "La columna 'Recinto' no está presente en base_ceco_data"
-
-# Asegurarse de que 'Ejercicio' y 'Período' son de tipo string
-data0['Ejercicio'] = data0['Ejercicio'].astype(str)
-data0['Período'] = data0['Período'].astype(str)
-budget_data['Año'] = budget_data['Año'].astype(str)
-budget_data['Mes'] = budget_data['Mes'].astype(str)
-
-# Agregar nuevas columnas a data0
-data0['Utec'] = None
-data0['Proceso'] = None
-data0['Recinto'] = None
-
-# Convertir la columna 'Período' y 'Valor/mon.inf.' a tipo numérico
-data0['Período'] = pd.to_numeric(data0['Período'], errors='coerce')
-data0['Valor/mon.inf.'] = pd.to_numeric(data0['Valor/mon.inf.'], errors='coerce')
-
-# Primer mapeo: Asignar Utec utilizando ORDERS_URL
-if 'Orden partner' in data0.columns and 'Orden' in orders_data.columns:
-    data0 = data0.merge(orders_data[['Orden', 'Utec']], how='left', left_on='Orden partner', right_on='Orden', suffixes=('_original', '_merged'))
-    if 'Utec_merged' in data0.columns:
-        data0['Utec'] = data0['Utec_merged']
-        data0.drop(columns=['Utec_original', 'Utec_merged'], inplace=True)
-    else:
-        st.error("No se encontraron las columnas necesarias para el primer mapeo ('Utec')")
+# Origen de los archivos de referencia: por defecto la URL de S3. MONITOR_ORIGEN
+# permite usar un directorio local con los CSV y MONITOR_SNAPSHOT un snapshot
+# Parquet generado con `python fuentes.py <directorio>`.
+ORIGEN_DATOS = os.environ.get('MONITOR_ORIGEN', URL_BASE)
+SNAPSHOT_DIR = os.environ.get('MONITOR_SNAPSHOT')
+
+# Directorio donde se guardan los archivos descargados para revalidarlos con
+# ETag/Last-Modified después de reiniciar; MONITOR_CACHE vacío la desactiva.
+CACHE_DIR = os.environ.get('MONITOR_CACHE', CACHE_DESCARGAS)
+
+# Directorio con el resultado del último procesamiento. Si se define, al llegar
+# datos nuevos solo se recalculan los grupos y períodos que cambiaron.
+INCREMENTAL_DIR = os.environ.get('MONITOR_INCREMENTAL')
+
+# Con MONITOR_PROCESOS=N (N > 1) el procesamiento completo se reparte en N
+# procesos por particiones del gasto (ver particiones.py).
+PROCESOS = int(os.environ.get('MONITOR_PROCESOS') or 1)
+
+# Con MONITOR_MOTOR=duckdb el gasto procesado y el presupuesto se guardan como
+# Parquet en MONITOR_PARQUET y las consultas de la página las responde DuckDB,
+# sin mantener las tablas de detalle en memoria. Sin duckdb instalado se usa
+# el cubo en pandas.
+MOTOR_DUCKDB = os.environ.get('MONITOR_MOTOR') == 'duckdb'
+PARQUET_DIR = os.environ.get('MONITOR_PARQUET', DIRECTORIO_PARQUET)
+if MOTOR_DUCKDB and not DUCKDB_DISPONIBLE:
+    st.warning("MONITOR_MOTOR=duckdb pero duckdb no está instalado; se usa pandas")
+    MOTOR_DUCKDB = False
+
+# Actualización en segundo plano: con MONITOR_ACTUALIZAR=<segundos> los archivos
+# de origen se vuelven a cargar cada esos segundos y con MONITOR_ACTUALIZAR=archivos
+# cuando cambian los archivos locales (MONITOR_ORIGEN local o MONITOR_SNAPSHOT).
+# Los datos nuevos se procesan en un hilo, fuera de las sesiones, y cada sesión
+# usa la última versión completa.
+ACTUALIZAR = os.environ.get('MONITOR_ACTUALIZAR')
+
+# Límites de la caché de tablas y gráficos por selección de filtros, compartida
+# por todas las sesiones: cantidad de selecciones y MB en total
+CACHE_VISTAS_ENTRADAS = int(os.environ.get('MONITOR_CACHE_VISTAS', 256))
+CACHE_VISTAS_MB = float(os.environ.get('MONITOR_CACHE_VISTAS_MB', 256))
+
+# Diagnóstico: MONITOR_DIAGNOSTICO_LOG agrega las etapas de cada ejecución como
+# líneas JSON a ese archivo y MONITOR_TRACEMALLOC=1 mide además el pico de
+# memoria de cada etapa (hace más lento el procesamiento).
+DIAGNOSTICO_LOG = os.environ.get('MONITOR_DIAGNOSTICO_LOG')
+if os.environ.get('MONITOR_TRACEMALLOC') == '1' and not tracemalloc.is_tracing():
+    tracemalloc.start()
+
+# Tiempo, memoria y filas de cada etapa de esta ejecución de la página
+registro = []
+
+if SNAPSHOT_DIR:
+    RUTAS = rutas_snapshot(SNAPSHOT_DIR)
 else:
-    st.error("No se encontraron las columnas necesarias para el primer mapeo")
-
-# Verificar si data0 es un DataFrame
-if not isinstance(data0, pd.DataFrame):
-    st.error("data0 no es un DataFrame después del primer mapeo")
-
-# Segundo mapeo: Asignar Proceso utilizando Base_UTEC_BudgetVersion.csv
-if 'Utec' in data0.columns:
-    data0 = data0.merge(base_utec_data[['Utec', 'Proceso']], how='left', on='Utec', suffixes=('_original', '_merged'))
-    if 'Proceso_merged' in data0.columns:
-        data0['Proceso'] = data0['Proceso_merged']
-        data0.drop(columns=['Proceso_original', 'Proceso_merged'], inplace=True)
-    else:
-        st.error("No se encontraron las columnas necesarias para el segundo mapeo")
-else:
-    st.error("No se encontraron las columnas necesarias para el segundo mapeo")
-
-# Verificar si data0 es un DataFrame
-if not isinstance(data0, pd.DataFrame):
-    st.error("data0 no es un DataFrame después del primer mapeo")
-
-# Asignar Recinto utilizando Base_UTEC_BudgetVersion.csv
-if 'Utec' in data0.columns:
-    data0 = data0.merge(base_utec_data[['Utec', 'Recinto']], how='left', on='Utec', suffixes=('_original', '_merged'))
-    if 'Recinto_merged' in data0.columns:
-        data0['Recinto'] = data0['Recinto_merged']
-        data0.drop(columns=['Recinto_original', 'Recinto_merged'], inplace=True)
+    RUTAS = rutas_fuentes(ORIGEN_DATOS)
+
+if ACTUALIZAR == 'archivos' and any(ruta.startswith(('http://', 'https://', 's3://')) for ruta in RUTAS.values()):
+    st.warning("MONITOR_ACTUALIZAR=archivos necesita archivos locales; los datos no se actualizan en segundo plano")
+    ACTUALIZAR = None
+
+# Función para cargar los archivos de referencia, en paralelo y a través de la
+# caché en disco. Las etapas de la carga se emiten por el log de diagnóstico.
+def cargar_tablas(urls):
+    diagnostico = []
+    fuentes = cargar_fuentes(dict(zip(ARCHIVOS, urls)), CACHE_DIR or None, diagnostico)
+    registrar_log(diagnostico, DIAGNOSTICO_LOG, ambito='carga')
+    return fuentes
+
+# Función para cargar los archivos de referencia una vez por proceso. Las
+# tablas se comparten entre sesiones sin copiarlas: nadie las modifica.
+@st.cache_resource(show_spinner=False)
+def load_data(urls):
+    return cargar_tablas(urls)
+
+# Función para obtener la huella del contenido de los archivos de origen
+@st.cache_data
+def huella_fuentes(urls):
+    return huella_datos(*load_data(urls))
+
+# Función para construir el conjunto de datos procesado a partir de las tablas
+# de origen. Las etapas del procesamiento quedan en datos['diagnostico']. Con
+# el motor DuckDB se guardan los Parquet y se descartan las tablas de detalle y
+# el cubo; datos['parquet'] tiene la ruta de los archivos. Con la actualización
+# en segundo plano se conservan los Parquet de la versión anterior, que las
+# sesiones en curso pueden seguir consultando.
+def procesar_fuentes(fuentes, huella):
+    diagnostico = []
+    datos = construir_datos(fuentes, INCREMENTAL_DIR, diagnostico, PROCESOS)
+    datos['diagnostico'] = diagnostico
+    datos['filas'] = len(datos['data0'])
+    if MOTOR_DUCKDB:
+        with etapa(diagnostico, 'escribir_parquet', datos['data0']):
+            datos['parquet'] = escribir_parquet_datos(datos, PARQUET_DIR, huella, conservar=1 if ACTUALIZAR else 0)
+        for clave in ['data0', 'removed_data', 'cubo']:
+            del datos[clave]
+    registrar_log(diagnostico, DIAGNOSTICO_LOG, ambito='procesamiento', huella=huella)
+    return datos
+
+# Función para construir el conjunto de datos procesado. Se guarda en caché según
+# la huella del contenido, de modo que cambiar un filtro no vuelve a ejecutar
+# los mapeos, la eliminación de pares ni el reparto de Overhead. El resultado es
+# un único objeto por proceso, compartido por todas las sesiones: cada sesión
+# debe usarlo a través de `vista_compartida`.
+@st.cache_resource(show_spinner="Procesando datos...")
+def construir_datos_procesados(huella, urls):
+    return procesar_fuentes(load_data(urls), huella)
+
+# Función para construir el conjunto de datos procesado con el motor DuckDB. Las
+# tablas de origen se cargan solo aquí y se descartan al escribir los Parquet,
+# así que el proceso conserva solo la huella y los datos resumidos.
+@st.cache_resource(show_spinner="Procesando datos...")
+def construir_datos_parquet(urls):
+    fuentes = cargar_tablas(urls)
+    huella = huella_datos(*fuentes)
+    return huella, procesar_fuentes(fuentes, huella)
+
+# Función para obtener el actualizador en segundo plano del proceso. Se inicia
+# con la primera sesión y construye la primera versión en su hilo; las versiones
+# que publica se comparten como las de `construir_datos_procesados`.
+@st.cache_resource(show_spinner=False)
+def actualizador(urls):
+    if ACTUALIZAR == 'archivos':
+        return Actualizador(lambda: cargar_tablas(urls), procesar_fuentes, rutas=urls).iniciar()
+    return Actualizador(lambda: cargar_tablas(urls), procesar_fuentes, cada=float(ACTUALIZAR)).iniciar()
+
+# Función para obtener la caché de vistas del proceso, compartida por todas las sesiones
+@st.cache_resource
+def cache_vistas():
+    return CacheVistas(CACHE_VISTAS_ENTRADAS, int(CACHE_VISTAS_MB * 1024 ** 2))
+
+# Función para calcular las tablas y gráficos de la página para una selección de
+# filtros. Los gráficos se guardan como JSON de Plotly; el resultado se comparte
+# entre sesiones a través de la caché de vistas y no debe modificarse.
+def calcular_vista(datos, filtros):
+    # Obtener del cubo agregado (o de DuckDB) los totales para los filtros seleccionados
+    if MOTOR_DUCKDB:
+        consulta = consultar_duckdb(datos['parquet'], *filtros)
     else:
-        st.error("No se encontraron las columnas necesarias para el tercer mapeo")
-else:
-    st.error("No se encontraron las columnas necesarias para el tercer mapeo")
-
-# Asegurarse de que data0 es un DataFrame
-if isinstance(data0, pd.DataFrame):
-    # Convertir temporalmente 'Período' a tipo numérico para eliminar pares opuestos
-    data0['Período'] = pd.to_numeric(data0['Período'], errors='coerce')
-    
-    # Ejecutar `eliminar_pares_opuestos`
-    data0, removed_data = eliminar_pares_opuestos(data0)  # Capturar ambos DataFrames
-    
-    # Convertir 'Período' de vuelta a cadena si es necesario
-    # data0['Período'] = data0['Período'].astype(str)
-else:
-    st.error("data0 no es un DataFrame")
+        consulta = consultar_cubo(datos['cubo'], *filtros)
 
-# Procesamiento de data0
-if isinstance(data0, pd.DataFrame):
-    data0 = eliminar_filas_grupo_ceco(data0)
-else:
-    st.error("data0 no es un DataFrame antes de eliminar filas con valores específicos en 'Grupo_Ceco'")
-
-# Filtrar filas sin Proceso y Recinto completos
-data0_incomplete = data0[(data0['Proceso'].isna()) & (data0['Recinto'].isna())].copy()
-
-# Convertir columnas a string
-data0_incomplete['Centro de coste'] = data0_incomplete['Centro de coste'].astype(str)
-base_ceco_data['Ceco'] = base_ceco_data['Ceco'].astype(str)
-base_ceco_data['Recinto'] = base_ceco_data['Recinto'].astype(str)
-base_ceco_data['Proceso'] = base_ceco_data['Proceso'].astype(str)
-
-# Verificar si data0 es un DataFrame
-if not isinstance(data0_incomplete, pd.DataFrame):
-    st.error("data0_incomplete no es un DataFrame después del mapeo ceco")
-
-# Mapeo de Proceso utilizando Base_Ceco_2.csv
-if 'Centro de coste' in data0_incomplete.columns:
-    data0_incomplete = data0_incomplete.merge(base_ceco_data[['Ceco', 'Proceso']], how='left', left_on='Centro de coste', right_on='Ceco')
-    if 'Proceso_y' in data0_incomplete.columns:
-        data0_incomplete['Proceso'] = data0_incomplete['Proceso_y']
-        data0_incomplete.drop(columns=['Proceso_y', 'Proceso_x', 'Ceco'], inplace=True)
-else:
-    st.error("No se encontraron las columnas necesarias para el mapeo de Proceso")
-
-# Mapeo de Recinto utilizando Base_Ceco_2.csv
-if 'Centro de coste' in data0_incomplete.columns:
-    data0_incomplete = data0_incomplete.merge(base_ceco_data[['Ceco', 'Recinto']], how='left', left_on='Centro de coste', right_on='Ceco')
-    if 'Recinto_y' in data0_incomplete.columns:
-        data0_incomplete['Recinto'] = data0_incomplete['Recinto_y']
-        data0_incomplete.drop(columns=['Recinto_y', 'Recinto_x', 'Ceco'], inplace=True)
-else:
-    st.error("No se encontraron las columnas necesarias para el mapeo de Recinto")
+    # Calcular las sumas por año y mes para Gasto Real y Gasto Presupuestado
+    gasto_real, gasto_presupuestado = preparar_gasto(consulta)
 
-# Limpieza y normalización de los valores antes del merge
-data0['Centro de coste'] = data0['Centro de coste'].str.strip().str.upper()
-data0_incomplete['Centro de coste'] = data0_incomplete['Centro de coste'].str.strip().str.upper()
+    # Crear la tabla combinada
+    combined_data = tabla_gasto_vs_presupuesto(gasto_real, gasto_presupuestado)
 
-combined_data = data0.merge(
-    data0_incomplete[['Centro de coste', 'Proceso', 'Recinto', 'id']],
-    on=['Centro de coste', 'id'],
-    how='left',
-    suffixes=('', '_incomplete')
-)
+    # Ocultar la primera fila de año y ordenar las columnas
+    combined_data_display = combined_data.drop(columns=['Año']).set_index(['Mes'])
+    combined_data_display.columns.name = None  # Eliminar el nombre de las columnas
+    combined_data_display.index = combined_data_display.index.map(str)  # Convertir índice a string para visualización
 
-# Actualizar los valores de 'Proceso' y 'Recinto' en data0
-combined_data['Proceso'] = combined_data['Proceso'].combine_first(combined_data['Proceso_incomplete'])
-combined_data['Recinto'] = combined_data['Recinto'].combine_first(combined_data['Recinto_incomplete'])
-
-combined_data.drop(columns=['Proceso_incomplete', 'Recinto_incomplete'], inplace=True)
-
-# Asignar el DataFrame resultante a data0
-data0 = combined_data
-
-# Convertir todos los valores en la columna 'Proceso' a cadenas para evitar el error de ordenación
-data0['Proceso'] = data0['Proceso'].astype(str)
-data0['Recinto'] = data0['Recinto'].astype(str)
-
-# Generar el enlace de descarga para las filas procesadas
-#csv_procesed_data = convertir_a_csv(combined_data)
-
-# Agregar un botón de descarga en la aplicación
-#st.download_button(
-    #label="Descargar_procesed_data",
-    #data=csv_procesed_data,
-    #file_name='filas_procesed_data.csv',
-    #mime='text/csv',
-#)
-
-# Paso 1: Calcular el gasto total mensual por proceso, excluyendo "Overhead"
-gasto_mensual_proceso = data0[data0['Proceso'] != 'Overhead'].groupby(['Ejercicio', 'Período', 'Proceso'])['Valor/mon.inf.'].sum().reset_index()
-
-# Paso 2: Calcular el gasto total mensual excluyendo "Overhead"
-gasto_mensual_total_sin_overhead = gasto_mensual_proceso.groupby(['Ejercicio', 'Período'])['Valor/mon.inf.'].sum().reset_index()
-gasto_mensual_total_sin_overhead = gasto_mensual_total_sin_overhead.rename(columns={'Valor/mon.inf.': 'Total_sin_overhead'})
-
-# Paso 3: Calcular las proporciones de cada proceso con respecto al gasto total mensual excluyendo "Overhead"
-gasto_mensual_proceso = gasto_mensual_proceso.merge(gasto_mensual_total_sin_overhead, on=['Ejercicio', 'Período'])
-gasto_mensual_proceso['Proporción'] = gasto_mensual_proceso['Valor/mon.inf.'] / gasto_mensual_proceso['Total_sin_overhead']
-
-# Paso 4: Filtrar solo los datos de "Overhead"
-gasto_overhead = data0[data0['Proceso'] == 'Overhead'].groupby(['Ejercicio', 'Período'])['Valor/mon.inf.'].sum().reset_index()
-
-# Paso 5: Crear nuevas filas para cada proceso con el monto redistribuido de "Overhead"
-filas_nuevas = []
-
-for _, overhead_row in gasto_overhead.iterrows():
-    ejercicio = overhead_row['Ejercicio']
-    periodo = overhead_row['Período']
-    overhead_valor = overhead_row['Valor/mon.inf.']
-    
-    # Obtener las proporciones de los otros procesos en el mismo período
-    proporciones_procesos = gasto_mensual_proceso[(gasto_mensual_proceso['Ejercicio'] == ejercicio) & 
-                                                  (gasto_mensual_proceso['Período'] == periodo)]
-    
-    for _, proc_row in proporciones_procesos.iterrows():
-        nueva_fila = {
-            'Ejercicio': ejercicio,
-            'Período': periodo,
-            'Proceso': proc_row['Proceso'],
-            'Valor/mon.inf.': overhead_valor * proc_row['Proporción']
-        }
-        filas_nuevas.append(nueva_fila)
-
-# Convertir la lista de nuevas filas a un DataFrame
-filas_nuevas_df = pd.DataFrame(filas_nuevas)
-
-# Paso 6: Agregar las nuevas filas al DataFrame original
-data0 = pd.concat([data0, filas_nuevas_df], ignore_index=True)
-
-# Paso 7: Eliminar las filas correspondientes a "Overhead"
-data0 = data0[data0['Proceso'] != 'Overhead']
-
-# Convertir la columna 'Familia_Cuenta' y 'Recinto' a tipo string
-data0['Familia_Cuenta'] = data0['Familia_Cuenta'].astype(str)
-data0['Recinto'] = data0['Recinto'].astype(str)
+    # Esta tabla necesita las filas de detalle, así que aplica los filtros sobre data0
+    if MOTOR_DUCKDB:
+        top_5_gastos_display = top_5_gastos_duckdb(datos['parquet'], *filtros)
+    else:
+        top_5_gastos_display = top_5_gastos(datos['data0'], *filtros)
+
+    # Gráfico de Líneas para Gasto Acumulado
+    fig_acumulado = go.Figure()
+    fig_acumulado.add_trace(go.Scatter(x=combined_data['Mes'], y=combined_data['Valor/mon.inf.'].cumsum(), mode='lines+markers', name='Gasto Acumulado Real'))
+    fig_acumulado.add_trace(go.Scatter(x=combined_data['Mes'], y=combined_data['Presupuesto'].cumsum(), mode='lines+markers', name='Gasto Acumulado Presupuestado'))
+    fig_acumulado.update_layout(title='Evolución del Gasto Acumulado Real vs Presupuestado', xaxis_title='Mes', yaxis_title='Gasto Acumulado (Millones)')
+
+    # Gráfico de Columnas Apiladas con Presupuesto: preparar los datos
+    data0_grouped = consulta['gasto_por_tipo_orden'].rename(columns={'Período': 'Mes', 'gasto': 'Valor/mon.inf.'})
+    data0_grouped['Mes'] = data0_grouped['Mes'].astype(int)
+    data0_pivot = data0_grouped.pivot(index='Mes', columns='Clase de orden', values='Valor/mon.inf.').fillna(0)
+
+    # Agregar la columna de presupuesto y multiplicar por 1,000,000
+    data0_pivot['Presupuesto'] = combined_data.set_index('Mes')['Presupuesto'] * 1000000
+
+    fig_columnas = go.Figure()
+
+    # Añadir las columnas apiladas por tipo de orden
+    for column in data0_pivot.columns:
+        if column != 'Presupuesto':
+            fig_columnas.add_trace(go.Bar(x=data0_pivot.index, y=data0_pivot[column], name=column))
+
+    # Añadir la línea de presupuesto
+    fig_columnas.add_trace(go.Scatter(x=data0_pivot.index, y=data0_pivot['Presupuesto'], mode='lines+markers', name='Presupuesto', line=dict(color='grey', width=2, dash='dash')))
+
+    fig_columnas.update_layout(barmode='stack', title='Gasto Real por Tipo de Orden vs Presupuesto', xaxis_title='Mes', yaxis_title='Gasto', legend_title='Tipo de Orden')
+
+    return {
+        'gasto_vs_presupuesto': combined_data_display.T,
+        'acumulado': gasto_acumulado(gasto_real, gasto_presupuestado),
+        'top_5_gastos': top_5_gastos_display,
+        'gasto_con_ot': consulta['gasto_con_ot'],
+        'gasto_sin_ot': consulta['gasto_sin_ot'],
+        'tipos_orden': tabla_tipos_orden(consulta),
+        'fig_acumulado': fig_acumulado.to_json(),
+        'fig_columnas': fig_columnas.to_json(),
+    }
+
+# Colores del mapa de cumplimiento, en el orden de su código en el mapa
+COLORES_CUMPLIMIENTO = ['green', 'yellow', 'red', 'grey']
+
+# Función para calcular el cumplimiento del presupuesto de todas las
+# combinaciones de Proceso y Recinto (y de Clase de coste si `por_clase`) con el
+# año, la familia de cuenta y la clase de coste seleccionados, en una sola
+# consulta agrupada, y el mapa de calor que lo muestra. Como `calcular_vista`,
+# el resultado se comparte a través de la caché de vistas.
+def calcular_cumplimiento(datos, filtros, por_clase):
+    opcion_año, _, opcion_fam_cuenta, opcion_clase_coste, _ = filtros
+    filtros_grupo = (opcion_año, 'Todos', opcion_fam_cuenta, opcion_clase_coste, 'Todos')
+    dimensiones = ['Proceso', 'Recinto'] + (['Clase de coste'] if por_clase else [])
+    if MOTOR_DUCKDB:
+        consulta = consultar_duckdb_por_grupo(datos['parquet'], *filtros_grupo, dimensiones)
+    else:
+        consulta = consultar_cubo_por_grupo(datos['cubo'], *filtros_grupo, dimensiones)
+    cumplimiento = cumplimiento_por_grupo(consulta, dimensiones)
+
+    # Sin gasto real en la selección no hay celdas que mostrar
+    if cumplimiento.empty:
+        return {'tabla': cumplimiento, 'fig_cumplimiento': None}
+
+    # Una fila del mapa por Proceso (y Clase de coste) y una columna por Recinto
+    cumplimiento['Fila'] = cumplimiento['Proceso'].astype(str)
+    if por_clase:
+        cumplimiento['Fila'] = cumplimiento['Fila'] + ' / ' + cumplimiento['Clase de coste'].astype(str)
+    cumplimiento['Columna'] = cumplimiento['Recinto'].astype(str)
+    cumplimiento['Código'] = cumplimiento['color'].map(COLORES_CUMPLIMIENTO.index)
+    cumplimiento['Texto'] = cumplimiento['porcentaje'].map('{:.0f}%'.format).where(cumplimiento['porcentaje'].notna(), 's/p')
+    cumplimiento['Detalle'] = (
+        'Real $' + cumplimiento['real'].map('{:.1f}M'.format)
+        + '<br>Presupuestado ' + cumplimiento['presupuestado'].map('${:.1f}M'.format).where(cumplimiento['presupuestado'].notna(), 'No disponible')
+    )
+    mapa = cumplimiento.pivot(index='Fila', columns='Columna', values=['Código', 'Texto', 'Detalle'])
+
+    # Escala discreta: cada código ocupa una franja del mismo color
+    escala = []
+    for codigo, color in enumerate(COLORES_CUMPLIMIENTO):
+        escala += [[codigo / len(COLORES_CUMPLIMIENTO), color], [(codigo + 1) / len(COLORES_CUMPLIMIENTO), color]]
+
+    fig_cumplimiento = go.Figure(go.Heatmap(
+        z=mapa['Código'].to_numpy(dtype=float),
+        x=list(mapa['Código'].columns),
+        y=list(mapa.index),
+        text=mapa['Texto'].fillna('').to_numpy(),
+        texttemplate='%{text}',
+        hovertext=mapa['Detalle'].fillna('').to_numpy(),
+        hovertemplate='%{y} · %{x}<br>%{hovertext}<extra></extra>',
+        colorscale=escala,
+        zmin=-0.5,
+        zmax=len(COLORES_CUMPLIMIENTO) - 0.5,
+        showscale=False,
+        xgap=1,
+        ygap=1,
+    ))
+    fig_cumplimiento.update_layout(
+        title='Gasto Acumulado Real vs Presupuestado (%)',
+        xaxis_title='Recinto',
+        yaxis_title='Proceso / Clase de coste' if por_clase else 'Proceso',
+        yaxis_autorange='reversed',
+        height=max(400, 30 * len(mapa) + 150),
+    )
+
+    return {
+        'tabla': cumplimiento,
+        'fig_cumplimiento': fig_cumplimiento.to_json(),
+    }
+
+# Cargar y procesar los datos
+URLS = tuple(RUTAS[nombre] for nombre in ARCHIVOS)
+if ACTUALIZAR:
+    # La versión se lee una sola vez, así toda la ejecución usa el mismo conjunto
+    # aunque el actualizador publique otro mientras tanto
+    with etapa(registro, 'version_actualizada') as medida:
+        with st.spinner("Procesando datos..."):
+            version_datos = actualizador(URLS).actual()
+        huella = version_datos['huella']
+        datos = vista_compartida(version_datos['datos'])
+        medida['filas_salida'] = datos['filas']
+    st.caption(f"Datos versión {version_datos['version']} ({huella[:12]}), actualizados el {version_datos['actualizado'].replace('T', ' ')}")
+    error_actualizacion = actualizador(URLS).error
+    if error_actualizacion:
+        st.warning(f"No se pudieron actualizar los datos ({error_actualizacion['mensaje']}); se muestra la versión {version_datos['version']}")
+elif MOTOR_DUCKDB:
+    with etapa(registro, 'construir_datos_parquet') as medida:
+        huella, datos = construir_datos_parquet(URLS)
+        datos = vista_compartida(datos)
+        medida['filas_salida'] = datos['filas']
+else:
+    with etapa(registro, 'load_data') as medida:
+        medida['filas_salida'] = sum(len(data) for data in load_data(URLS))
+    with etapa(registro, 'huella_fuentes'):
+        huella = huella_fuentes(URLS)
+    with etapa(registro, 'construir_datos_procesados') as medida:
+        datos = vista_compartida(construir_datos_procesados(huella, URLS))
+        medida['filas_salida'] = datos['filas']
+
+for aviso in datos['avisos']:
+    st.warning(aviso)
+
+opciones = datos['opciones']
+
+# Función para generar, al pulsar el botón de descarga, el archivo con las filas
+# de `tabla` ('data0' o 'removed_data') que cumplen los filtros. Se escribe por
+# bloques en un archivo temporal en lugar de armar el texto completo en memoria;
+# solo se lee el archivo final, ya comprimido si el formato lo indica.
+def generar_descarga(datos, tabla, formato, filtros):
+    def escribir(ruta):
+        if MOTOR_DUCKDB:
+            exportar_duckdb(datos['parquet'], {'data0': 'gasto', 'removed_data': 'eliminado'}[tabla], ruta, formato, filtros)
+        else:
+            exportar_filas(datos[tabla], ruta, formato, filtros)
+
+    def generar():
+        with archivo_exportado(escribir, FORMATOS[formato][0]) as archivo:
+            return archivo.read()
+    return generar
 
 # Filtros Laterales
 with st.sidebar:
     st.header("Parámetros")
-    opcion_año = st.selectbox('Año', ['2024'] + sorted(data0['Ejercicio'].unique()))
-
-    opciones_proceso = ['Todos'] + [proceso for proceso in sorted(data0['Proceso'].unique()) if proceso != 'Overhead']
-    opcion_proceso = st.selectbox('Proceso', opciones_proceso)
-
-    # Lista fija de opciones para 'Familia_Cuenta'
-    opciones_fam_cuenta = ['Todos', 'Servicios', 'Materiales']
-    opcion_fam_cuenta = st.selectbox('Familia_Cuenta', opciones_fam_cuenta)
-
-    # Eliminar NaN y convertir a string para 'Clase de coste'
-    opciones_clase_coste = ['Todos'] + sorted([cc for cc in data0['Clase de coste'].unique() if pd.notna(cc)])
-    opcion_clase_coste = st.selectbox('Clase de coste', opciones_clase_coste)
-
-    # Eliminar NaN y 'Overhead' para 'Recinto'
-    opciones_recinto = ['Todos'] + sorted([recinto for recinto in data0['Recinto'].unique() if pd.notna(recinto) and recinto != 'Overhead'])
-    opcion_recinto = st.selectbox('Recinto', opciones_recinto)
-
-# Aplicar filtros seleccionados a los DataFrames
-def aplicar_filtros(data, opcion_año, opcion_proceso, opcion_fam_cuenta, opcion_clase_coste, opcion_recinto, col_año):
-    if opcion_año != 'Todos':
-        data = data[data[col_año] == opcion_año]
-    if opcion_proceso != 'Todos':
-        data = data[data['Proceso'] == opcion_proceso]
-    if opcion_fam_cuenta != 'Todos':
-        data = data[data['Familia_Cuenta'] == opcion_fam_cuenta]
-    if opcion_clase_coste != 'Todos':
-        data = data[data['Clase de coste'] == opcion_clase_coste]
-    if opcion_recinto != 'Todos':
-        data = data[data['Recinto'] == opcion_recinto]
-    return data
-
-data0 = aplicar_filtros(data0, opcion_año, opcion_proceso, opcion_fam_cuenta, opcion_clase_coste, opcion_recinto, 'Ejercicio')
-budget_data = aplicar_filtros(budget_data, opcion_año, opcion_proceso, opcion_fam_cuenta, opcion_clase_coste, opcion_recinto, 'Año')
-
-# Calcular las sumas por año y mes para Gasto Real y Gasto Presupuestado
-gasto_real = data0.groupby(['Ejercicio', 'Período'])['Valor/mon.inf.'].sum().reset_index()
-gasto_real['Valor/mon.inf.'] = (gasto_real['Valor/mon.inf.'] / 1000000).round(1)  # Convertir a millones con un decimal
-gasto_real = gasto_real.rename(columns={'Ejercicio': 'Año', 'Período': 'Mes'})
-
-gasto_presupuestado = budget_data.groupby(['Año', 'Mes'])['Presupuesto'].sum().reset_index()
-gasto_presupuestado['Presupuesto'] = gasto_presupuestado['Presupuesto'].round(1)
-
-# Asegurarse de que las columnas son del mismo tipo
-gasto_real['Año'] = gasto_real['Año'].astype(str)
-gasto_real['Mes'] = gasto_real['Mes'].astype(int)  # Convertir a entero para orden correcto
-gasto_presupuestado['Año'] = gasto_presupuestado['Año'].astype(str)
-gasto_presupuestado['Mes'] = gasto_presupuestado['Mes'].astype(int)  # Convertir a entero para orden correcto
-
-# Crear la tabla combinada
-combined_data = pd.merge(gasto_real, gasto_presupuestado, on=['Año', 'Mes'], how='outer').fillna(0)
-
-combined_data['Diferencia'] = combined_data['Valor/mon.inf.'] - combined_data['Presupuesto']
-
-# Ordenar las columnas de manera ascendente
-combined_data = combined_data.sort_values(by=['Año', 'Mes'])
+    opcion_año = st.selectbox('Año', opciones['Año'])
 
-# Tabla combinada
-st.markdown("#### Tabla de Gasto Real vs Presupuestado")
+    opcion_proceso = st.selectbox('Proceso', opciones['Proceso'])
 
-# Ocultar la primera fila de año y ordenar las columnas
-combined_data_display = combined_data.drop(columns=['Año']).set_index(['Mes'])
-combined_data_display.columns.name = None  # Eliminar el nombre de las columnas
-combined_data_display.index = combined_data_display.index.map(str)  # Convertir índice a string para visualización
-st.dataframe(combined_data_display.T)
+    opcion_fam_cuenta = st.selectbox('Familia_Cuenta', OPCIONES_FAM_CUENTA)
 
-# Nueva sección: Widgets de Gasto Acumulado
-st.markdown("#### Gasto Acumulado")
+    opcion_clase_coste = st.selectbox('Clase de coste', opciones['Clase de coste'])
 
-# Calcular el gasto acumulado real
-ultimo_mes_real = gasto_real['Mes'].max()
-gasto_acumulado_real = gasto_real[gasto_real['Mes'] <= ultimo_mes_real]['Valor/mon.inf.'].sum()
+    opcion_recinto = st.selectbox('Recinto', opciones['Recinto'])
 
-# Verificar si hay datos presupuestados antes de calcular el gasto acumulado presupuestado
-if not gasto_presupuestado[gasto_presupuestado['Mes'] <= ultimo_mes_real].empty:
-    gasto_acumulado_presupuestado = gasto_presupuestado[gasto_presupuestado['Mes'] <= ultimo_mes_real]['Presupuesto'].sum()
-else:
-    gasto_acumulado_presupuestado = None
-
-# Aplicar lógica de colores
-if gasto_acumulado_presupuestado is not None and gasto_acumulado_presupuestado != 0:
-    diferencia_porcentaje = (gasto_acumulado_real / gasto_acumulado_presupuestado) * 100
-
-    if diferencia_porcentaje <= 100:
-        color_real = 'background-color: green;'
-        color_presupuesto = 'background-color: green;'
-    elif 100 < diferencia_porcentaje <= 110:
-        color_real = 'background-color: yellow;'
-        color_presupuesto = 'background-color: yellow;'
-    else:
-        color_real = 'background-color: red;'
-        color_presupuesto = 'background-color: red;'
-else:
-    color_real = 'background-color: grey;'
-    color_presupuesto = 'background-color: grey;'
-
-# Mostrar los widgets alineados horizontalmente
-col1, col2 = st.columns(2)
-
-col1.markdown(f"<div style='{color_real} padding: 10px; border-radius: 5px; text-align: center;'>Gasto acumulado real<br><strong>${gasto_acumulado_real:.1f}M</strong></div>", unsafe_allow_html=True)
-if gasto_acumulado_presupuestado is not None:
-    col2.markdown(f"<div style='{color_presupuesto} padding: 10px; border-radius: 5px; text-align: center;'>Gasto acumulado presupuestado<br><strong>${gasto_acumulado_presupuestado:.1f}M</strong></div>", unsafe_allow_html=True)
-else:
-    col2.markdown(f"<div style='{color_presupuesto} padding: 10px; border-radius: 5px; text-align: center;'>Gasto acumulado presupuestado<br><strong>No disponible</strong></div>", unsafe_allow_html=True)
-
-# Nueva sección: Tabla de los 5 mayores gastos
-st.markdown("#### Top 5 Mayores Gastos")
+    filtros = (opcion_año, opcion_proceso, opcion_fam_cuenta, opcion_clase_coste, opcion_recinto)
 
-# Filtrar filas con 'Centro de coste' no vacío
-data0_filtered = data0[data0['Centro de coste'].notna() & (data0['Centro de coste'] != '')]
+    # Descarga de las filas procesadas y de las eliminadas como pares opuestos,
+    # con los filtros seleccionados; el archivo se genera solo al pulsar el botón
+    st.header("Descargas")
+    formato_descarga = st.selectbox('Formato', list(FORMATOS))
+    for tabla, nombre in EXPORTACIONES.items():
+        st.download_button(
+            label=f"Descargar {nombre.replace('_', ' ')}",
+            data=generar_descarga(datos, tabla, formato_descarga, filtros),
+            file_name=nombre + FORMATOS[formato_descarga][0],
+            mime=FORMATOS[formato_descarga][1],
+            on_click='ignore',
+        )
 
-# Filtrar y ordenar data0 para obtener los 5 mayores gastos
-data0_sorted = data0_filtered.sort_values(by='Valor/mon.inf.', ascending=False)
-top_5_gastos = data0_sorted.head(5)
+    # Sección opcional de diagnóstico; se completa al final de la página
+    mostrar_diagnostico = st.checkbox("Diagnóstico")
+    panel_diagnostico = st.container()
 
-# Seleccionar columnas específicas para mostrar
-top_5_gastos_display = top_5_gastos[['Centro de coste', 'Denominación del objeto', 'Grupo_Ceco', 'Fe.contabilización', 'Valor/mon.inf.']]
+# Obtener los totales, tablas y gráficos de la selección desde la caché de
+# vistas o calcularlos
+with etapa(registro, 'calcular_vista') as medida:
+    vista, acierto = cache_vistas().obtener((huella, filtros), lambda: calcular_vista(datos, filtros))
+    medida['cache'] = 'acierto' if acierto else 'fallo'
 
-# Mostrar la tabla en la aplicación Streamlit
-st.dataframe(top_5_gastos_display)
+# Tabla combinada
+with etapa(registro, 'Tabla de Gasto Real vs Presupuestado'):
+    st.markdown("#### Tabla de Gasto Real vs Presupuestado")
+    st.dataframe(vista['gasto_vs_presupuesto'])
 
-# Nueva sección: Widgets de Gasto con y sin OT
-st.markdown("#### Gasto con y sin OT")
+# Nueva sección: Widgets de Gasto Acumulado
+with etapa(registro, 'Gasto Acumulado'):
+    st.markdown("#### Gasto Acumulado")
+
+    # Gasto acumulado real y presupuestado y su color
+    acumulado = vista['acumulado']
+    gasto_acumulado_real = acumulado['real']
+    gasto_acumulado_presupuestado = acumulado['presupuestado']
+    color_real = f"background-color: {acumulado['color']};"
+    color_presupuesto = f"background-color: {acumulado['color']};"
+
+    # Mostrar los widgets alineados horizontalmente
+    col1, col2 = st.columns(2)
+
+    col1.markdown(f"<div style='{color_real} padding: 10px; border-radius: 5px; text-align: center;'>Gasto acumulado real<br><strong>${gasto_acumulado_real:.1f}M</strong></div>", unsafe_allow_html=True)
+    if gasto_acumulado_presupuestado is not None:
+        col2.markdown(f"<div style='{color_presupuesto} padding: 10px; border-radius: 5px; text-align: center;'>Gasto acumulado presupuestado<br><strong>${gasto_acumulado_presupuestado:.1f}M</strong></div>", unsafe_allow_html=True)
+    else:
+        col2.markdown(f"<div style='{color_presupuesto} padding: 10px; border-radius: 5px; text-align: center;'>Gasto acumulado presupuestado<br><strong>No disponible</strong></div>", unsafe_allow_html=True)
+
+# Nueva sección: Mapa de cumplimiento de todas las combinaciones de Proceso y
+# Recinto, con el detalle de la celda seleccionada
+with etapa(registro, 'Cumplimiento por Proceso y Recinto') as medida:
+    st.markdown("#### Cumplimiento por Proceso y Recinto")
+
+    por_clase = st.checkbox("Separar por Clase de coste")
+    clave_cumplimiento = (huella, 'cumplimiento', opcion_año, opcion_fam_cuenta, opcion_clase_coste, por_clase)
+    cumplimiento, acierto = cache_vistas().obtener(clave_cumplimiento, lambda: calcular_cumplimiento(datos, filtros, por_clase))
+    medida['cache'] = 'acierto' if acierto else 'fallo'
+    tabla_cumplimiento = cumplimiento['tabla']
+    medida['filas_salida'] = len(tabla_cumplimiento)
+
+    if tabla_cumplimiento.empty:
+        st.info("No hay gasto real para el año, la familia de cuenta y la clase de coste seleccionados")
+    else:
+        evento = st.plotly_chart(pio.from_json(cumplimiento['fig_cumplimiento']), on_select='rerun', selection_mode='points', key='mapa_cumplimiento')
 
-# Calcular gasto con OT
-gasto_con_ot = data0[data0['Orden partner'].notna()]['Valor/mon.inf.'].sum()
+        # La celda del detalle se elige con un clic en el mapa o en la lista
+        celdas = list(tabla_cumplimiento['Fila'] + ' · ' + tabla_cumplimiento['Columna'])
+        seleccion = [f"{punto['y']} · {punto['x']}" for punto in evento.selection.points]
+        indice = celdas.index(seleccion[0]) if seleccion and seleccion[0] in celdas else None
+        celda = st.selectbox('Detalle', celdas, index=indice, placeholder='Seleccione una celda del mapa')
 
-# Calcular gasto sin OT
-gasto_sin_ot = data0[data0['Orden partner'].isna()]['Valor/mon.inf.'].sum()
+        if celda is not None:
+            fila = tabla_cumplimiento.iloc[celdas.index(celda)]
+            filtros_celda = (opcion_año, fila['Proceso'], opcion_fam_cuenta, fila['Clase de coste'] if por_clase else opcion_clase_coste, fila['Recinto'])
+            vista_celda, _ = cache_vistas().obtener((huella, filtros_celda), lambda: calcular_vista(datos, filtros_celda))
+            st.dataframe(vista_celda['gasto_vs_presupuesto'])
 
-# Mostrar los widgets alineados horizontalmente
-col1, col2 = st.columns(2)
+# Nueva sección: Tabla de los 5 mayores gastos
+with etapa(registro, 'Top 5 Mayores Gastos') as medida:
+    st.markdown("#### Top 5 Mayores Gastos")
 
-col1.markdown(f"<div style='border: 2px solid black; padding: 10px; border-radius: 5px; text-align: center;'>Gasto con OT<br><strong>${gasto_con_ot:,.0f}M</strong></div>", unsafe_allow_html=True)
-col2.markdown(f"<div style='border: 2px solid black; padding: 10px; border-radius: 5px; text-align: center;'>Gasto sin OT<br><strong>${gasto_sin_ot:,.0f}M</strong></div>", unsafe_allow_html=True)
+    top_5_gastos_display = vista['top_5_gastos']
+    medida['filas_salida'] = len(top_5_gastos_display)
 
-# Nueva sección: Tabla de Tipos de Orden
-st.markdown("### Tipos de Orden")
+    # Mostrar la tabla en la aplicación Streamlit
+    st.dataframe(top_5_gastos_display)
 
-# Unir data0 con orders_data para obtener el tipo de orden
-data0 = data0.merge(orders_data, how='left', left_on='Orden partner', right_on='Orden')
+# Nueva sección: Widgets de Gasto con y sin OT
+with etapa(registro, 'Gasto con y sin OT'):
+    st.markdown("#### Gasto con y sin OT")
 
-# Calcular las métricas para cada tipo de orden
-tipo_orden_metrics = data0.groupby('Clase de orden').agg(
-    cantidad_ordenes=pd.NamedAgg(column='Orden partner', aggfunc='count'),
-    gasto=pd.NamedAgg(column='Valor/mon.inf.', aggfunc='sum')
-).reset_index()
+    # Gasto con y sin OT
+    gasto_con_ot = vista['gasto_con_ot']
+    gasto_sin_ot = vista['gasto_sin_ot']
 
-# Calcular el valor OT medio
-tipo_orden_metrics['valor_ot_media'] = tipo_orden_metrics['gasto'] / tipo_orden_metrics['cantidad_ordenes']
+    # Mostrar los widgets alineados horizontalmente
+    col1, col2 = st.columns(2)
 
-# Seleccionar columnas específicas para mostrar
-tipo_orden_metrics_display = tipo_orden_metrics[['Clase de orden', 'cantidad_ordenes', 'gasto', 'valor_ot_media']]
+    col1.markdown(f"<div style='border: 2px solid black; padding: 10px; border-radius: 5px; text-align: center;'>Gasto con OT<br><strong>${gasto_con_ot:,.0f}M</strong></div>", unsafe_allow_html=True)
+    col2.markdown(f"<div style='border: 2px solid black; padding: 10px; border-radius: 5px; text-align: center;'>Gasto sin OT<br><strong>${gasto_sin_ot:,.0f}M</strong></div>", unsafe_allow_html=True)
 
-# Renombrar las columnas para la visualización
-tipo_orden_metrics_display.columns = ['Tipo de orden', 'Cantidad de ordenes', 'Gasto', 'Valor OT media']
+# Nueva sección: Tabla de Tipos de Orden
+with etapa(registro, 'Tipos de Orden'):
+    st.markdown("### Tipos de Orden")
 
-# Redondear valor_ot_media a 0 decimales
-tipo_orden_metrics_display['Valor OT media'] = tipo_orden_metrics_display['Valor OT media'].round(0).astype(int)
+    # Métricas de cada tipo de orden
+    tipo_orden_metrics_display = vista['tipos_orden']
 
-# Mostrar la tabla en la aplicación Streamlit
-st.dataframe(tipo_orden_metrics_display)
+    # Mostrar la tabla en la aplicación Streamlit
+    st.dataframe(tipo_orden_metrics_display)
 
 # Gráfico de Líneas para Gasto Acumulado
-st.markdown("### Gráfico de Gasto Acumulado")
+with etapa(registro, 'Gráfico de Gasto Acumulado'):
+    st.markdown("### Gráfico de Gasto Acumulado")
 
-fig_acumulado = go.Figure()
-fig_acumulado.add_trace(go.Scatter(x=combined_data['Mes'], y=combined_data['Valor/mon.inf.'].cumsum(), mode='lines+markers', name='Gasto Acumulado Real'))
-fig_acumulado.add_trace(go.Scatter(x=combined_data['Mes'], y=combined_data['Presupuesto'].cumsum(), mode='lines+markers', name='Gasto Acumulado Presupuestado'))
-fig_acumulado.update_layout(title='Evolución del Gasto Acumulado Real vs Presupuestado', xaxis_title='Mes', yaxis_title='Gasto Acumulado (Millones)')
-st.plotly_chart(fig_acumulado)
+    st.plotly_chart(pio.from_json(vista['fig_acumulado']))
 
 # Gráfico de Columnas Apiladas con Presupuesto
-st.markdown("### Gráfico de Gasto Real por Tipo de Orden y Presupuesto")
-
-# Preparar los datos para el gráfico de columnas apiladas
-data0['Mes'] = data0['Período'].astype(int)
-data0_grouped = data0.groupby(['Mes', 'Clase de orden'])['Valor/mon.inf.'].sum().reset_index()
-data0_pivot = data0_grouped.pivot(index='Mes', columns='Clase de orden', values='Valor/mon.inf.').fillna(0)
-
-# Agregar la columna de presupuesto y multiplicar por 1,000,000
-data0_pivot['Presupuesto'] = combined_data.set_index('Mes')['Presupuesto'] * 1000000
-
-fig_columnas = go.Figure()
-
-# Añadir las columnas apiladas por tipo de orden
-for column in data0_pivot.columns:
-    if column != 'Presupuesto':
-        fig_columnas.add_trace(go.Bar(x=data0_pivot.index, y=data0_pivot[column], name=column))
-
-# Añadir la línea de presupuesto
-fig_columnas.add_trace(go.Scatter(x=data0_pivot.index, y=data0_pivot['Presupuesto'], mode='lines+markers', name='Presupuesto', line=dict(color='grey', width=2, dash='dash')))
-
-fig_columnas.update_layout(barmode='stack', title='Gasto Real por Tipo de Orden vs Presupuesto', xaxis_title='Mes', yaxis_title='Gasto', legend_title='Tipo de Orden')
-st.plotly_chart(fig_columnas)
+with etapa(registro, 'Gráfico de Gasto Real por Tipo de Orden'):
+    st.markdown("### Gráfico de Gasto Real por Tipo de Orden y Presupuesto")
+
+    st.plotly_chart(pio.from_json(vista['fig_columnas']))
+
+# Registrar las etapas de esta ejecución y mostrar el diagnóstico si se pidió
+registrar_log(registro, DIAGNOSTICO_LOG, ambito='pagina', huella=huella)
+if mostrar_diagnostico:
+    with panel_diagnostico:
+        st.markdown("**Esta ejecución**")
+        st.dataframe(tabla_registro(registro))
+
+        st.markdown("**Último procesamiento de los datos**")
+        st.dataframe(tabla_registro(datos['diagnostico']))
+
+        # Uso de la caché de tablas y gráficos por selección de filtros
+        st.markdown("**Caché de vistas**")
+        metricas = cache_vistas().metricas()
+        metricas['MB'] = round(metricas.pop('bytes') / 1024 ** 2, 2)
+        st.dataframe(pd.DataFrame([metricas]))
+
+        # Versión publicada y revisiones del actualizador en segundo plano
+        if ACTUALIZAR:
+            st.markdown("**Actualización en segundo plano**")
+            st.dataframe(pd.DataFrame([actualizador(URLS).estado()]))
+
+        # Tamaño en memoria de los datos en cada etapa del procesamiento
+        st.markdown("**Memoria por etapa**")
+        memoria = pd.DataFrame.from_dict(datos['memoria'], orient='index')
+        memoria['MB'] = (memoria.pop('bytes') / 1024 ** 2).round(2)
+        st.dataframe(memoria)
+
+        st.download_button(
+            label="Descargar diagnóstico (JSON)",
+            data=exportar_json(registro, huella=huella, procesamiento=datos['diagnostico']),
+            file_name='diagnostico.json',
+            mime='application/json',
+        )
@@ -0,0 +1,225 @@
+import argparse
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+from fuentes import ARCHIVOS, cargar_fuentes, rutas_fuentes, validar_esquema
+from procesamiento import huella_datos
+from reportes import construir_datos
+
+logger = logging.getLogger(__name__)
+
+# Segundos entre revisiones de los archivos locales cuando se vigilan cambios
+ESPERA_ARCHIVOS = 2
+
+
+# Función para obtener la firma (tamaño y fecha de modificación) de los
+# archivos locales de `rutas`. Un archivo que no existe tiene firma None.
+def firma_archivos(rutas):
+    firma = []
+    for ruta in rutas:
+        try:
+            estado = os.stat(ruta)
+            firma.append((ruta, estado.st_size, estado.st_mtime_ns))
+        except OSError:
+            firma.append((ruta, None, None))
+    return tuple(firma)
+
+
+# Actualizador de los datos procesados en un hilo en segundo plano
+#
+# `cargar()` devuelve las cinco tablas de origen, en el orden de ARCHIVOS, y
+# `construir(fuentes, huella)` el conjunto de datos procesado. Cada `cada`
+# segundos, o con `rutas` cuando cambia alguno de esos archivos locales, se
+# vuelven a cargar las tablas; si su huella es distinta de la publicada, se
+# validan con `validar_esquema`, se procesan en el mismo hilo y la versión nueva
+# reemplaza a la anterior con una sola asignación. Quien lee la versión actual
+# recibe siempre un conjunto completo, y cada cambio de datos se procesa una
+# sola vez por proceso. Si la carga o el procesamiento fallan se mantiene la
+# versión anterior y el error queda en `estado()`.
+class Actualizador:
+    def __init__(self, cargar, construir, cada=None, rutas=None, espera=ESPERA_ARCHIVOS):
+        if not cada and not rutas:
+            raise ValueError("Se necesita un intervalo o archivos que vigilar")
+        self.cargar = cargar
+        self.construir = construir
+        self.cada = cada
+        self.rutas = list(rutas) if rutas else None
+        self.espera = espera
+        self._actual = None
+        self._bloqueo = threading.Lock()
+        self._primera = threading.Event()
+        self._detener = threading.Event()
+        self._hilo = None
+        self.revisiones = 0
+        self.reconstrucciones = 0
+        self.error = None
+
+    # Inicia el hilo; la primera versión se construye apenas arranca
+    def iniciar(self):
+        self._hilo = threading.Thread(target=self._ejecutar, name='actualizador-datos', daemon=True)
+        self._hilo.start()
+        return self
+
+    # Detiene el hilo al terminar la revisión en curso
+    def detener(self):
+        self._detener.set()
+        if self._hilo is not None:
+            self._hilo.join()
+
+    # Devuelve la versión publicada: un diccionario con 'version', 'huella',
+    # 'datos', 'actualizado' y 'segundos'. Espera a la primera versión.
+    def actual(self, tiempo_espera=None):
+        self._primera.wait(tiempo_espera)
+        actual = self._actual
+        if actual is None:
+            raise RuntimeError(f"No se pudieron cargar los datos: {self.error['mensaje'] if self.error else 'sin versión'}")
+        return actual
+
+    # Carga las tablas y, si cambiaron, construye y publica una versión nueva.
+    # Devuelve True si se publicó una versión.
+    def actualizar(self):
+        with self._bloqueo:
+            fuentes = self.cargar()
+            for nombre, data in zip(ARCHIVOS, fuentes):
+                validar_esquema(nombre, data)
+            huella = huella_datos(*fuentes)
+            anterior = self._actual
+            if anterior is not None and anterior['huella'] == huella:
+                return False
+
+            inicio = time.perf_counter()
+            datos = self.construir(fuentes, huella)
+            self._actual = {
+                'version': anterior['version'] + 1 if anterior else 1,
+                'huella': huella,
+                'datos': datos,
+                'actualizado': datetime.now().isoformat(timespec='seconds'),
+                'segundos': round(time.perf_counter() - inicio, 3),
+            }
+            self.reconstrucciones += 1
+            logger.info("Datos actualizados a la versión %s (%s)", self._actual['version'], huella[:12])
+            return True
+
+    # Devuelve el estado del actualizador para mostrarlo en el diagnóstico
+    def estado(self):
+        actual = self._actual
+        return {
+            'version': actual['version'] if actual else None,
+            'huella': actual['huella'][:12] if actual else None,
+            'actualizado': actual['actualizado'] if actual else None,
+            'segundos': actual['segundos'] if actual else None,
+            'revisiones': self.revisiones,
+            'reconstrucciones': self.reconstrucciones,
+            'error': self.error['mensaje'] if self.error else None,
+        }
+
+    def _intentar(self):
+        try:
+            self.actualizar()
+            self.error = None
+        except Exception as error:
+            logger.exception("No se pudieron actualizar los datos")
+            self.error = {'mensaje': f"{type(error).__name__}: {error}", 'fecha': datetime.now().isoformat(timespec='seconds')}
+        finally:
+            self.revisiones += 1
+            self._primera.set()
+
+    # Con `rutas`, un cambio se procesa cuando la firma de los archivos se
+    # mantiene igual entre dos revisiones, para no leer archivos a medio copiar
+    def _ejecutar(self):
+        firma_cargada = firma_vista = firma_archivos(self.rutas) if self.rutas else None
+        self._intentar()
+        while not self._detener.wait(self.espera if self.rutas else self.cada):
+            if self.rutas:
+                firma = firma_archivos(self.rutas)
+                estable = firma == firma_vista
+                firma_vista = firma
+                if not estable or firma == firma_cargada:
+                    continue
+                firma_cargada = firma
+            self._intentar()
+
+
+# Función para comprobar el actualizador vigilando una copia de los CSV de
+# `origen`: un archivo modificado genera una sola versión nueva, una copia sin
+# cambios no genera ninguna y una tabla sin sus columnas mantiene la versión
+# anterior. Devuelve la lista de problemas.
+def verificar_actualizacion(origen, espera=0.2):
+    problemas = []
+    with tempfile.TemporaryDirectory() as temporal:
+        shutil.copytree(origen, temporal, dirs_exist_ok=True)
+        rutas = rutas_fuentes(temporal)
+        actualizador = Actualizador(
+            lambda: cargar_fuentes(rutas),
+            lambda fuentes, huella: construir_datos(fuentes),
+            rutas=rutas.values(),
+            espera=espera,
+        ).iniciar()
+
+        # Espera a que el hilo procese los archivos después de un cambio
+        def esperar_revision():
+            revisiones = actualizador.revisiones
+            limite = time.monotonic() + 60
+            while actualizador.revisiones == revisiones and time.monotonic() < limite:
+                time.sleep(espera)
+
+        def comprobar(descripcion, version, reconstrucciones, error=False):
+            estado = actualizador.estado()
+            print(f"{descripcion}: {estado}")
+            if estado['version'] != version or estado['reconstrucciones'] != reconstrucciones:
+                problemas.append(f"{descripcion}: versión {estado['version']} y {estado['reconstrucciones']} reconstrucciones en lugar de {version} y {reconstrucciones}")
+            if bool(estado['error']) != error:
+                problemas.append(f"{descripcion}: error {estado['error']!r}")
+
+        try:
+            primera = actualizador.actual(tiempo_espera=600)
+            comprobar('versión inicial', 1, 1)
+
+            # Se reescribe un archivo con el mismo contenido: se revisa pero no se reconstruye
+            ruta = rutas['orders_data']
+            with open(ruta, 'rb') as archivo:
+                contenido = archivo.read()
+            with open(ruta, 'wb') as archivo:
+                archivo.write(contenido)
+            esperar_revision()
+            comprobar('archivo sin cambios', 1, 1)
+
+            # Se agrega una orden: una sola versión nueva
+            with open(ruta, 'a', encoding='ISO-8859-1') as archivo:
+                archivo.write('OTNUEVA;U0;PM01\n')
+            esperar_revision()
+            comprobar('archivo modificado', 2, 2)
+            if actualizador.actual()['huella'] == primera['huella']:
+                problemas.append("archivo modificado: la huella no cambió")
+
+            # Falta una columna: se mantiene la versión anterior
+            ruta = rutas['base_ceco_data']
+            with open(ruta, 'w', encoding='ISO-8859-1') as archivo:
+                archivo.write('Otra;Proceso;Recinto\n')
+            esperar_revision()
+            comprobar('columna faltante', 2, 2, error=True)
+        finally:
+            actualizador.detener()
+    return problemas
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Comprueba la actualización de los datos en segundo plano con una copia de los CSV")
+    parser.add_argument('directorio', help="Directorio con los archivos CSV de origen")
+    args = parser.parse_args()
+
+    problemas = verificar_actualizacion(args.directorio)
+    for problema in problemas:
+        print(problema)
+    print("Actualización en segundo plano correcta" if not problemas else "Se encontraron problemas")
+    return 1 if problemas else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,227 @@
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from cubo import construir_cubo
+from fuentes import cargar_fuentes, rutas_fuentes, rutas_snapshot
+from particiones import procesar_particionado
+from procesamiento import (
+    aplicar_filtros,
+    completar_datos,
+    construir_indices_mapeo,
+    eliminar_pares_opuestos,
+    limpiar_gasto,
+    mapear_dimensiones,
+    medir_memoria,
+    redistribuir_overhead,
+    tipar_gasto,
+)
+from reportes import OPCIONES_FAM_CUENTA, combinaciones_filtros, generar_reporte
+from sintetico import EJERCICIOS, PROCESOS, RECINTOS, escribir_csv, escribir_parquet, generar_fuentes
+
+# Versión del formato del reporte
+VERSION_REPORTE = 1
+
+# Diferencia mínima, en segundos, para considerar una etapa más lenta que la referencia
+MINIMO_SEGUNDOS = 0.05
+
+
+# Función para ejecutar una etapa midiendo su tiempo y, si tracemalloc está
+# activo, el pico de memoria que reserva
+def _medir(etapas, nombre, funcion, *args):
+    if tracemalloc.is_tracing():
+        tracemalloc.reset_peak()
+    inicial = tracemalloc.get_traced_memory()[0]
+    inicio = time.perf_counter()
+    resultado = funcion(*args)
+    segundos = time.perf_counter() - inicio
+    pico = tracemalloc.get_traced_memory()[1] - inicial if tracemalloc.is_tracing() else None
+
+    tablas = resultado if isinstance(resultado, (tuple, list)) else [resultado]
+    tablas = [tabla for tabla in tablas if isinstance(tabla, pd.DataFrame)]
+    etapas.append(dict({'etapa': nombre, 'segundos': segundos, 'pico_bytes': pico}, **{
+        f'{clave}_resultado': valor for clave, valor in medir_memoria(*tablas).items()
+    }))
+    return resultado
+
+
+# Función para ejecutar el procesamiento completo sobre las tablas en `rutas`,
+# midiendo cada etapa por separado. `combinaciones` son los filtros con los que
+# se miden `aplicar_filtros` y las agregaciones finales. Con `procesos` mayor
+# que 1 se mide además el procesamiento completo por particiones.
+def medir_etapas(rutas, combinaciones, procesos=None):
+    etapas = []
+    fuentes = _medir(etapas, 'load_data', cargar_fuentes, rutas)
+    if procesos and procesos > 1:
+        _medir(etapas, 'procesar_particionado', procesar_particionado, *fuentes, procesos)
+    data0, budget_data, orders_data, base_utec_data, base_ceco_data = fuentes
+    data0 = data0.copy()
+    data0['id'] = range(1, len(data0) + 1)
+
+    indices = _medir(etapas, 'construir_indices_mapeo', construir_indices_mapeo, orders_data, base_utec_data, base_ceco_data)
+    mapeado, conteos = _medir(etapas, 'mapear_dimensiones', mapear_dimensiones, data0, indices)
+    tipado = _medir(etapas, 'tipar_gasto', tipar_gasto, mapeado)
+    gasto, removed_data = _medir(etapas, 'eliminar_pares_opuestos', eliminar_pares_opuestos, tipado)
+    gasto = _medir(etapas, 'limpiar_gasto', limpiar_gasto, gasto)
+    removed_data = removed_data.reset_index(drop=True)
+    filas_nuevas_df = _medir(etapas, 'redistribuir_overhead', redistribuir_overhead, gasto)
+
+    reporte = dict(conteos, duplicados=indices['duplicados'])
+    datos = _medir(etapas, 'completar_datos', completar_datos, gasto, filas_nuevas_df, removed_data, budget_data, orders_data, reporte, {})
+    cubo = _medir(etapas, 'construir_cubo', construir_cubo, datos['data0'], datos['budget_data'], datos['orders_data'])
+
+    def filtrar():
+        return [aplicar_filtros(datos['data0'], *combinacion, 'Ejercicio') for combinacion in combinaciones]
+
+    def agregar():
+        return [generar_reporte(cubo, *combinacion) for combinacion in combinaciones]
+
+    _medir(etapas, 'aplicar_filtros', filtrar)
+    _medir(etapas, 'agregaciones', agregar)
+    return etapas
+
+
+# Función para ejecutar el benchmark con datos sintéticos de cada tamaño en `filas`
+# Con `memoria=False` se omite la pasada con tracemalloc, que en los tamaños
+# grandes tarda bastante más que la de tiempos.
+def ejecutar_benchmark(filas, formato='csv', repeticiones=1, semilla=0, memoria=True, procesos=None, **parametros):
+    resultados = []
+    for cantidad in filas:
+        with tempfile.TemporaryDirectory() as directorio:
+            fuentes = generar_fuentes(cantidad, semilla=semilla, **parametros)
+            if formato == 'parquet':
+                escribir_parquet(fuentes, directorio)
+                rutas = rutas_snapshot(directorio)
+            else:
+                escribir_csv(fuentes, directorio)
+                rutas = rutas_fuentes(directorio)
+            del fuentes
+
+            # Filtros a medir: la grilla Proceso × Recinto del último año, incluyendo 'Todos'
+            opciones = {
+                'Año': [str(max(parametros.get('ejercicios', EJERCICIOS)))],
+                'Proceso': ['Todos'] + PROCESOS,
+                'Familia_Cuenta': OPCIONES_FAM_CUENTA,
+                'Clase de coste': ['Todos'],
+                'Recinto': ['Todos'] + RECINTOS,
+            }
+            combinaciones = combinaciones_filtros(opciones, {'Año': ['*'], 'Proceso': ['Todos', '*'], 'Recinto': ['Todos', '*']})
+
+            # Los tiempos se miden sin tracemalloc, que hace más lentas las
+            # etapas con muchos objetos de Python; la memoria en una pasada aparte
+            corridas = [medir_etapas(rutas, combinaciones, procesos) for _ in range(repeticiones)]
+            etapas = corridas[0]
+            if memoria:
+                tracemalloc.start()
+                try:
+                    etapas = medir_etapas(rutas, combinaciones, procesos)
+                finally:
+                    tracemalloc.stop()
+
+        # De varias repeticiones se conserva el menor tiempo
+        for etapa, *tiempos in zip(etapas, *corridas):
+            etapa['segundos'] = min(tiempo['segundos'] for tiempo in tiempos)
+
+        resultados.append({
+            'filas': cantidad,
+            'formato': formato,
+            'combinaciones': len(combinaciones),
+            'total_segundos': sum(etapa['segundos'] for etapa in etapas),
+            'etapas': etapas,
+        })
+
+    return {
+        'version': VERSION_REPORTE,
+        'fecha': datetime.now().isoformat(timespec='seconds'),
+        'entorno': {
+            'python': platform.python_version(),
+            'pandas': pd.__version__,
+            'numpy': np.__version__,
+            'plataforma': platform.platform(),
+            'cpus': os.cpu_count(),
+        },
+        'parametros': dict(parametros, repeticiones=repeticiones, semilla=semilla, procesos=procesos),
+        'resultados': resultados,
+    }
+
+
+# Función para comparar un reporte con uno de referencia. Devuelve las etapas
+# cuyo tiempo o pico de memoria supera al de referencia en más de `tolerancia`.
+def comparar_reportes(reporte, referencia, tolerancia=0.25):
+    anteriores = {
+        (resultado['filas'], resultado['formato'], etapa['etapa']): etapa
+        for resultado in referencia['resultados'] for etapa in resultado['etapas']
+    }
+    regresiones = []
+    for resultado in reporte['resultados']:
+        for etapa in resultado['etapas']:
+            anterior = anteriores.get((resultado['filas'], resultado['formato'], etapa['etapa']))
+            if anterior is None:
+                continue
+            for medida, minimo in [('segundos', MINIMO_SEGUNDOS), ('pico_bytes', 0)]:
+                if etapa[medida] is None or anterior[medida] is None:
+                    continue
+                if etapa[medida] > anterior[medida] * (1 + tolerancia) and etapa[medida] - anterior[medida] > minimo:
+                    regresiones.append({
+                        'filas': resultado['filas'],
+                        'etapa': etapa['etapa'],
+                        'medida': medida,
+                        'referencia': anterior[medida],
+                        'actual': etapa[medida],
+                    })
+    return regresiones
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mide el tiempo y la memoria de cada etapa del procesamiento con datos sintéticos")
+    parser.add_argument('--filas', type=int, nargs='+', default=[10000, 100000], help="Tamaños del gasto real a medir")
+    parser.add_argument('--formato', choices=['csv', 'parquet'], default='csv', help="Formato de los archivos que lee load_data")
+    parser.add_argument('--repeticiones', type=int, default=1)
+    parser.add_argument('--sin-memoria', action='store_true', help="No mide el pico de memoria de cada etapa")
+    parser.add_argument('--procesos', type=int, help="Mide también el procesamiento por particiones con esta cantidad de procesos")
+    parser.add_argument('--pares', type=float, default=0.1, help="Proporción de filas que forman pares opuestos")
+    parser.add_argument('--overhead', type=float, default=0.1, help="Proporción de Utec y Ceco con proceso Overhead")
+    parser.add_argument('--sin-utec', type=float, default=0.05, help="Proporción de filas con una orden que no está en la base")
+    parser.add_argument('--ceco', type=float, default=0.3, help="Proporción de filas sin orden, mapeadas por Ceco")
+    parser.add_argument('--semilla', type=int, default=0)
+    parser.add_argument('--salida', help="Archivo JSON donde se escribe el reporte (por defecto, la salida estándar)")
+    parser.add_argument('--comparar', help="Reporte JSON de referencia para detectar regresiones")
+    parser.add_argument('--tolerancia', type=float, default=0.25, help="Aumento relativo permitido respecto a la referencia")
+    args = parser.parse_args()
+
+    reporte = ejecutar_benchmark(
+        args.filas, args.formato, args.repeticiones, args.semilla, not args.sin_memoria, args.procesos,
+        pares=args.pares, overhead=args.overhead, sin_utec=args.sin_utec, ceco=args.ceco,
+    )
+
+    if args.comparar:
+        with open(args.comparar, encoding='utf-8') as archivo:
+            reporte['regresiones'] = comparar_reportes(reporte, json.load(archivo), args.tolerancia)
+
+    texto = json.dumps(reporte, indent=2, ensure_ascii=False)
+    if args.salida:
+        with open(args.salida, 'w', encoding='utf-8') as archivo:
+            archivo.write(texto)
+    else:
+        print(texto)
+
+    for resultado in reporte['resultados']:
+        for etapa in resultado['etapas']:
+            pico = f"{etapa['pico_bytes'] / 1024 ** 2:>10.1f} MB" if etapa['pico_bytes'] is not None else ''
+            print(f"{resultado['filas']:>10} {etapa['etapa']:<26} {etapa['segundos']:>9.3f} s {pico}", file=sys.stderr)
+    for regresion in reporte.get('regresiones', []):
+        print(f"Regresión: {regresion}", file=sys.stderr)
+    return 1 if reporte.get('regresiones') else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,78 @@
+import sys
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+
+
+# Función para estimar el tamaño en bytes de un resultado guardado en la caché
+def tamaño_resultado(valor):
+    if isinstance(valor, pd.DataFrame):
+        return int(valor.memory_usage(index=True, deep=True).sum())
+    if isinstance(valor, dict):
+        return sum(tamaño_resultado(elemento) for elemento in valor.values())
+    if isinstance(valor, (list, tuple)):
+        return sum(tamaño_resultado(elemento) for elemento in valor)
+    return sys.getsizeof(valor)
+
+
+# Caché de resultados compartida por todas las sesiones de un proceso
+#
+# Guarda hasta `max_entradas` resultados y hasta `max_bytes` en total (ver
+# `tamaño_resultado`); al superar cualquiera de los dos límites descarta los
+# resultados usados hace más tiempo. Los resultados se entregan sin copiar, así
+# que quien los usa no debe modificarlos. Si dos sesiones piden a la vez una
+# clave que no está, ambas la calculan y se guarda la última.
+class CacheVistas:
+    def __init__(self, max_entradas=256, max_bytes=256 * 1024 ** 2):
+        self.max_entradas = max_entradas
+        self.max_bytes = max_bytes
+        self._entradas = OrderedDict()
+        self._bytes = 0
+        self._bloqueo = threading.Lock()
+        self.aciertos = 0
+        self.fallos = 0
+        self.descartes = 0
+
+    # Devuelve el resultado de `clave` y si estaba en la caché; si no estaba, lo
+    # obtiene con `calcular()` y lo guarda
+    def obtener(self, clave, calcular):
+        with self._bloqueo:
+            if clave in self._entradas:
+                self._entradas.move_to_end(clave)
+                self.aciertos += 1
+                return self._entradas[clave][0], True
+            self.fallos += 1
+
+        valor = calcular()
+        tamaño = tamaño_resultado(valor)
+        with self._bloqueo:
+            if clave in self._entradas:
+                self._bytes -= self._entradas.pop(clave)[1]
+            # Un resultado mayor que el límite no se guarda
+            if tamaño <= self.max_bytes:
+                self._entradas[clave] = (valor, tamaño)
+                self._bytes += tamaño
+            while len(self._entradas) > self.max_entradas or self._bytes > self.max_bytes:
+                self._bytes -= self._entradas.popitem(last=False)[1][1]
+                self.descartes += 1
+        return valor, False
+
+    # Descarta todos los resultados, sin reiniciar las métricas
+    def limpiar(self):
+        with self._bloqueo:
+            self._entradas.clear()
+            self._bytes = 0
+
+    # Devuelve las métricas de uso de la caché
+    def metricas(self):
+        with self._bloqueo:
+            consultas = self.aciertos + self.fallos
+            return {
+                'entradas': len(self._entradas),
+                'bytes': self._bytes,
+                'aciertos': self.aciertos,
+                'fallos': self.fallos,
+                'descartes': self.descartes,
+                'tasa_aciertos': self.aciertos / consultas if consultas else None,
+            }
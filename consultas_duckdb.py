@@ -0,0 +1,274 @@
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+
+import pandas as pd
+
+from cubo import consultar_cubo, consultar_cubo_por_grupo
+from fuentes import CACHE_DESCARGAS, URL_BASE, cargar_fuentes, rutas_fuentes, rutas_snapshot
+from procesamiento import huella_datos
+from reportes import OPCIONES_FAM_CUENTA, combinaciones_filtros, construir_datos, cumplimiento_por_grupo, top_5_gastos
+
+try:
+    import duckdb
+except ImportError:  # dependencia opcional; sin ella se usa el cubo en pandas
+    duckdb = None
+
+# Indica si se puede usar el motor DuckDB
+DUCKDB_DISPONIBLE = duckdb is not None
+
+# Directorio por defecto de los datos procesados en Parquet; cada versión de
+# los datos va en un subdirectorio con su huella
+DIRECTORIO_PARQUET = os.path.join(CACHE_DESCARGAS, 'procesado')
+
+# Filtros de una consulta y la columna de cada tabla con la que se comparan.
+# El año es 'Ejercicio' en el gasto y 'Año' en el presupuesto.
+FILTROS = ['Año', 'Proceso', 'Familia_Cuenta', 'Clase de coste', 'Recinto']
+
+# Tablas que se guardan como Parquet en cada versión
+TABLAS_PARQUET = ['gasto', 'eliminado', 'presupuesto', 'ordenes']
+
+# Columnas que muestra la tabla de los 5 mayores gastos
+COLUMNAS_TOP_5 = ['Centro de coste', 'Denominación del objeto', 'Grupo_Ceco', 'Fe.contabilización', 'Valor/mon.inf.']
+
+
+# Función para guardar el gasto procesado, las filas eliminadas como pares
+# opuestos, el presupuesto y la clase de cada orden como Parquet en
+# `directorio/<version>`
+#
+# Si esa versión ya existe con todas las tablas se reutiliza. La escritura se hace en un directorio
+# temporal que se renombra al final, de modo que una consulta nunca ve archivos
+# a medio escribir, y después se borran las versiones anteriores salvo las
+# `conservar` más recientes, que pueden seguir en uso mientras se reemplazan. El
+# índice de data0 se guarda en la columna 'fila' para mostrarlo igual que con pandas.
+def escribir_parquet_datos(datos, directorio, version, conservar=0):
+    ruta = os.path.join(directorio, version)
+    if all(os.path.isfile(os.path.join(ruta, tabla + '.parquet')) for tabla in TABLAS_PARQUET):
+        return ruta
+    shutil.rmtree(ruta, ignore_errors=True)
+
+    os.makedirs(directorio, exist_ok=True)
+    temporal = tempfile.mkdtemp(dir=directorio, prefix='.escribiendo-')
+    try:
+        datos['data0'].rename_axis('fila').reset_index().to_parquet(os.path.join(temporal, 'gasto.parquet'), index=False)
+        datos['removed_data'].to_parquet(os.path.join(temporal, 'eliminado.parquet'), index=False)
+        datos['budget_data'].to_parquet(os.path.join(temporal, 'presupuesto.parquet'), index=False)
+        ordenes = datos['orders_data'].drop_duplicates('Orden')[['Orden', 'Clase de orden']]
+        ordenes.to_parquet(os.path.join(temporal, 'ordenes.parquet'), index=False)
+        os.rename(temporal, ruta)
+    except OSError:
+        shutil.rmtree(temporal, ignore_errors=True)
+        # Otro proceso pudo escribir la misma versión al mismo tiempo
+        if not os.path.isdir(ruta):
+            raise
+
+    anteriores = [os.path.join(directorio, nombre) for nombre in os.listdir(directorio) if nombre != version and not nombre.startswith('.')]
+    anteriores.sort(key=os.path.getmtime, reverse=True)
+    for anterior in anteriores[conservar:]:
+        shutil.rmtree(anterior, ignore_errors=True)
+    return ruta
+
+
+# Función para abrir una conexión DuckDB en memoria con una vista por archivo Parquet
+def _conectar(ruta):
+    conexion = duckdb.connect()
+    for tabla in TABLAS_PARQUET:
+        archivo = os.path.join(ruta, tabla + '.parquet').replace("'", "''")
+        conexion.execute(f"CREATE VIEW {tabla} AS SELECT * FROM read_parquet('{archivo}')")
+    return conexion
+
+
+# Función para armar la condición WHERE equivalente a `aplicar_filtros`
+#
+# Como en pandas, un valor de texto nunca es igual a un número: si el tipo de la
+# opción no corresponde al de la columna, la condición es falsa en lugar de
+# convertir uno de los dos.
+def _condiciones(conexion, tabla, opciones, col_año):
+    tipos = dict(conexion.execute(f"SELECT column_name, column_type FROM (DESCRIBE {tabla})").fetchall())
+    condiciones, parametros = ['TRUE'], []
+    for filtro, opcion in zip(FILTROS, opciones):
+        if opcion == 'Todos':
+            continue
+        columna = col_año if filtro == 'Año' else filtro
+        opcion = opcion.item() if hasattr(opcion, 'item') else opcion
+        if isinstance(opcion, str) != (tipos[columna] == 'VARCHAR'):
+            condiciones.append('FALSE')
+            continue
+        condiciones.append(f'"{columna}" = ?')
+        parametros.append(opcion)
+    return ' AND '.join(condiciones), parametros
+
+
+# Función para obtener los mismos totales que `consultar_cubo`, calculados por
+# DuckDB sobre los Parquet escritos con `escribir_parquet_datos`
+def consultar_duckdb(ruta, opcion_año, opcion_proceso, opcion_fam_cuenta, opcion_clase_coste, opcion_recinto):
+    opciones = (opcion_año, opcion_proceso, opcion_fam_cuenta, opcion_clase_coste, opcion_recinto)
+    with _conectar(ruta) as conexion:
+        filtro_gasto, parametros_gasto = _condiciones(conexion, 'gasto', opciones, 'Ejercicio')
+        filtro_presupuesto, parametros_presupuesto = _condiciones(conexion, 'presupuesto', opciones, 'Año')
+
+        def consultar(sql, parametros):
+            return conexion.execute(sql, parametros).df()
+
+        gasto_real = consultar(f"""
+            SELECT "Ejercicio", "Período", COALESCE(SUM("Valor/mon.inf."), 0) AS "Valor/mon.inf."
+            FROM gasto WHERE {filtro_gasto} AND "Ejercicio" IS NOT NULL AND "Período" IS NOT NULL
+            GROUP BY ALL ORDER BY ALL
+        """, parametros_gasto)
+        gasto_presupuestado = consultar(f"""
+            SELECT "Año", "Mes", COALESCE(SUM("Presupuesto"), 0) AS "Presupuesto"
+            FROM presupuesto WHERE {filtro_presupuesto} AND "Año" IS NOT NULL AND "Mes" IS NOT NULL
+            GROUP BY ALL ORDER BY ALL
+        """, parametros_presupuesto)
+        con_sin_ot = consultar(f"""
+            SELECT COALESCE(SUM("Valor/mon.inf.") FILTER ("Orden partner" IS NOT NULL), 0) AS con_ot,
+                   COALESCE(SUM("Valor/mon.inf.") FILTER ("Orden partner" IS NULL), 0) AS sin_ot
+            FROM gasto WHERE {filtro_gasto}
+        """, parametros_gasto)
+
+        # Gasto con su clase de orden, buscada por 'Orden partner'
+        con_clase = f"""
+            SELECT g."Período", o."Clase de orden", g."Orden partner", g."Valor/mon.inf."
+            FROM gasto g JOIN ordenes o ON g."Orden partner" = o."Orden"
+            WHERE {filtro_gasto} AND o."Clase de orden" IS NOT NULL
+        """
+        tipo_orden = consultar(f"""
+            SELECT "Clase de orden", COUNT("Orden partner") AS cantidad_ordenes, COALESCE(SUM("Valor/mon.inf."), 0) AS gasto
+            FROM ({con_clase}) GROUP BY ALL ORDER BY ALL
+        """, parametros_gasto)
+        gasto_por_tipo_orden = consultar(f"""
+            SELECT "Período", "Clase de orden", COALESCE(SUM("Valor/mon.inf."), 0) AS gasto
+            FROM ({con_clase}) WHERE "Período" IS NOT NULL GROUP BY ALL ORDER BY ALL
+        """, parametros_gasto)
+
+    return {
+        'gasto_real': gasto_real,
+        'gasto_presupuestado': gasto_presupuestado,
+        'gasto_con_ot': con_sin_ot['con_ot'].iloc[0],
+        'gasto_sin_ot': con_sin_ot['sin_ot'].iloc[0],
+        'tipo_orden': tipo_orden,
+        'gasto_por_tipo_orden': gasto_por_tipo_orden,
+    }
+
+
+# Función para obtener los mismos totales que `consultar_cubo_por_grupo`,
+# calculados por DuckDB sobre los Parquet
+def consultar_duckdb_por_grupo(ruta, opcion_año, opcion_proceso, opcion_fam_cuenta, opcion_clase_coste, opcion_recinto, dimensiones):
+    opciones = (opcion_año, opcion_proceso, opcion_fam_cuenta, opcion_clase_coste, opcion_recinto)
+    columnas = ', '.join(f'"{columna}"' for columna in dimensiones)
+    no_nulas = ' AND '.join(f'"{columna}" IS NOT NULL' for columna in dimensiones)
+    with _conectar(ruta) as conexion:
+        filtro_gasto, parametros_gasto = _condiciones(conexion, 'gasto', opciones, 'Ejercicio')
+        filtro_presupuesto, parametros_presupuesto = _condiciones(conexion, 'presupuesto', opciones, 'Año')
+        gasto_real = conexion.execute(f"""
+            SELECT {columnas}, "Ejercicio", "Período", COALESCE(SUM("Valor/mon.inf."), 0) AS "Valor/mon.inf."
+            FROM gasto WHERE {filtro_gasto} AND {no_nulas} AND "Ejercicio" IS NOT NULL AND "Período" IS NOT NULL
+            GROUP BY ALL ORDER BY ALL
+        """, parametros_gasto).df()
+        gasto_presupuestado = conexion.execute(f"""
+            SELECT {columnas}, "Año", "Mes", COALESCE(SUM("Presupuesto"), 0) AS "Presupuesto"
+            FROM presupuesto WHERE {filtro_presupuesto} AND {no_nulas} AND "Año" IS NOT NULL AND "Mes" IS NOT NULL
+            GROUP BY ALL ORDER BY ALL
+        """, parametros_presupuesto).df()
+    return {'gasto_real': gasto_real, 'gasto_presupuestado': gasto_presupuestado}
+
+
+# Función equivalente a `top_5_gastos` calculada por DuckDB
+def top_5_gastos_duckdb(ruta, opcion_año, opcion_proceso, opcion_fam_cuenta, opcion_clase_coste, opcion_recinto):
+    opciones = (opcion_año, opcion_proceso, opcion_fam_cuenta, opcion_clase_coste, opcion_recinto)
+    columnas = ', '.join(f'"{columna}"' for columna in COLUMNAS_TOP_5)
+    with _conectar(ruta) as conexion:
+        filtro, parametros = _condiciones(conexion, 'gasto', opciones, 'Ejercicio')
+        top = conexion.execute(f"""
+            SELECT fila, {columnas} FROM gasto
+            WHERE {filtro} AND "Centro de coste" IS NOT NULL AND "Centro de coste" <> ''
+            ORDER BY "Valor/mon.inf." DESC NULLS LAST, fila LIMIT 5
+        """, parametros).df()
+    return top.set_index('fila').rename_axis(None)
+
+
+# Función para exportar las filas procesadas ('gasto') o las eliminadas como
+# pares opuestos ('eliminado') que cumplen `filtros` a la ruta `destino`, en los
+# formatos de exportacion.py. DuckDB lee y escribe por bloques, sin cargar la
+# tabla en memoria.
+def exportar_duckdb(ruta, tabla, destino, formato='csv', filtros=None):
+    with _conectar(ruta) as conexion:
+        filtro, parametros = _condiciones(conexion, tabla, filtros or ('Todos',) * len(FILTROS), 'Ejercicio')
+        excluir = ' EXCLUDE (fila)' if tabla == 'gasto' else ''
+        relacion = conexion.sql(f"SELECT *{excluir} FROM {tabla} WHERE {filtro}", params=parametros)
+        if formato == 'parquet':
+            relacion.write_parquet(destino)
+        else:
+            relacion.write_csv(destino, sep=';', header=True, compression='gzip' if formato == 'csv.gz' else 'none')
+
+
+# Función para comparar las consultas de DuckDB con las del cubo en pandas para
+# cada combinación de filtros. Devuelve la lista de diferencias encontradas.
+def verificar_duckdb(datos, ruta, combinaciones):
+    diferencias = []
+    for combinacion in combinaciones:
+        esperado = consultar_cubo(datos['cubo'], *combinacion)
+        obtenido = consultar_duckdb(ruta, *combinacion)
+        for clave, valor in esperado.items():
+            if isinstance(valor, pd.DataFrame):
+                try:
+                    pd.testing.assert_frame_equal(
+                        obtenido[clave].astype({columna: str for columna in obtenido[clave].select_dtypes('object')}),
+                        valor.astype({columna: str for columna in valor.select_dtypes(['category', 'object'])}),
+                        check_dtype=False, check_exact=False, rtol=1e-9,
+                    )
+                except AssertionError as error:
+                    diferencias.append(f"{combinacion} {clave}: {error}")
+            elif abs(obtenido[clave] - valor) > 1e-9 * max(1, abs(valor)):
+                diferencias.append(f"{combinacion} {clave}: {obtenido[clave]} != {valor}")
+
+        # Con empates el orden de pandas no está definido, así que se comparan los importes
+        esperado_top = top_5_gastos(datos['data0'], *combinacion)['Valor/mon.inf.'].tolist()
+        obtenido_top = top_5_gastos_duckdb(ruta, *combinacion)['Valor/mon.inf.'].tolist()
+        if obtenido_top != esperado_top:
+            diferencias.append(f"{combinacion} top_5_gastos: {obtenido_top} != {esperado_top}")
+
+    # Cumplimiento de todas las combinaciones de Proceso, Recinto y Clase de coste
+    dimensiones = ['Proceso', 'Recinto', 'Clase de coste']
+    filtros = ('Todos',) * len(FILTROS)
+    esperado = cumplimiento_por_grupo(consultar_cubo_por_grupo(datos['cubo'], *filtros, dimensiones), dimensiones)
+    obtenido = cumplimiento_por_grupo(consultar_duckdb_por_grupo(ruta, *filtros, dimensiones), dimensiones)
+    try:
+        pd.testing.assert_frame_equal(
+            obtenido.astype({columna: str for columna in dimensiones}).sort_values(dimensiones, ignore_index=True),
+            esperado.astype({columna: str for columna in dimensiones}).sort_values(dimensiones, ignore_index=True),
+            check_dtype=False, check_exact=False, rtol=1e-9,
+        )
+    except AssertionError as error:
+        diferencias.append(f"cumplimiento_por_grupo: {error}")
+    return diferencias
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compara las consultas de DuckDB sobre Parquet con las del cubo en pandas")
+    parser.add_argument('--origen', default=URL_BASE, help="URL base o directorio local con los archivos CSV")
+    parser.add_argument('--snapshot', help="Directorio con un snapshot Parquet (reemplaza a --origen)")
+    parser.add_argument('--directorio', default=DIRECTORIO_PARQUET, help="Directorio donde se escriben los Parquet procesados")
+    args = parser.parse_args()
+
+    if not DUCKDB_DISPONIBLE:
+        print("duckdb no está instalado")
+        return 1
+
+    fuentes = cargar_fuentes(rutas_snapshot(args.snapshot) if args.snapshot else rutas_fuentes(args.origen))
+    datos = construir_datos(fuentes)
+    ruta = escribir_parquet_datos(datos, args.directorio, huella_datos(*fuentes))
+    opciones = dict(datos['opciones'], Familia_Cuenta=OPCIONES_FAM_CUENTA)
+    combinaciones = combinaciones_filtros(opciones, {filtro: ['Todos', '*'] for filtro in FILTROS})
+
+    diferencias = verificar_duckdb(datos, ruta, combinaciones)
+    for diferencia in diferencias:
+        print(diferencia)
+    print(f"{len(combinaciones)} combinaciones: " + ("DuckDB coincide con el cubo" if not diferencias else "se encontraron diferencias"))
+    return 1 if diferencias else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,73 @@
+import pandas as pd
+
+from procesamiento import aplicar_filtros
+
+# Dimensiones de los filtros laterales, además del año
+DIMENSIONES = ['Proceso', 'Familia_Cuenta', 'Clase de coste', 'Recinto']
+
+
+# Función para construir el cubo agregado del gasto real y el presupuesto
+#
+# El cubo tiene tres tablas con las mismas columnas de filtro que los datos de
+# detalle, de modo que `aplicar_filtros` funciona igual sobre ellas:
+#   - 'gasto': gasto real por (Ejercicio, Período, dimensiones), separado en con y sin OT
+#   - 'ordenes': gasto y cantidad de órdenes por (Ejercicio, Período, dimensiones, Clase de orden)
+#   - 'presupuesto': presupuesto por (Año, Mes, dimensiones)
+def construir_cubo(data0, budget_data, orders_data):
+    claves_gasto = ['Ejercicio', 'Período'] + DIMENSIONES
+    con_ot = data0['Orden partner'].notna()
+    gasto = data0[claves_gasto].assign(**{
+        'Valor/mon.inf.': data0['Valor/mon.inf.'],
+        'Con OT': data0['Valor/mon.inf.'].where(con_ot, 0),
+        'Sin OT': data0['Valor/mon.inf.'].where(~con_ot, 0),
+    })
+    gasto = gasto.groupby(claves_gasto, dropna=False, observed=True).sum().reset_index()
+
+    # La clase de orden se busca por 'Orden partner' en lugar de unir toda la tabla de órdenes
+    clase_orden = orders_data.drop_duplicates('Orden').set_index('Orden')['Clase de orden']
+    ordenes = data0[claves_gasto + ['Orden partner', 'Valor/mon.inf.']].assign(**{
+        'Clase de orden': data0['Orden partner'].astype(object).map(clase_orden),
+    })
+    ordenes = ordenes.groupby(claves_gasto + ['Clase de orden'], dropna=False, observed=True).agg(
+        cantidad_ordenes=pd.NamedAgg(column='Orden partner', aggfunc='count'),
+        gasto=pd.NamedAgg(column='Valor/mon.inf.', aggfunc='sum'),
+    ).reset_index()
+    ordenes = ordenes[ordenes['Clase de orden'].notna()]
+
+    claves_presupuesto = ['Año', 'Mes'] + DIMENSIONES
+    presupuesto = budget_data.groupby(claves_presupuesto, dropna=False, observed=True)['Presupuesto'].sum().reset_index()
+
+    return {'gasto': gasto, 'ordenes': ordenes, 'presupuesto': presupuesto}
+
+
+# Función para obtener del cubo los totales que muestra la aplicación para una selección de filtros
+def consultar_cubo(cubo, opcion_año, opcion_proceso, opcion_fam_cuenta, opcion_clase_coste, opcion_recinto):
+    filtros = (opcion_año, opcion_proceso, opcion_fam_cuenta, opcion_clase_coste, opcion_recinto)
+    gasto = aplicar_filtros(cubo['gasto'], *filtros, 'Ejercicio')
+    ordenes = aplicar_filtros(cubo['ordenes'], *filtros, 'Ejercicio')
+    presupuesto = aplicar_filtros(cubo['presupuesto'], *filtros, 'Año')
+
+    return {
+        'gasto_real': gasto.groupby(['Ejercicio', 'Período'], observed=True)['Valor/mon.inf.'].sum().reset_index(),
+        'gasto_presupuestado': presupuesto.groupby(['Año', 'Mes'], observed=True)['Presupuesto'].sum().reset_index(),
+        'gasto_con_ot': gasto['Con OT'].sum(),
+        'gasto_sin_ot': gasto['Sin OT'].sum(),
+        'tipo_orden': ordenes.groupby('Clase de orden', observed=True)[['cantidad_ordenes', 'gasto']].sum().reset_index(),
+        'gasto_por_tipo_orden': ordenes.groupby(['Período', 'Clase de orden'], observed=True)['gasto'].sum().reset_index(),
+    }
+
+
+# Función para obtener del cubo el gasto real y el presupuesto por año y mes de
+# cada grupo de `dimensiones` (por ejemplo Proceso y Recinto) en una sola
+# pasada, en lugar de consultar el cubo una vez por combinación. Los filtros se
+# aplican igual que en `consultar_cubo`; para recorrer todos los valores de una
+# dimensión su filtro debe ser 'Todos'.
+def consultar_cubo_por_grupo(cubo, opcion_año, opcion_proceso, opcion_fam_cuenta, opcion_clase_coste, opcion_recinto, dimensiones):
+    filtros = (opcion_año, opcion_proceso, opcion_fam_cuenta, opcion_clase_coste, opcion_recinto)
+    gasto = aplicar_filtros(cubo['gasto'], *filtros, 'Ejercicio')
+    presupuesto = aplicar_filtros(cubo['presupuesto'], *filtros, 'Año')
+
+    return {
+        'gasto_real': gasto.groupby(dimensiones + ['Ejercicio', 'Período'], observed=True)['Valor/mon.inf.'].sum().reset_index(),
+        'gasto_presupuestado': presupuesto.groupby(dimensiones + ['Año', 'Mes'], observed=True)['Presupuesto'].sum().reset_index(),
+    }
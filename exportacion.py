@@ -0,0 +1,124 @@
+import argparse
+import gzip
+import io
+import os
+import sys
+import tempfile
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from fuentes import URL_BASE, cargar_fuentes, rutas_fuentes, rutas_snapshot
+from procesamiento import aplicar_filtros
+from reportes import OPCIONES_FAM_CUENTA, combinaciones_filtros, construir_datos
+
+# Formatos de exportación, con la extensión y el tipo MIME de cada uno
+FORMATOS = {
+    'csv': ('.csv', 'text/csv'),
+    'csv.gz': ('.csv.gz', 'application/gzip'),
+    'parquet': ('.parquet', 'application/vnd.apache.parquet'),
+}
+
+# Filas que se convierten a la vez al exportar
+FILAS_POR_BLOQUE = 100000
+
+# Tablas que se pueden exportar y el nombre del archivo de cada una
+EXPORTACIONES = {'data0': 'filas_procesadas', 'removed_data': 'filas_eliminadas'}
+
+
+# Función para recorrer `data` por bloques de filas, aplicando los filtros a cada bloque
+def _bloques(data, filtros, filas_por_bloque):
+    for inicio in range(0, len(data), filas_por_bloque):
+        bloque = data.iloc[inicio:inicio + filas_por_bloque]
+        if filtros:
+            bloque = aplicar_filtros(bloque, *filtros, 'Ejercicio')
+        if len(bloque):
+            yield bloque
+
+
+# Función para exportar las filas de `data` que cumplen `filtros` (las cinco
+# opciones de `aplicar_filtros`, o None para todas)
+#
+# `destino` es una ruta o un archivo binario abierto. Las filas se convierten
+# y se escriben por bloques de `filas_por_bloque`, así nunca se arma en memoria
+# el texto completo ni una copia filtrada de toda la tabla. El CSV usa ';' como
+# separador, igual que `convertir_a_csv`; con 'csv.gz' se comprime con gzip y
+# con 'parquet' cada bloque es un grupo de filas.
+def exportar_filas(data, destino, formato='csv', filtros=None, filas_por_bloque=FILAS_POR_BLOQUE):
+    if isinstance(destino, (str, os.PathLike)):
+        with open(destino, 'wb') as archivo:
+            return exportar_filas(data, archivo, formato, filtros, filas_por_bloque)
+
+    bloques = _bloques(data, filtros, filas_por_bloque)
+    if formato == 'parquet':
+        esquema = pa.Schema.from_pandas(data, preserve_index=False)
+        with pq.ParquetWriter(destino, esquema) as escritor:
+            for bloque in bloques:
+                escritor.write_table(pa.Table.from_pandas(bloque, schema=esquema, preserve_index=False))
+        return
+
+    comprimido = gzip.GzipFile(fileobj=destino, mode='wb') if formato == 'csv.gz' else None
+    texto = io.TextIOWrapper(comprimido or destino, encoding='utf-8', newline='')
+    data.head(0).to_csv(texto, sep=';', index=False)
+    for bloque in bloques:
+        bloque.to_csv(texto, sep=';', index=False, header=False)
+    # Se suelta el archivo sin cerrarlo, para que quien lo abrió decida
+    texto.flush()
+    texto.detach()
+    if comprimido is not None:
+        comprimido.close()
+
+
+# Función para generar una exportación en un archivo temporal y devolverlo
+# abierto para leer. `escribir` recibe la ruta donde debe escribir. El archivo
+# se borra del disco apenas se abre y desaparece al cerrarlo.
+def archivo_exportado(escribir, sufijo=''):
+    descriptor, ruta = tempfile.mkstemp(suffix=sufijo)
+    os.close(descriptor)
+    try:
+        escribir(ruta)
+        return open(ruta, 'rb')
+    finally:
+        os.unlink(ruta)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Exporta las filas procesadas y las eliminadas como pares opuestos")
+    parser.add_argument('destino', help="Directorio donde se escriben los archivos")
+    parser.add_argument('--origen', default=URL_BASE, help="URL base o directorio local con los archivos CSV")
+    parser.add_argument('--snapshot', help="Directorio con un snapshot Parquet (reemplaza a --origen)")
+    parser.add_argument('--incremental', help="Directorio con el resultado del último procesamiento")
+    parser.add_argument('--formato', choices=list(FORMATOS), default='csv.gz')
+    parser.add_argument('--año', default='Todos')
+    parser.add_argument('--proceso', default='Todos')
+    parser.add_argument('--familia-cuenta', default='Todos')
+    parser.add_argument('--clase-coste', default='Todos')
+    parser.add_argument('--recinto', default='Todos')
+    args = parser.parse_args()
+
+    rutas = rutas_snapshot(args.snapshot) if args.snapshot else rutas_fuentes(args.origen)
+    datos = construir_datos(cargar_fuentes(rutas), args.incremental)
+
+    # Los valores se buscan entre las opciones de cada filtro por su texto, como en reportes.py
+    opciones = dict(datos['opciones'], Familia_Cuenta=OPCIONES_FAM_CUENTA)
+    try:
+        filtros = combinaciones_filtros(opciones, {
+            'Año': [args.año],
+            'Proceso': [args.proceso],
+            'Familia_Cuenta': [args.familia_cuenta],
+            'Clase de coste': [args.clase_coste],
+            'Recinto': [args.recinto],
+        })[0]
+    except ValueError as error:
+        parser.error(str(error))
+
+    os.makedirs(args.destino, exist_ok=True)
+    for tabla, nombre in EXPORTACIONES.items():
+        ruta = os.path.join(args.destino, nombre + FORMATOS[args.formato][0])
+        exportar_filas(datos[tabla], ruta, args.formato, filtros)
+        print(f"{ruta}: {os.path.getsize(ruta)} bytes")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
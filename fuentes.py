@@ -0,0 +1,262 @@
+import argparse
+import hashlib
+import io
+import json
+import logging
+import os
+import pickle
+import tempfile
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from instrumentacion import etapa
+
+logger = logging.getLogger(__name__)
+
+# Ubicación por defecto de los archivos de referencia
+URL_BASE = 'https://streamlitmaps.s3.amazonaws.com/'
+
+# Directorio por defecto de la caché local de archivos descargados
+CACHE_DESCARGAS = os.path.join(os.path.expanduser('~'), '.cache', 'monitor_presupuesto')
+
+# Versión del formato de la caché; las tablas guardadas con otra versión se vuelven a leer del CSV
+VERSION_CACHE = 1
+
+# Segundos de espera máxima de cada descarga
+TIEMPO_ESPERA = 60
+
+# Archivo de origen de cada tabla
+ARCHIVOS = {
+    'data0': 'Data_0624.csv',
+    'budget_data': 'Base_Presupuesto_2.csv',
+    'orders_data': 'Base_Ordenes_0624.csv',
+    'base_utec_data': 'Base_UTEC_BudgetVersion.csv',
+    'base_ceco_data': 'Base_Ceco_3.csv',
+}
+
+# Columnas que debe tener cada tabla. Las marcadas como 'num' se guardan como
+# números ya decodificados; las columnas de texto se guardan como categorías.
+ESQUEMAS = {
+    'data0': {
+        'Ejercicio': 'num',
+        'Período': 'num',
+        'Clase de coste': None,
+        'Centro de coste': None,
+        'Valor/mon.inf.': 'num',
+        'Orden partner': None,
+        'Grupo_Ceco': None,
+        'Familia_Cuenta': None,
+    },
+    'budget_data': {
+        'Año': 'num',
+        'Mes': 'num',
+        'Proceso': None,
+        'Familia_Cuenta': None,
+        'Clase de coste': None,
+        'Recinto': None,
+        'Presupuesto': 'num',
+    },
+    'orders_data': {
+        'Orden': None,
+        'Utec': None,
+    },
+    'base_utec_data': {
+        'Utec': None,
+        'Proceso': None,
+        'Recinto': None,
+    },
+    'base_ceco_data': {
+        'Ceco': None,
+        'Proceso': None,
+        'Recinto': None,
+    },
+}
+
+
+# Función para obtener la ruta de cada archivo de origen. `origen` puede ser la
+# URL base de S3 o un directorio local con los mismos archivos.
+def rutas_fuentes(origen=URL_BASE):
+    if origen.startswith(('http://', 'https://', 's3://')):
+        return {nombre: origen.rstrip('/') + '/' + archivo for nombre, archivo in ARCHIVOS.items()}
+    return {nombre: os.path.join(origen, archivo) for nombre, archivo in ARCHIVOS.items()}
+
+
+# Función para leer un archivo de origen en formato CSV
+def leer_csv(ruta):
+    data = pd.read_csv(ruta, encoding='ISO-8859-1', sep=';')
+
+    if 'Valor/mon.inf.' in data.columns:
+        data['Valor/mon.inf.'] = pd.to_numeric(data['Valor/mon.inf.'].str.replace(',', ''), errors='coerce').fillna(0)
+
+    return data
+
+
+# Función para verificar que una tabla tiene las columnas de su esquema
+def validar_esquema(nombre, data):
+    faltantes = [columna for columna in ESQUEMAS[nombre] if columna not in data.columns]
+    if faltantes:
+        raise ValueError(f"Faltan las columnas {faltantes} en {nombre}")
+
+
+# Función para convertir una tabla a los tipos del snapshot
+def tipar_fuente(nombre, data):
+    data = data.copy()
+    for columna in data.columns:
+        if ESQUEMAS[nombre].get(columna) == 'num':
+            data[columna] = pd.to_numeric(data[columna], errors='coerce')
+        elif data[columna].dtype == object:
+            valores = data[columna]
+            data[columna] = valores.where(valores.isna(), valores.astype(str)).astype('category')
+    return data
+
+
+# Función para escribir el snapshot Parquet de las cinco tablas de origen
+def escribir_snapshot(origen, destino):
+    os.makedirs(destino, exist_ok=True)
+    for nombre, ruta in rutas_fuentes(origen).items():
+        data = leer_csv(ruta)
+        validar_esquema(nombre, data)
+        tipar_fuente(nombre, data).to_parquet(ruta_snapshot(destino, nombre), index=False)
+
+
+# Función para obtener la ruta del archivo Parquet de una tabla en el snapshot
+def ruta_snapshot(destino, nombre):
+    return os.path.join(destino, nombre + '.parquet')
+
+
+# Función para obtener las rutas de las cinco tablas de un snapshot
+def rutas_snapshot(destino):
+    return {nombre: ruta_snapshot(destino, nombre) for nombre in ARCHIVOS}
+
+
+# Función para leer una tabla del snapshot usando memory-mapping
+def leer_snapshot(ruta):
+    return pd.read_parquet(ruta, memory_map=True)
+
+
+# Función para obtener las rutas de los archivos que guarda la caché para una URL
+def _rutas_cache(directorio, url):
+    base = os.path.join(directorio, hashlib.sha256(url.encode('utf-8')).hexdigest()[:32])
+    return {'csv': base + '.csv', 'tabla': base + '.pkl', 'meta': base + '.json'}
+
+
+# Función para escribir un archivo de la caché de forma atómica
+#
+# Cada escritura usa su propio archivo temporal en el mismo directorio, así dos
+# procesos que descargan la misma URL nunca mezclan sus contenidos: cada
+# `os.replace` instala un archivo completo.
+def _escribir_atomico(ruta, contenido):
+    descriptor, temporal = tempfile.mkstemp(dir=os.path.dirname(ruta), prefix='.' + os.path.basename(ruta) + '.')
+    try:
+        with os.fdopen(descriptor, 'wb') as archivo:
+            archivo.write(contenido)
+        os.replace(temporal, ruta)
+    except BaseException:
+        os.unlink(temporal)
+        raise
+
+
+# Función para leer la tabla guardada en la caché sin volver a interpretar el CSV
+def _leer_cache(rutas, meta):
+    if meta.get('version') == VERSION_CACHE and os.path.exists(rutas['tabla']):
+        try:
+            return pd.read_pickle(rutas['tabla'])
+        except Exception:
+            logger.warning("No se pudo leer %s; se vuelve a interpretar el CSV", rutas['tabla'])
+    return leer_csv(rutas['csv'])
+
+
+# Función para descargar un archivo de origen usando una caché en disco
+#
+# La caché guarda el CSV descargado, la tabla ya interpretada y los encabezados
+# ETag y Last-Modified de la respuesta. En cada llamada se hace un GET
+# condicional; si el servidor responde 304 se usa la tabla guardada sin volver
+# a interpretar el CSV. Si no hay conexión o el servidor responde con un error
+# 5xx se usa la copia guardada, si existe. Devuelve la tabla y el resultado:
+# 'descargado', 'no modificado', 'sin conexión' o 'error del servidor'.
+def descargar_con_cache(url, directorio, tiempo_espera=TIEMPO_ESPERA):
+    os.makedirs(directorio, exist_ok=True)
+    rutas = _rutas_cache(directorio, url)
+    meta = {}
+    if os.path.exists(rutas['meta']) and os.path.exists(rutas['csv']):
+        with open(rutas['meta'], encoding='utf-8') as archivo:
+            meta = json.load(archivo)
+
+    pedido = urllib.request.Request(url)
+    if meta.get('etag'):
+        pedido.add_header('If-None-Match', meta['etag'])
+    if meta.get('last_modified'):
+        pedido.add_header('If-Modified-Since', meta['last_modified'])
+
+    try:
+        with urllib.request.urlopen(pedido, timeout=tiempo_espera) as respuesta:
+            contenido = respuesta.read()
+            cabeceras = respuesta.headers
+    except urllib.error.HTTPError as error:
+        if error.code == 304 and meta:
+            return _leer_cache(rutas, meta), 'no modificado'
+        if error.code >= 500 and meta:
+            logger.warning("El servidor respondió %s para %s; se usa la copia guardada", error.code, url)
+            return _leer_cache(rutas, meta), 'error del servidor'
+        raise
+    except (urllib.error.URLError, OSError) as error:
+        if not meta:
+            raise
+        logger.warning("No se pudo descargar %s (%s); se usa la copia guardada", url, error)
+        return _leer_cache(rutas, meta), 'sin conexión'
+
+    data = leer_csv(io.BytesIO(contenido))
+    _escribir_atomico(rutas['csv'], contenido)
+    _escribir_atomico(rutas['tabla'], pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL))
+    _escribir_atomico(rutas['meta'], json.dumps({
+        'version': VERSION_CACHE,
+        'url': url,
+        'etag': cabeceras.get('ETag'),
+        'last_modified': cabeceras.get('Last-Modified'),
+    }).encode('utf-8'))
+    return data, 'descargado'
+
+
+# Función para leer una tabla desde CSV o desde un snapshot según la extensión.
+# Con `cache`, los archivos HTTP se descargan a través de la caché en ese directorio.
+def leer_fuente(ruta, cache=None):
+    if ruta.endswith('.parquet'):
+        return leer_snapshot(ruta)
+    if cache and ruta.startswith(('http://', 'https://')):
+        return descargar_con_cache(ruta, cache)[0]
+    return leer_csv(ruta)
+
+
+# Función para leer las cinco tablas, en el orden de ARCHIVOS
+#
+# Las tablas se descargan e interpretan en paralelo, de modo que el tiempo total
+# es cercano al del archivo más grande. Si se entrega `registro`, se agrega una
+# etapa por tabla con el resultado de la caché (ver instrumentacion.py).
+def cargar_fuentes(rutas, cache=None, registro=None):
+    def cargar(nombre):
+        ruta = rutas[nombre]
+        with etapa(registro, f'load_data {nombre}') as medida:
+            if cache and ruta.startswith(('http://', 'https://')) and not ruta.endswith('.parquet'):
+                data, medida['cache'] = descargar_con_cache(ruta, cache)
+            else:
+                data = leer_fuente(ruta)
+            medida['filas_salida'] = len(data)
+        return data
+
+    with ThreadPoolExecutor(max_workers=len(ARCHIVOS)) as pool:
+        return list(pool.map(cargar, ARCHIVOS))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convierte los archivos de origen a un snapshot Parquet tipado")
+    parser.add_argument('destino', help="Directorio donde se escriben los archivos .parquet")
+    parser.add_argument('--origen', default=URL_BASE, help="URL base o directorio local con los archivos CSV")
+    args = parser.parse_args()
+    escribir_snapshot(args.origen, args.destino)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,304 @@
+import argparse
+import hashlib
+import os
+import pickle
+import shutil
+import sys
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from fuentes import URL_BASE, _escribir_atomico, cargar_fuentes, rutas_fuentes, rutas_snapshot, validar_esquema
+from instrumentacion import etapa
+from procesamiento import (
+    CLAVES_PARES,
+    completar_datos,
+    construir_indices_mapeo,
+    enriquecer_gasto,
+    mapear_dimensiones,
+    medir_memoria,
+    procesar_datos,
+    redistribuir_overhead,
+)
+
+# Archivo donde se guarda el resultado del último procesamiento
+ARCHIVO_ESTADO = 'estado.pkl'
+
+# Versión del formato del estado; un estado de otra versión se descarta
+VERSION_ESTADO = 3
+
+# Columnas que identifican una partición mensual del gasto real
+CLAVES_PERIODO = ['Ejercicio', 'Período']
+
+
+# Función para leer el estado guardado en `directorio`, o None si no existe
+def leer_estado(directorio):
+    ruta = os.path.join(directorio, ARCHIVO_ESTADO)
+    if not os.path.exists(ruta):
+        return None
+    with open(ruta, 'rb') as archivo:
+        return pickle.load(archivo)
+
+
+# Función para guardar el estado de forma atómica
+def guardar_estado(directorio, estado):
+    os.makedirs(directorio, exist_ok=True)
+    _escribir_atomico(os.path.join(directorio, ARCHIVO_ESTADO), pickle.dumps(estado, protocol=pickle.HIGHEST_PROTOCOL))
+
+
+# Función para calcular una huella por partición (Ejercicio, Período). Incluye
+# la columna 'id', así que una fila que cambia de posición cambia su partición.
+def _huellas_particiones(data0):
+    filas = pd.util.hash_pandas_object(data0, index=False).to_numpy()
+    posiciones = data0.groupby(CLAVES_PERIODO, dropna=False, sort=False, observed=True).indices
+    huellas = {clave: hashlib.sha256(filas[indices].tobytes()).hexdigest() for clave, indices in posiciones.items()}
+    return huellas, posiciones
+
+
+# Función para obtener las claves de una tabla de mapeo cuyas filas cambiaron
+def _claves_modificadas(anterior, nueva, clave):
+    def firmas(data):
+        filas = pd.util.hash_pandas_object(data, index=False).to_numpy()
+        return {k: filas[indices].tobytes() for k, indices in data.groupby(clave, dropna=False, sort=False, observed=True).indices.items()}
+
+    firmas_anteriores = firmas(anterior)
+    firmas_nuevas = firmas(nueva)
+    return [k for k in set(firmas_anteriores) | set(firmas_nuevas) if firmas_anteriores.get(k) != firmas_nuevas.get(k)]
+
+
+# Función para decidir si dos tipos de columna son compatibles. Dos categorías
+# lo son aunque tengan otros valores, como ocurre en cada snapshot tipado con
+# datos nuevos; `_alinear_tipos` vuelve a aplicar las categorías del recálculo.
+def _tipos_compatibles(anterior, nuevo):
+    if isinstance(anterior, pd.CategoricalDtype) or isinstance(nuevo, pd.CategoricalDtype):
+        return isinstance(anterior, pd.CategoricalDtype) and isinstance(nuevo, pd.CategoricalDtype)
+    return anterior.kind == nuevo.kind
+
+
+# Función para decidir si el estado guardado puede reutilizarse con las nuevas tablas
+def _estado_compatible(estado, data0, orders_data, base_utec_data, base_ceco_data):
+    pares = [
+        (estado['data0'], data0),
+        (estado['orders_data'], orders_data),
+        (estado['base_utec_data'], base_utec_data),
+        (estado['base_ceco_data'], base_ceco_data),
+    ]
+    return all(
+        list(anterior.columns) == list(nueva.columns)
+        and all(_tipos_compatibles(tipo_anterior, tipo_nuevo) for tipo_anterior, tipo_nuevo in zip(anterior.dtypes, nueva.dtypes))
+        for anterior, nueva in pares
+    )
+
+
+# Función para concatenar las filas conservadas y las recalculadas sin que una
+# parte vacía cambie los tipos de las columnas
+def _concatenar(tablas):
+    con_filas = [data for data in tablas if len(data)]
+    return pd.concat(con_filas or tablas[:1])
+
+
+# Función para ordenar filas de gasto como lo hace `eliminar_pares_opuestos`:
+# por grupo (Clase de coste, Centro de coste), Período y posición de origen
+def _ordenar_como_origen(data, rango_grupo):
+    orden = np.lexsort((data['id'].to_numpy(), data['Período'].to_numpy(), rango_grupo[data['id'].to_numpy() - 1]))
+    return data.iloc[orden].reset_index(drop=True)
+
+
+# Función para volver a aplicar los tipos categóricos que produce el recálculo
+def _alinear_tipos(data, referencia):
+    for columna in data.columns:
+        if columna in referencia.columns and isinstance(referencia[columna].dtype, pd.CategoricalDtype) and data[columna].dtype != referencia[columna].dtype:
+            data[columna] = data[columna].astype(referencia[columna].dtype)
+    return data
+
+
+# Función para actualizar el resultado guardado recalculando solo lo necesario
+#
+# Se recalculan los grupos (Clase de coste, Centro de coste) que tienen filas en
+# particiones (Ejercicio, Período) nuevas o modificadas, o cuyas órdenes, Utec o
+# Ceco cambiaron en las tablas de mapeo. El Overhead se vuelve a repartir solo
+# en los períodos donde cambió alguna fila de esos grupos. Devuelve None cuando
+# no es posible y hay que reprocesar todo.
+def _actualizar(estado, data0, mapeado, huellas, posiciones, orders_data, base_utec_data, base_ceco_data, registro=None):
+    anterior = estado['data0']
+    tocadas = np.zeros(len(data0), dtype=bool)
+    tocadas_anteriores = np.zeros(len(anterior), dtype=bool)
+
+    # Particiones nuevas, modificadas o eliminadas
+    for clave in set(huellas) | set(estado['huellas']):
+        if huellas.get(clave) != estado['huellas'].get(clave):
+            if clave in posiciones:
+                tocadas[posiciones[clave]] = True
+            if clave in estado['posiciones']:
+                tocadas_anteriores[estado['posiciones'][clave]] = True
+
+    # Órdenes cuya Utec cambió
+    claves_ordenes = _claves_modificadas(estado['orders_data'][['Orden', 'Utec']], orders_data[['Orden', 'Utec']], 'Orden')
+    tocadas |= data0['Orden partner'].isin(claves_ordenes).to_numpy()
+
+    # Utec cuyo Proceso o Recinto cambió
+    columnas_utec = ['Utec', 'Proceso', 'Recinto']
+    claves_utec = _claves_modificadas(estado['base_utec_data'][columnas_utec], base_utec_data[columnas_utec], 'Utec')
+    if any(pd.isna(clave) for clave in claves_utec):
+        return None
+    ordenes = pd.concat([estado['orders_data'][['Orden', 'Utec']], orders_data[['Orden', 'Utec']]])
+    tocadas |= data0['Orden partner'].isin(ordenes.loc[ordenes['Utec'].isin(claves_utec), 'Orden']).to_numpy()
+
+    # Ceco cuyo Proceso o Recinto cambió (el mapeo compara los valores como texto)
+    columnas_ceco = ['Ceco', 'Proceso', 'Recinto']
+    claves_ceco = _claves_modificadas(estado['base_ceco_data'][columnas_ceco].astype(str), base_ceco_data[columnas_ceco].astype(str), 'Ceco')
+    tocadas |= data0['Centro de coste'].astype(str).isin(claves_ceco).to_numpy()
+
+    if not tocadas.any() and not tocadas_anteriores.any():
+        return estado['gasto'], estado['removed_data'], estado['filas_nuevas']
+
+    # Grupos a recalcular: los de cualquier fila tocada, antes o ahora
+    claves = pd.concat([anterior[CLAVES_PARES], data0[CLAVES_PARES]], ignore_index=True)
+    codigos = claves.groupby(CLAVES_PARES, dropna=False, sort=False, observed=True).ngroup().to_numpy()
+    codigos_anteriores, codigos_nuevos = codigos[:len(anterior)], codigos[len(anterior):]
+    grupo_tocado = np.zeros(codigos.max() + 1 if len(codigos) else 0, dtype=bool)
+    grupo_tocado[codigos_anteriores[tocadas_anteriores]] = True
+    grupo_tocado[codigos_nuevos[tocadas]] = True
+    recalcular = grupo_tocado[codigos_nuevos]
+
+    gasto_nuevo, removed_nuevo = enriquecer_gasto(mapeado[recalcular], registro)
+
+    # Las filas guardadas de grupos no tocados se conservan tal cual
+    conservar_gasto = ~grupo_tocado[codigos_anteriores[estado['gasto']['id'].to_numpy() - 1]]
+    conservar_removed = ~grupo_tocado[codigos_anteriores[estado['removed_data']['id'].to_numpy() - 1]]
+
+    rango_grupo = data0.groupby(CLAVES_PARES, dropna=True, observed=True).ngroup().to_numpy()
+    gasto = _ordenar_como_origen(_concatenar([estado['gasto'][conservar_gasto], gasto_nuevo]), rango_grupo)
+    removed_data = _ordenar_como_origen(_concatenar([estado['removed_data'][conservar_removed], removed_nuevo]), rango_grupo)
+    gasto = _alinear_tipos(gasto, gasto_nuevo)
+    removed_data = _alinear_tipos(removed_data, removed_nuevo)
+
+    # Repartir de nuevo el Overhead solo en los períodos afectados
+    afectados = pd.concat([estado['gasto'].loc[~conservar_gasto, CLAVES_PERIODO], gasto_nuevo[CLAVES_PERIODO]]).drop_duplicates()
+    afectados = pd.MultiIndex.from_frame(afectados)
+    en_afectados = pd.MultiIndex.from_frame(gasto[CLAVES_PERIODO]).isin(afectados)
+    filas_anteriores = estado['filas_nuevas']
+    filas_conservadas = filas_anteriores[~pd.MultiIndex.from_frame(filas_anteriores[CLAVES_PERIODO]).isin(afectados)]
+    filas_nuevas_df = pd.concat([filas_conservadas, redistribuir_overhead(gasto[en_afectados])])
+    filas_nuevas_df = filas_nuevas_df.sort_values(CLAVES_PERIODO, kind='stable').reset_index(drop=True)
+
+    return gasto, removed_data, filas_nuevas_df
+
+
+# Función equivalente a `procesar_datos` que reutiliza el resultado guardado en
+# `directorio` y lo actualiza con los datos recibidos
+def procesar_incremental(directorio, data0, budget_data, orders_data, base_utec_data, base_ceco_data, registro=None):
+    validar_esquema('data0', data0)
+    validar_esquema('budget_data', budget_data)
+    validar_esquema('orders_data', orders_data)
+    validar_esquema('base_utec_data', base_utec_data)
+    validar_esquema('base_ceco_data', base_ceco_data)
+
+    data0 = data0.copy()
+    data0['id'] = range(1, len(data0) + 1)
+    with etapa(registro, 'huellas_particiones', data0) as medida:
+        huellas, posiciones = _huellas_particiones(data0)
+        medida['filas_salida'] = len(huellas)
+    memoria = {'origen': medir_memoria(data0)}
+
+    # El mapeo de dimensiones es una pasada vectorizada; se aplica a todas las filas
+    with etapa(registro, 'mapear_dimensiones', data0) as medida:
+        indices = construir_indices_mapeo(orders_data, base_utec_data, base_ceco_data)
+        mapeado, conteos = mapear_dimensiones(data0, indices)
+        medida['filas_salida'] = len(mapeado)
+    memoria['mapeado'] = medir_memoria(mapeado)
+
+    with etapa(registro, 'leer_estado'):
+        estado = leer_estado(directorio)
+    resultado = None
+    if estado is not None and estado.get('version') == VERSION_ESTADO and _estado_compatible(estado, data0, orders_data, base_utec_data, base_ceco_data):
+        with etapa(registro, 'actualizar_incremental', mapeado) as medida:
+            resultado = _actualizar(estado, data0, mapeado, huellas, posiciones, orders_data, base_utec_data, base_ceco_data, registro)
+            medida['filas_salida'] = len(resultado[0]) if resultado is not None else None
+    if resultado is None:
+        gasto, removed_data = enriquecer_gasto(mapeado, registro)
+        with etapa(registro, 'redistribuir_overhead', gasto) as medida:
+            filas_nuevas_df = redistribuir_overhead(gasto)
+            medida['filas_salida'] = len(filas_nuevas_df)
+    else:
+        gasto, removed_data, filas_nuevas_df = resultado
+    memoria['enriquecido'] = medir_memoria(gasto, removed_data)
+
+    with etapa(registro, 'guardar_estado'):
+        guardar_estado(directorio, {
+            'version': VERSION_ESTADO,
+            'data0': data0,
+            'huellas': huellas,
+            'posiciones': posiciones,
+            'orders_data': orders_data,
+            'base_utec_data': base_utec_data,
+            'base_ceco_data': base_ceco_data,
+            'gasto': gasto,
+            'removed_data': removed_data,
+            'filas_nuevas': filas_nuevas_df,
+        })
+    reporte = dict(conteos, duplicados=indices['duplicados'])
+    with etapa(registro, 'completar_datos', gasto) as medida:
+        datos = completar_datos(gasto, filas_nuevas_df, removed_data, budget_data, orders_data, reporte, memoria)
+        medida['filas_salida'] = len(datos['data0'])
+    return datos
+
+
+# Función para comprobar que la actualización incremental da el mismo resultado
+# que reprocesar todo y que, si el estado guardado tiene las mismas columnas,
+# se usó la actualización incremental en lugar de reprocesar todo (por ejemplo,
+# con un snapshot tipado cuyas categorías cambian en cada entrega). No modifica
+# el estado guardado en `directorio`.
+def verificar_incremental(directorio, fuentes):
+    estado = leer_estado(directorio)
+    registro = []
+    with tempfile.TemporaryDirectory() as copia:
+        if estado is not None:
+            shutil.copy(os.path.join(directorio, ARCHIVO_ESTADO), os.path.join(copia, ARCHIVO_ESTADO))
+        incremental = procesar_incremental(copia, *fuentes, registro=registro)
+    completo = procesar_datos(*fuentes)
+
+    diferencias = []
+    data0, _, orders_data, base_utec_data, base_ceco_data = fuentes
+    reutilizable = estado is not None and estado.get('version') == VERSION_ESTADO and all(
+        list(estado[clave].columns) == list(data.columns)
+        for clave, data in [('orders_data', orders_data), ('base_utec_data', base_utec_data), ('base_ceco_data', base_ceco_data)]
+    ) and list(estado['data0'].columns) == list(data0.columns) + ['id']
+    if reutilizable and not any(medida['etapa'] == 'actualizar_incremental' for medida in registro):
+        diferencias.append("estado: el estado guardado tiene las mismas columnas pero se reprocesó todo")
+    for clave in ['data0', 'removed_data', 'budget_data']:
+        try:
+            pd.testing.assert_frame_equal(incremental[clave], completo[clave], check_exact=True)
+        except AssertionError as error:
+            diferencias.append(f"{clave}: {error}")
+    for clave in ['opciones', 'reporte_mapeo', 'avisos']:
+        if incremental[clave] != completo[clave]:
+            diferencias.append(f"{clave}: {incremental[clave]} != {completo[clave]}")
+    return diferencias
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Procesamiento incremental del gasto real")
+    parser.add_argument('accion', choices=['actualizar', 'verificar'])
+    parser.add_argument('estado', help="Directorio donde se guarda el resultado procesado")
+    parser.add_argument('--origen', default=URL_BASE, help="URL base o directorio local con los archivos CSV")
+    parser.add_argument('--snapshot', help="Directorio con un snapshot Parquet (reemplaza a --origen)")
+    args = parser.parse_args()
+
+    rutas = rutas_snapshot(args.snapshot) if args.snapshot else rutas_fuentes(args.origen)
+    fuentes = cargar_fuentes(rutas)
+
+    if args.accion == 'actualizar':
+        procesar_incremental(args.estado, *fuentes)
+        return 0
+
+    diferencias = verificar_incremental(args.estado, fuentes)
+    for diferencia in diferencias:
+        print(diferencia)
+    print("Resultado incremental idéntico al reprocesamiento completo" if not diferencias else "Se encontraron diferencias")
+    return 1 if diferencias else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
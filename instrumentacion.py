@@ -0,0 +1,117 @@
+import json
+import logging
+import platform
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+
+import pandas as pd
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Logger por el que se emite cada etapa como una línea JSON
+logger = logging.getLogger('monitor.diagnostico')
+
+# Etapas abiertas en el hilo actual, para medir el pico de memoria de etapas anidadas
+_abiertas = threading.local()
+
+
+# Función para obtener el máximo de memoria residente del proceso, en bytes
+def rss_maximo():
+    if resource is None:
+        return None
+    maximo = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maximo if sys.platform == 'darwin' else maximo * 1024
+
+
+# Función para contar las filas de una tabla o de un número ya calculado
+def _filas(data):
+    if data is None:
+        return None
+    return data if isinstance(data, int) else len(data)
+
+
+# Función para medir una etapa del procesamiento o una sección de la página
+#
+# Agrega a `registro` un diccionario con el nombre, el nivel de anidamiento, el
+# tiempo en segundos, las filas de entrada y el máximo de memoria residente del
+# proceso al terminar. Si tracemalloc está activo se agrega también el pico de
+# memoria reservada durante la etapa. El diccionario se entrega al bloque para
+# que complete 'filas_salida' y otros conteos propios de la etapa. Con
+# `registro=None` no se mide nada.
+@contextmanager
+def etapa(registro, nombre, entrada=None):
+    medida = {'etapa': nombre, 'filas_entrada': _filas(entrada)}
+    if registro is None:
+        yield medida
+        return
+
+    pila = getattr(_abiertas, 'pila', None)
+    if pila is None:
+        pila = _abiertas.pila = []
+    medida['nivel'] = len(pila)
+    registro.append(medida)
+
+    trazando = tracemalloc.is_tracing()
+    if trazando:
+        actual, pico = tracemalloc.get_traced_memory()
+        for abierta in pila:
+            abierta['_pico'] = max(abierta['_pico'], pico)
+        tracemalloc.reset_peak()
+        medida['_inicial'], medida['_pico'] = actual, actual
+    pila.append(medida)
+
+    inicio = time.perf_counter()
+    try:
+        yield medida
+    finally:
+        medida['segundos'] = time.perf_counter() - inicio
+        pila.pop()
+        if trazando and tracemalloc.is_tracing():
+            pico = max(medida.pop('_pico'), tracemalloc.get_traced_memory()[1])
+            medida['pico_bytes'] = pico - medida.pop('_inicial')
+            for abierta in pila:
+                abierta['_pico'] = max(abierta['_pico'], pico)
+        medida['rss_maximo_bytes'] = rss_maximo()
+
+
+# Función para convertir el registro en una tabla para mostrar
+def tabla_registro(registro):
+    columnas = ['etapa', 'segundos', 'filas_entrada', 'filas_salida', 'filas_eliminadas', 'pico_bytes', 'rss_maximo_bytes']
+    tabla = pd.DataFrame(registro).reindex(columns=['nivel'] + columnas)
+    tabla['etapa'] = ['  ' * int(nivel) + etapa for nivel, etapa in zip(tabla['nivel'].fillna(0), tabla['etapa'])]
+    for columna in ['pico_bytes', 'rss_maximo_bytes']:
+        tabla[columna.replace('_bytes', '_mb')] = (tabla.pop(columna) / 1024 ** 2).round(1)
+    return tabla.drop(columns='nivel').set_index('etapa')
+
+
+# Función para obtener los datos que identifican la ejecución en los registros exportados
+def contexto_ejecucion(**extra):
+    return dict({
+        'fecha': datetime.now().isoformat(timespec='seconds'),
+        'host': platform.node(),
+        'python': platform.python_version(),
+    }, **extra)
+
+
+# Función para exportar el registro como un documento JSON
+def exportar_json(registro, **contexto):
+    return json.dumps(dict(contexto_ejecucion(**contexto), etapas=registro), ensure_ascii=False, indent=2, default=str)
+
+
+# Función para emitir cada etapa del registro como una línea JSON por `logger`
+# y, si se indica `ruta`, agregarla también a ese archivo
+def registrar_log(registro, ruta=None, **contexto):
+    contexto = contexto_ejecucion(**contexto)
+    lineas = [json.dumps(dict(contexto, **medida), ensure_ascii=False, default=str) for medida in registro]
+    for linea in lineas:
+        logger.info(linea)
+    if ruta:
+        with open(ruta, 'a', encoding='utf-8') as archivo:
+            archivo.writelines(linea + '\n' for linea in lineas)
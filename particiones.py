@@ -0,0 +1,218 @@
+import argparse
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from fuentes import URL_BASE, cargar_fuentes, rutas_fuentes, rutas_snapshot, validar_esquema
+from instrumentacion import etapa
+from procesamiento import (
+    CLAVES_PARES,
+    completar_datos,
+    construir_indices_mapeo,
+    enriquecer_gasto,
+    mapear_dimensiones,
+    medir_memoria,
+    procesar_datos,
+    redistribuir_overhead,
+)
+
+# Columnas del gasto que necesita `redistribuir_overhead`
+COLUMNAS_OVERHEAD = ['Ejercicio', 'Período', 'Proceso', 'Valor/mon.inf.']
+
+
+# Función para convertir una tabla en arreglos de NumPy para enviarla a otro proceso
+#
+# Las columnas numéricas viajan como su arreglo; las de texto y las categorías
+# como códigos enteros y sus valores únicos, así cada valor repetido se envía
+# una sola vez en lugar de un objeto de Python por fila. `a_tabla` reconstruye
+# la tabla con los mismos tipos y valores.
+def a_arreglos(data):
+    columnas = []
+    for nombre in data.columns:
+        serie = data[nombre]
+        if isinstance(serie.dtype, pd.CategoricalDtype):
+            columnas.append((nombre, 'categoria', serie.cat.codes.to_numpy(), serie.cat.categories, serie.cat.ordered))
+        elif serie.dtype == object:
+            valores = serie.to_numpy()
+            codigos, unicos = pd.factorize(valores)
+            # Se conserva el nulo original (None o NaN) para reconstruir la columna igual
+            nulos = valores[codigos == -1]
+            nulo = nulos[0] if len(nulos) else None
+            tipo = np.int32 if len(unicos) < 2 ** 31 else np.int64
+            columnas.append((nombre, 'texto', codigos.astype(tipo), unicos, nulo))
+        else:
+            columnas.append((nombre, 'arreglo', serie.to_numpy() if isinstance(serie.dtype, np.dtype) else serie.array, None, None))
+    return columnas
+
+
+# Función para reconstruir una tabla enviada con `a_arreglos`
+def a_tabla(columnas):
+    data = {}
+    for nombre, tipo, valores, extra, otro in columnas:
+        if tipo == 'categoria':
+            data[nombre] = pd.Categorical.from_codes(valores, extra, ordered=otro)
+        elif tipo == 'texto':
+            # El código -1 toma el último elemento, que es el nulo
+            data[nombre] = pd.Series(np.append(extra.astype(object), np.array([otro], dtype=object))[valores], dtype=object)
+        else:
+            data[nombre] = valores
+    return pd.DataFrame(data)
+
+
+# Función para repartir las filas del gasto en particiones por grupo (Clase de coste, Centro de coste)
+#
+# Los grupos se numeran en el mismo orden que en `eliminar_pares_opuestos` y cada
+# partición recibe un tramo contiguo de grupos con una cantidad de filas parecida.
+# Como los pares solo se buscan dentro de un grupo, cada partición se procesa por
+# separado, y al concatenar los resultados en orden se obtiene el mismo orden de
+# filas que en serie. Las filas con claves nulas van en la primera partición: se
+# mapean y después se descartan igual que en serie. Devuelve las posiciones de
+# las filas de cada partición.
+def particiones_por_grupo(data0, particiones):
+    grupo = data0.groupby(CLAVES_PARES, dropna=True, observed=True).ngroup().to_numpy()
+    filas_por_grupo = np.bincount(grupo[grupo >= 0])
+    if particiones <= 1 or len(filas_por_grupo) <= 1:
+        return [np.arange(len(data0))]
+
+    # Primer grupo de cada partición, según las filas acumuladas
+    acumulado = np.cumsum(filas_por_grupo)
+    inicios = np.searchsorted(acumulado, acumulado[-1] * np.arange(1, particiones) / particiones, side='right')
+    particion = np.searchsorted(inicios, grupo, side='right')
+    particion[grupo < 0] = 0
+    posiciones = [np.flatnonzero(particion == numero) for numero in range(particiones)]
+    return [filas for filas in posiciones if len(filas)]
+
+
+# Índices de mapeo compartidos por los procesos del pool; se copian una vez por proceso
+_indices_trabajador = None
+
+
+def _iniciar_trabajador(indices):
+    global _indices_trabajador
+    _indices_trabajador = indices
+
+
+# Función que ejecuta en un proceso del pool el mapeo y el enriquecimiento de una partición
+def _enriquecer_particion(columnas):
+    data0, conteos = mapear_dimensiones(a_tabla(columnas), _indices_trabajador)
+    memoria = medir_memoria(data0)
+    gasto, removed_data = enriquecer_gasto(data0)
+    return a_arreglos(gasto), a_arreglos(removed_data), conteos, memoria
+
+
+# Función que ejecuta en un proceso del pool el reparto de Overhead de un Ejercicio
+def _overhead_particion(columnas):
+    return a_arreglos(redistribuir_overhead(a_tabla(columnas)))
+
+
+# Función para concatenar los resultados de las particiones sin que una
+# partición vacía cambie los tipos de las columnas
+def _concatenar(tablas):
+    con_filas = [data for data in tablas if len(data)]
+    return pd.concat(con_filas or tablas[:1], ignore_index=True)
+
+
+# Función equivalente a `procesar_datos` que reparte el trabajo en `procesos` procesos
+#
+# El mapeo de dimensiones, la eliminación de pares y la limpieza del gasto se
+# ejecutan por particiones de grupos (ver `particiones_por_grupo`) y el reparto
+# de Overhead por Ejercicio, cuyos períodos son independientes entre sí. Las
+# particiones viajan entre procesos como arreglos de NumPy (ver `a_arreglos`).
+# El resultado es idéntico al de `procesar_datos`, en valores, tipos y orden.
+def procesar_particionado(data0, budget_data, orders_data, base_utec_data, base_ceco_data, procesos=None, registro=None):
+    procesos = procesos or os.cpu_count()
+    if procesos <= 1:
+        return procesar_datos(data0, budget_data, orders_data, base_utec_data, base_ceco_data, registro)
+
+    validar_esquema('data0', data0)
+    validar_esquema('budget_data', budget_data)
+    validar_esquema('orders_data', orders_data)
+    validar_esquema('base_utec_data', base_utec_data)
+    validar_esquema('base_ceco_data', base_ceco_data)
+
+    data0 = data0.copy()
+    data0['id'] = range(1, len(data0) + 1)
+    memoria = {'origen': medir_memoria(data0)}
+
+    indices = construir_indices_mapeo(orders_data, base_utec_data, base_ceco_data)
+    with ProcessPoolExecutor(max_workers=procesos, initializer=_iniciar_trabajador, initargs=(indices,)) as pool:
+        with etapa(registro, 'particionar', data0) as medida:
+            particiones = [a_arreglos(data0.iloc[filas]) for filas in particiones_por_grupo(data0, procesos)]
+            medida['filas_salida'] = len(particiones)
+
+        # Mapeo, pares opuestos y limpieza por partición
+        with etapa(registro, 'enriquecer_particiones', data0) as medida:
+            resultados = list(pool.map(_enriquecer_particion, particiones))
+            gasto = _concatenar([a_tabla(resultado[0]) for resultado in resultados])
+            removed_data = _concatenar([a_tabla(resultado[1]) for resultado in resultados])
+            medida.update(filas_salida=len(gasto), filas_eliminadas=len(data0) - len(gasto))
+        del particiones
+        conteos = {clave: sum(resultado[2][clave] for resultado in resultados) for clave in resultados[0][2]}
+        memoria['mapeado'] = {
+            clave: sum(resultado[3][clave] for resultado in resultados) for clave in ('filas', 'bytes')
+        }
+        memoria['enriquecido'] = medir_memoria(gasto, removed_data)
+        del resultados
+
+        # Reparto de Overhead por Ejercicio; los Ejercicios sin Overhead no generan filas
+        with etapa(registro, 'redistribuir_overhead', gasto) as medida:
+            ejercicios = sorted(gasto.loc[gasto['Proceso'] == 'Overhead', 'Ejercicio'].dropna().unique())
+            columnas = gasto[COLUMNAS_OVERHEAD]
+            por_ejercicio = [a_arreglos(columnas[columnas['Ejercicio'] == ejercicio]) for ejercicio in ejercicios]
+            if por_ejercicio:
+                filas_nuevas_df = _concatenar([a_tabla(resultado) for resultado in pool.map(_overhead_particion, por_ejercicio)])
+            else:
+                filas_nuevas_df = redistribuir_overhead(columnas)
+            medida['filas_salida'] = len(filas_nuevas_df)
+
+    reporte = dict(conteos, duplicados=indices['duplicados'])
+    with etapa(registro, 'completar_datos', gasto) as medida:
+        datos = completar_datos(gasto, filas_nuevas_df, removed_data, budget_data, orders_data, reporte, memoria)
+        medida['filas_salida'] = len(datos['data0'])
+    return datos
+
+
+# Función para comparar el procesamiento por particiones con el procesamiento
+# en serie. Devuelve la lista de diferencias encontradas.
+def verificar_particionado(fuentes, procesos=None):
+    esperado = procesar_datos(*fuentes)
+    obtenido = procesar_particionado(*fuentes, procesos=procesos or max(2, os.cpu_count()))
+    diferencias = []
+    for clave in ['data0', 'removed_data', 'budget_data', 'orders_data']:
+        try:
+            pd.testing.assert_frame_equal(obtenido[clave], esperado[clave], check_exact=True)
+        except AssertionError as error:
+            diferencias.append(f"{clave}: {error}")
+    for clave in ['opciones', 'reporte_mapeo', 'avisos']:
+        if obtenido[clave] != esperado[clave]:
+            diferencias.append(f"{clave}: {obtenido[clave]!r} != {esperado[clave]!r}")
+    return diferencias
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compara el procesamiento por particiones en varios procesos con el procesamiento en serie")
+    parser.add_argument('--origen', default=URL_BASE, help="URL base o directorio local con los archivos CSV")
+    parser.add_argument('--snapshot', help="Directorio con un snapshot Parquet (reemplaza a --origen)")
+    parser.add_argument('--filas', type=int, help="Usa datos sintéticos con esta cantidad de filas (reemplaza a --origen)")
+    parser.add_argument('--procesos', type=int, help="Cantidad de procesos (por defecto, uno por CPU y al menos 2)")
+    args = parser.parse_args()
+
+    if args.filas:
+        # Los datos sintéticos solo se usan desde la línea de comandos
+        from sintetico import generar_fuentes
+        fuentes = generar_fuentes(args.filas)
+    else:
+        fuentes = cargar_fuentes(rutas_snapshot(args.snapshot) if args.snapshot else rutas_fuentes(args.origen))
+
+    diferencias = verificar_particionado(fuentes, args.procesos)
+    for diferencia in diferencias:
+        print(diferencia)
+    print("El procesamiento por particiones coincide con el procesamiento en serie" if not diferencias else "Se encontraron diferencias")
+    return 1 if diferencias else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
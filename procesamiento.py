@@ -0,0 +1,412 @@
+import hashlib
+
+import numpy as np
+import pandas as pd
+
+from fuentes import validar_esquema
+from instrumentacion import etapa
+
+# Columnas que definen los grupos en los que se buscan pares de valores opuestos
+CLAVES_PARES = ['Clase de coste', 'Centro de coste']
+
+# Columnas de texto de los datos procesados que se guardan como categorías
+COLUMNAS_CATEGORICAS = [
+    'Ejercicio', 'Centro de coste', 'Clase de coste', 'Proceso', 'Recinto', 'Familia_Cuenta',
+    'Grupo_Ceco', 'Denominación del objeto', 'Orden partner', 'Utec', 'Fe.contabilización',
+    'Año', 'Mes',
+]
+
+# Columnas de importes; se mantienen en float64 para no perder precisión en las sumas
+COLUMNAS_IMPORTE = ['Valor/mon.inf.', 'Presupuesto']
+
+
+# Función para identificar y eliminar pares de valores opuestos
+#
+# Cada gasto positivo queda disponible para anular un gasto negativo del mismo
+# importe absoluto dentro del mismo grupo (Clase de coste, Centro de coste).
+# Un negativo se empareja primero con un positivo del mismo período y, si no
+# lo hay, con el positivo disponible del período anterior más reciente (>= 1).
+# Un positivo posterior en el mismo período reemplaza al anterior, que queda
+# sin emparejar. Las filas con el mismo período se procesan en el orden en que
+# aparecen en `data`.
+#
+# En lugar de recorrer cada grupo con iterrows, las filas se ordenan una sola
+# vez por (grupo, importe absoluto, período) y los emparejamientos se resuelven
+# con operaciones vectorizadas:
+#   1. Dentro de cada período, un negativo precedido por un positivo se anula
+#      con él.
+#   2. Los negativos restantes cierran, como en un paréntesis, el último
+#      positivo que sobrevivió al final de un período anterior.
+def eliminar_pares_opuestos(data):
+    n = len(data)
+    grupo = data.groupby(CLAVES_PARES, dropna=True, observed=True).ngroup().to_numpy()
+    valores = data['Valor/mon.inf.'].to_numpy()
+    periodos = data['Período'].to_numpy()
+
+    # Solo participan importes distintos de cero en grupos y períodos válidos
+    candidatos = (grupo >= 0) & pd.notna(valores) & (valores != 0) & pd.notna(periodos)
+    posiciones = np.flatnonzero(candidatos)
+
+    removidas = np.zeros(n, dtype=bool)
+    if len(posiciones):
+        removidas[posiciones[_emparejar_opuestos(grupo[posiciones], valores[posiciones], periodos[posiciones])]] = True
+
+    # Las filas con claves de grupo nulas no pertenecen a ningún grupo y se descartan.
+    # El resultado queda ordenado por grupo y período, como al recorrer los grupos.
+    orden = np.lexsort((np.arange(n), periodos, grupo))
+    orden = orden[grupo[orden] >= 0]
+    filtered_df = data.iloc[orden[~removidas[orden]]]
+    removed_df = data.iloc[orden[removidas[orden]]]
+    return filtered_df, removed_df
+
+
+# Función auxiliar que devuelve, para las filas candidatas, cuáles forman un par
+def _emparejar_opuestos(grupo, valores, periodos):
+    negativo = valores < 0
+    importe, _ = pd.factorize(np.abs(valores))
+    periodos = periodos.astype(np.int64)
+
+    # Los períodos < 1 nunca se emparejan con otros períodos, así que cada uno
+    # forma su propia secuencia; todos los períodos >= 1 comparten una
+    tramo = np.where(periodos >= 1, 1, periodos)
+    secuencia, _ = pd.factorize(pd.MultiIndex.from_arrays([grupo, importe, tramo]))
+
+    orden = np.lexsort((np.arange(len(valores)), periodos, secuencia))
+    sec = secuencia[orden]
+    per = periodos[orden]
+    neg = negativo[orden]
+
+    mismo_periodo_prev = np.zeros(len(orden), dtype=bool)
+    mismo_periodo_prev[1:] = (sec[1:] == sec[:-1]) & (per[1:] == per[:-1])
+    mismo_periodo_sig = np.zeros(len(orden), dtype=bool)
+    mismo_periodo_sig[:-1] = mismo_periodo_prev[1:]
+
+    prev_positivo = np.zeros(len(orden), dtype=bool)
+    prev_positivo[1:] = ~neg[:-1]
+    prev_positivo &= mismo_periodo_prev
+
+    pares = np.zeros(len(orden), dtype=bool)
+
+    # Paso 1: coincidencias en el mismo período
+    cierre_mismo = neg & prev_positivo
+    pares[cierre_mismo] = True
+    pares[np.flatnonzero(cierre_mismo) - 1] = True
+
+    # Paso 2: coincidencias con períodos anteriores
+    cierre_anterior = neg & ~prev_positivo
+    sobreviviente = ~neg & ~mismo_periodo_sig
+    fichas = np.flatnonzero(cierre_anterior | sobreviviente)
+    if len(fichas):
+        sec_fichas = sec[fichas]
+        paso = np.where(sobreviviente[fichas], 1, -1)
+        acumulado = pd.Series(paso).groupby(sec_fichas).cumsum()
+        minimo = np.minimum(acumulado.groupby(sec_fichas).cummin().to_numpy(), 0)
+        profundidad = acumulado.to_numpy() - minimo
+        profundidad_prev = np.zeros(len(fichas), dtype=profundidad.dtype)
+        profundidad_prev[1:] = np.where(sec_fichas[1:] == sec_fichas[:-1], profundidad[:-1], 0)
+        # Un cierre con la pila vacía no encuentra pareja
+        con_pareja = ~((paso == -1) & (profundidad_prev == 0))
+        nivel = np.where(paso == 1, profundidad, profundidad_prev)
+
+        fichas = fichas[con_pareja]
+        paso = paso[con_pareja]
+        orden_nivel = np.lexsort((fichas, nivel[con_pareja], sec_fichas[con_pareja]))
+        cierres = np.flatnonzero(paso[orden_nivel] == -1)
+        pares[fichas[orden_nivel[cierres]]] = True
+        pares[fichas[orden_nivel[cierres - 1]]] = True
+
+    resultado = np.zeros(len(orden), dtype=bool)
+    resultado[orden] = pares
+    return resultado
+
+
+# Función para redistribuir el gasto de "Overhead" entre los demás procesos
+#
+# El Overhead de cada (Ejercicio, Período) se reparte según la proporción que
+# cada combinación de `claves` representa en `base` para ese mismo período.
+# Por defecto `base` es el gasto real sin Overhead de `data`, pero puede ser
+# cualquier tabla con 'Ejercicio', 'Período', las `claves` y 'Valor/mon.inf.'
+# (por ejemplo `base_presupuesto(budget_data)` para repartir según presupuesto).
+# Si `base` incluye una columna 'Escenario', se calcula el reparto de todos los
+# escenarios en la misma pasada y el resultado conserva esa columna.
+def redistribuir_overhead(data, claves=('Proceso',), base=None):
+    claves = list(claves)
+    periodo = ['Ejercicio', 'Período']
+    es_overhead = data['Proceso'] == 'Overhead'
+    if base is None:
+        base = data[~es_overhead]
+    grupo = periodo + (['Escenario'] if 'Escenario' in base.columns else [])
+
+    # Pasos 1 a 3: gasto por período y clave, y su proporción sobre el total del período
+    gasto_base = base.groupby(grupo + claves, dropna=False, observed=True)['Valor/mon.inf.'].sum().reset_index()
+    gasto_base['Proporción'] = gasto_base['Valor/mon.inf.'] / gasto_base.groupby(grupo)['Valor/mon.inf.'].transform('sum')
+
+    # Paso 4: total de "Overhead" por período
+    gasto_overhead = data[es_overhead].groupby(periodo)['Valor/mon.inf.'].sum().reset_index()
+
+    # Paso 5: una fila por período y clave con el monto redistribuido
+    filas_nuevas = gasto_overhead.merge(gasto_base[grupo + claves + ['Proporción']], on=periodo)
+    filas_nuevas['Valor/mon.inf.'] = filas_nuevas['Valor/mon.inf.'] * filas_nuevas['Proporción']
+    return filas_nuevas[grupo + claves + ['Valor/mon.inf.']]
+
+
+# Función para usar el presupuesto como base de reparto del Overhead
+def base_presupuesto(budget_data):
+    base = budget_data[budget_data['Proceso'] != 'Overhead'].rename(
+        columns={'Año': 'Ejercicio', 'Mes': 'Período', 'Presupuesto': 'Valor/mon.inf.'}
+    )
+    base['Ejercicio'] = base['Ejercicio'].astype(str)
+    base['Período'] = pd.to_numeric(base['Período'], errors='coerce')
+    return base
+
+
+# Función para eliminar filas con valores específicos en "Grupo_Ceco"
+def eliminar_filas_grupo_ceco(data):
+    valores_excluir = ["Abastecimiento y contratos", "Finanzas", "Servicios generales"]
+    return data[~data['Grupo_Ceco'].isin(valores_excluir)]
+
+
+# Función para convertir una columna a texto sin transformar los nulos en "nan"
+def a_texto(serie):
+    return serie.astype(str).where(serie.notna())
+
+
+# Función para guardar una tabla con las dimensiones como categorías y los
+# números enteros en el tipo más pequeño que los contiene
+def compactar(data):
+    data = data.copy()
+    for columna in data.columns:
+        if columna in COLUMNAS_CATEGORICAS:
+            data[columna] = data[columna].astype('category')
+        elif columna not in COLUMNAS_IMPORTE and pd.api.types.is_numeric_dtype(data[columna]):
+            data[columna] = pd.to_numeric(data[columna], downcast='integer')
+    return data
+
+
+# Función para medir el tamaño en memoria de una o varias tablas
+def medir_memoria(*tablas):
+    return {
+        'filas': sum(len(data) for data in tablas),
+        'bytes': int(sum(data.memory_usage(index=True, deep=True).sum() for data in tablas)),
+    }
+
+
+# Función para entregar a una sesión una vista de datos compartidos entre sesiones
+#
+# Recorre diccionarios y listas y reemplaza cada DataFrame por `copy(deep=False)`.
+# Con el modo copy-on-write de pandas activo, la vista no copia los datos: los
+# comparte con la tabla original y solo copia una columna si la sesión la
+# modifica, de modo que una sesión no puede alterar lo que ven las demás.
+def vista_compartida(datos):
+    if isinstance(datos, pd.DataFrame):
+        return datos.copy(deep=False)
+    if isinstance(datos, dict):
+        return {clave: vista_compartida(valor) for clave, valor in datos.items()}
+    if isinstance(datos, list):
+        return [vista_compartida(valor) for valor in datos]
+    return datos
+
+
+# Función para calcular una huella del contenido de los DataFrames de origen
+def huella_datos(*fuentes):
+    huella = hashlib.sha256()
+    for data in fuentes:
+        huella.update(repr(list(data.columns)).encode('utf-8'))
+        huella.update(pd.util.hash_pandas_object(data, index=False).to_numpy().tobytes())
+    return huella.hexdigest()
+
+
+# Función que ejecuta todo el enriquecimiento de los datos de origen
+#
+# Devuelve un diccionario con el gasto real procesado ('data0'), las filas
+# eliminadas como pares opuestos ('removed_data'), el presupuesto y las órdenes
+# listos para filtrar, las opciones de los filtros laterales, el reporte del
+# mapeo de dimensiones y los avisos que la aplicación debe mostrar. No modifica
+# los DataFrames recibidos. Si se entrega `registro`, se agrega a esa lista el
+# tiempo, la memoria y las filas de cada etapa (ver instrumentacion.py).
+def procesar_datos(data0, budget_data, orders_data, base_utec_data, base_ceco_data, registro=None):
+    # Verificar que las columnas necesarias están presentes en los DataFrames cargados
+    validar_esquema('data0', data0)
+    validar_esquema('budget_data', budget_data)
+    validar_esquema('orders_data', orders_data)
+    validar_esquema('base_utec_data', base_utec_data)
+    validar_esquema('base_ceco_data', base_ceco_data)
+
+    data0 = data0.copy()
+    data0['id'] = range(1, len(data0) + 1)
+    memoria = {'origen': medir_memoria(data0)}
+
+    with etapa(registro, 'mapear_dimensiones', data0) as medida:
+        indices = construir_indices_mapeo(orders_data, base_utec_data, base_ceco_data)
+        data0, conteos = mapear_dimensiones(data0, indices)
+        medida['filas_salida'] = len(data0)
+    memoria['mapeado'] = medir_memoria(data0)
+    gasto, removed_data = enriquecer_gasto(data0, registro)
+    memoria['enriquecido'] = medir_memoria(gasto, removed_data)
+
+    # Pasos 1 a 5: Repartir el gasto de "Overhead" entre los procesos según su proporción del gasto mensual
+    with etapa(registro, 'redistribuir_overhead', gasto) as medida:
+        filas_nuevas_df = redistribuir_overhead(gasto)
+        medida['filas_salida'] = len(filas_nuevas_df)
+
+    reporte = dict(conteos, duplicados=indices['duplicados'])
+    with etapa(registro, 'completar_datos', gasto) as medida:
+        datos = completar_datos(gasto, filas_nuevas_df, removed_data, budget_data, orders_data, reporte, memoria)
+        medida['filas_salida'] = len(datos['data0'])
+    return datos
+
+
+# Función para construir los índices clave -> dimensiones usados en el mapeo
+#
+# Cada tabla de mapeo se reduce a una fila por clave (se conserva la primera),
+# así una clave repetida no multiplica las filas de gasto; la cantidad de
+# claves repetidas queda en 'duplicados'. Los códigos Ceco se comparan como
+# texto, igual que en el mapeo original.
+def construir_indices_mapeo(orders_data, base_utec_data, base_ceco_data):
+    base_ceco_data = base_ceco_data[['Ceco', 'Proceso', 'Recinto']].astype(object)
+    base_ceco_data['Ceco'] = base_ceco_data['Ceco'].astype(str)
+    return {
+        'ordenes': orders_data.drop_duplicates('Orden').set_index('Orden')['Utec'],
+        'utec': base_utec_data.drop_duplicates('Utec').set_index('Utec')[['Proceso', 'Recinto']],
+        'ceco': base_ceco_data.drop_duplicates('Ceco').set_index('Ceco'),
+        'duplicados': {
+            'orders_data': int(orders_data['Orden'].duplicated().sum()),
+            'base_utec_data': int(base_utec_data['Utec'].duplicated().sum()),
+            'base_ceco_data': int(base_ceco_data['Ceco'].duplicated().sum()),
+        },
+    }
+
+
+# Función para asignar Utec, Proceso y Recinto a cada fila de gasto en una sola pasada
+#
+# Primero se busca la Utec de la 'Orden partner' y su Proceso y Recinto en
+# Base_UTEC. Las filas que quedan sin Proceso ni Recinto los toman de Base_Ceco
+# según su 'Centro de coste'. Devuelve también los conteos de filas mapeadas.
+def mapear_dimensiones(data0, indices):
+    data0 = data0.copy()
+    utec = data0['Orden partner'].map(indices['ordenes']).astype(object)
+    proceso = utec.map(indices['utec']['Proceso']).astype(object)
+    recinto = utec.map(indices['utec']['Recinto']).astype(object)
+
+    # Mapeo por Ceco para las filas sin Proceso ni Recinto
+    sin_dimensiones = proceso.isna() & recinto.isna()
+    centro = data0.loc[sin_dimensiones, 'Centro de coste'].astype(str)
+    proceso[sin_dimensiones] = centro.map(indices['ceco']['Proceso'])
+    recinto[sin_dimensiones] = centro.map(indices['ceco']['Recinto'])
+
+    data0['Utec'] = utec
+    data0['Proceso'] = proceso
+    data0['Recinto'] = recinto
+
+    con_orden = data0['Orden partner'].notna()
+    conteos = {
+        'filas': len(data0),
+        'orden_sin_utec': int((con_orden & utec.isna()).sum()),
+        'utec_sin_proceso': int((utec.notna() & sin_dimensiones).sum()),
+        'por_ceco': int((sin_dimensiones & (proceso.notna() | recinto.notna())).sum()),
+        'sin_mapeo': int((proceso.isna() & recinto.isna()).sum()),
+    }
+    return data0, conteos
+
+
+# Función para eliminar los pares opuestos y las filas de Grupo_Ceco excluidas
+# del gasto ya mapeado por `mapear_dimensiones`
+#
+# `data0` debe traer la columna 'id' con la posición de cada fila en el archivo
+# de origen. El resultado de cada fila solo depende de su grupo (Clase de coste,
+# Centro de coste), de modo que puede calcularse sobre un subconjunto de grupos
+# y combinarse después (ver incremental.py).
+def enriquecer_gasto(data0, registro=None):
+    with etapa(registro, 'tipar_gasto', data0) as medida:
+        data0 = tipar_gasto(data0)
+        medida['filas_salida'] = len(data0)
+
+    # Ejecutar `eliminar_pares_opuestos`
+    with etapa(registro, 'eliminar_pares_opuestos', data0) as medida:
+        data0, removed_data = eliminar_pares_opuestos(data0)  # Capturar ambos DataFrames
+        medida.update(filas_salida=len(data0), filas_eliminadas=len(removed_data))
+
+    return limpiar_gasto(data0, registro), removed_data.reset_index(drop=True)
+
+
+# Función para asegurarse de que 'Ejercicio' es de tipo string y 'Período' y 'Valor/mon.inf.' numéricos
+def tipar_gasto(data0):
+    data0 = data0.copy()
+    data0['Ejercicio'] = a_texto(data0['Ejercicio'])
+    data0['Período'] = pd.to_numeric(data0['Período'].astype(str), errors='coerce')
+    data0['Valor/mon.inf.'] = pd.to_numeric(data0['Valor/mon.inf.'], errors='coerce')
+    return data0
+
+
+# Función para quitar las filas de Grupo_Ceco excluidas y normalizar 'Centro de coste'
+def limpiar_gasto(data0, registro=None):
+    with etapa(registro, 'eliminar_filas_grupo_ceco', data0) as medida:
+        filas = len(data0)
+        data0 = eliminar_filas_grupo_ceco(data0).copy()
+        medida.update(filas_salida=len(data0), filas_eliminadas=filas - len(data0))
+
+    # Limpieza y normalización de los valores
+    data0['Centro de coste'] = data0['Centro de coste'].str.strip().str.upper()
+
+    return data0.reset_index(drop=True)
+
+
+# Función para incorporar el Overhead redistribuido y dejar listos los datos para la aplicación
+#
+# `memoria` trae el tamaño de las etapas anteriores (ver `medir_memoria`); se
+# completa con el de las tablas finales, que se guardan compactadas.
+def completar_datos(data0, filas_nuevas_df, removed_data, budget_data, orders_data, reporte, memoria):
+    budget_data = budget_data.copy()
+    budget_data['Año'] = a_texto(budget_data['Año'])
+    budget_data['Mes'] = a_texto(budget_data['Mes'])
+
+    # Paso 6: Agregar las nuevas filas al DataFrame original
+    data0 = pd.concat([data0, filas_nuevas_df], ignore_index=True)
+
+    # Paso 7: Eliminar las filas correspondientes a "Overhead"
+    data0 = data0[data0['Proceso'] != 'Overhead']
+
+    # Guardar las dimensiones como categorías y los enteros en el tipo más pequeño
+    data0 = compactar(data0)
+    removed_data = compactar(removed_data)
+    budget_data = compactar(budget_data)
+    memoria = dict(memoria, procesado=medir_memoria(data0, removed_data), presupuesto=medir_memoria(budget_data))
+
+    # Opciones de los filtros laterales, calculadas una sola vez por conjunto de datos
+    opciones = {
+        'Año': ['2024'] + sorted(data0['Ejercicio'].dropna().unique()),
+        'Proceso': ['Todos'] + [proceso for proceso in sorted(data0['Proceso'].dropna().unique()) if proceso != 'Overhead'],
+        'Clase de coste': ['Todos'] + sorted(data0['Clase de coste'].dropna().unique()),
+        'Recinto': ['Todos'] + [recinto for recinto in sorted(data0['Recinto'].dropna().unique()) if recinto != 'Overhead'],
+    }
+
+    avisos = [
+        f"{nombre}: {cantidad} claves duplicadas, se usa la primera fila de cada una"
+        for nombre, cantidad in reporte['duplicados'].items() if cantidad
+    ]
+
+    return {
+        'data0': data0,
+        'removed_data': removed_data,
+        'budget_data': budget_data,
+        'orders_data': orders_data,
+        'opciones': opciones,
+        'reporte_mapeo': reporte,
+        'avisos': avisos,
+        'memoria': memoria,
+    }
+
+
+# Aplicar filtros seleccionados a los DataFrames
+def aplicar_filtros(data, opcion_año, opcion_proceso, opcion_fam_cuenta, opcion_clase_coste, opcion_recinto, col_año):
+    if opcion_año != 'Todos':
+        data = data[data[col_año] == opcion_año]
+    if opcion_proceso != 'Todos':
+        data = data[data['Proceso'] == opcion_proceso]
+    if opcion_fam_cuenta != 'Todos':
+        data = data[data['Familia_Cuenta'] == opcion_fam_cuenta]
+    if opcion_clase_coste != 'Todos':
+        data = data[data['Clase de coste'] == opcion_clase_coste]
+    if opcion_recinto != 'Todos':
+        data = data[data['Recinto'] == opcion_recinto]
+    return data
@@ -0,0 +1,336 @@
+import argparse
+import io
+import itertools
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from cubo import construir_cubo, consultar_cubo
+from fuentes import URL_BASE, cargar_fuentes, rutas_fuentes, rutas_snapshot
+from incremental import procesar_incremental
+from instrumentacion import etapa
+from particiones import procesar_particionado
+from procesamiento import aplicar_filtros, medir_memoria, procesar_datos
+
+# Lista fija de opciones para 'Familia_Cuenta'
+OPCIONES_FAM_CUENTA = ['Todos', 'Servicios', 'Materiales']
+
+# Filtros de un reporte, en el orden en que los recibe `consultar_cubo`
+FILTROS = ['Año', 'Proceso', 'Familia_Cuenta', 'Clase de coste', 'Recinto']
+
+# Tablas que se generan para cada combinación de filtros en modo batch
+TABLAS = ['gasto_vs_presupuesto', 'gasto_acumulado', 'tipos_orden']
+
+# Porcentaje del presupuesto ejecutado hasta el que el cumplimiento es verde y
+# hasta el que es amarillo; por encima es rojo
+LIMITE_VERDE = 100
+LIMITE_AMARILLO = 110
+
+
+# Función para convertir DataFrame a CSV
+def convertir_a_csv(df):
+    buffer = io.StringIO()
+    df.to_csv(buffer, index=False, sep=';')
+    buffer.seek(0)
+    return buffer.getvalue()
+
+
+# Función para construir el conjunto de datos procesado y su cubo agregado a
+# partir de las cinco tablas de origen. Con `directorio_incremental` se
+# reutiliza el último resultado guardado (ver incremental.py) y con `procesos`
+# mayor que 1 se procesa por particiones en varios procesos (ver particiones.py).
+# Las etapas medidas se agregan a `registro`, si se entrega.
+def construir_datos(fuentes, directorio_incremental=None, registro=None, procesos=None):
+    if directorio_incremental:
+        datos = procesar_incremental(directorio_incremental, *fuentes, registro=registro)
+    elif procesos and procesos > 1:
+        datos = procesar_particionado(*fuentes, procesos=procesos, registro=registro)
+    else:
+        datos = procesar_datos(*fuentes, registro=registro)
+    with etapa(registro, 'construir_cubo', datos['data0']) as medida:
+        datos['cubo'] = construir_cubo(datos['data0'], datos['budget_data'], datos['orders_data'])
+        medida['filas_salida'] = sum(len(tabla) for tabla in datos['cubo'].values())
+    datos['memoria']['cubo'] = medir_memoria(*datos['cubo'].values())
+    return datos
+
+
+# Función para preparar el gasto real (en millones) y el presupuestado por año y mes
+def preparar_gasto(consulta):
+    gasto_real = consulta['gasto_real']
+    gasto_real['Valor/mon.inf.'] = (gasto_real['Valor/mon.inf.'] / 1000000).round(1)  # Convertir a millones con un decimal
+    gasto_real = gasto_real.rename(columns={'Ejercicio': 'Año', 'Período': 'Mes'})
+
+    gasto_presupuestado = consulta['gasto_presupuestado']
+    gasto_presupuestado['Presupuesto'] = gasto_presupuestado['Presupuesto'].round(1)
+
+    # Asegurarse de que las columnas son del mismo tipo
+    gasto_real['Año'] = gasto_real['Año'].astype(str)
+    gasto_real['Mes'] = gasto_real['Mes'].astype(int)  # Convertir a entero para orden correcto
+    gasto_presupuestado['Año'] = gasto_presupuestado['Año'].astype(str)
+    gasto_presupuestado['Mes'] = gasto_presupuestado['Mes'].astype(int)  # Convertir a entero para orden correcto
+
+    return gasto_real, gasto_presupuestado
+
+
+# Función para crear la tabla combinada de gasto real vs presupuestado
+def tabla_gasto_vs_presupuesto(gasto_real, gasto_presupuestado):
+    combined_data = pd.merge(gasto_real, gasto_presupuestado, on=['Año', 'Mes'], how='outer').fillna(0)
+
+    combined_data['Diferencia'] = combined_data['Valor/mon.inf.'] - combined_data['Presupuesto']
+
+    # Ordenar las columnas de manera ascendente
+    return combined_data.sort_values(by=['Año', 'Mes'])
+
+
+# Función para obtener el color según el porcentaje del presupuesto ejecutado
+def color_cumplimiento(porcentaje):
+    if porcentaje is None:
+        return 'grey'
+    if porcentaje <= LIMITE_VERDE:
+        return 'green'
+    if porcentaje <= LIMITE_AMARILLO:
+        return 'yellow'
+    return 'red'
+
+
+# Función para calcular el gasto acumulado real y presupuestado hasta el último mes con gasto real
+def gasto_acumulado(gasto_real, gasto_presupuestado):
+    ultimo_mes_real = gasto_real['Mes'].max()
+    gasto_acumulado_real = gasto_real[gasto_real['Mes'] <= ultimo_mes_real]['Valor/mon.inf.'].sum()
+
+    # Verificar si hay datos presupuestados antes de calcular el gasto acumulado presupuestado
+    if not gasto_presupuestado[gasto_presupuestado['Mes'] <= ultimo_mes_real].empty:
+        gasto_acumulado_presupuestado = gasto_presupuestado[gasto_presupuestado['Mes'] <= ultimo_mes_real]['Presupuesto'].sum()
+    else:
+        gasto_acumulado_presupuestado = None
+
+    if gasto_acumulado_presupuestado is not None and gasto_acumulado_presupuestado != 0:
+        porcentaje = (gasto_acumulado_real / gasto_acumulado_presupuestado) * 100
+    else:
+        porcentaje = None
+
+    return {
+        'real': gasto_acumulado_real,
+        'presupuestado': gasto_acumulado_presupuestado,
+        'porcentaje': porcentaje,
+        'color': color_cumplimiento(porcentaje),
+    }
+
+
+# Función para calcular el gasto acumulado real y presupuestado, el porcentaje
+# y el color de cada grupo de `dimensiones`, a partir de una consulta de
+# `consultar_cubo_por_grupo`
+#
+# Los valores son los mismos que da `gasto_acumulado` para cada combinación por
+# separado, pero se calculan por grupo sobre todas las filas a la vez: el gasto
+# en millones se redondea por año y mes, el presupuesto se suma hasta el último
+# mes con gasto real de cada grupo y el color es 'grey' si el grupo no tiene
+# presupuesto en esos meses o es cero. Solo aparecen los grupos con gasto real.
+def cumplimiento_por_grupo(consulta, dimensiones):
+    gasto_real = consulta['gasto_real']
+    real = gasto_real[dimensiones].assign(
+        real=(gasto_real['Valor/mon.inf.'] / 1000000).round(1),
+        Mes=gasto_real['Período'].astype(int),
+    )
+    real = real.groupby(dimensiones, observed=True).agg(real=('real', 'sum'), ultimo_mes=('Mes', 'max')).reset_index()
+
+    gasto_presupuestado = consulta['gasto_presupuestado']
+    presupuesto = gasto_presupuestado[dimensiones].assign(
+        presupuestado=gasto_presupuestado['Presupuesto'].round(1),
+        Mes=gasto_presupuestado['Mes'].astype(int),
+    )
+    # Último mes con gasto real del grupo de cada fila del presupuesto
+    ultimo_mes = presupuesto[dimensiones].merge(real[dimensiones + ['ultimo_mes']], on=dimensiones, how='left')['ultimo_mes']
+    presupuesto = presupuesto[presupuesto['Mes'].to_numpy() <= ultimo_mes.to_numpy()]
+    presupuesto = presupuesto.groupby(dimensiones, observed=True)['presupuestado'].sum().reset_index()
+
+    resultado = real.drop(columns='ultimo_mes').merge(presupuesto, on=dimensiones, how='left')
+    resultado['porcentaje'] = resultado['real'] / resultado['presupuestado'].where(resultado['presupuestado'] != 0) * 100
+    resultado['color'] = np.select(
+        [resultado['porcentaje'] <= LIMITE_VERDE, resultado['porcentaje'] <= LIMITE_AMARILLO, resultado['porcentaje'] > LIMITE_AMARILLO],
+        ['green', 'yellow', 'red'],
+        'grey',
+    )
+    return resultado
+
+
+# Función para calcular las métricas de cada tipo de orden
+def tabla_tipos_orden(consulta):
+    tipo_orden_metrics = consulta['tipo_orden']
+
+    # Calcular el valor OT medio
+    tipo_orden_metrics['valor_ot_media'] = tipo_orden_metrics['gasto'] / tipo_orden_metrics['cantidad_ordenes']
+
+    # Seleccionar columnas específicas para mostrar
+    tipo_orden_metrics_display = tipo_orden_metrics[['Clase de orden', 'cantidad_ordenes', 'gasto', 'valor_ot_media']]
+
+    # Renombrar las columnas para la visualización
+    tipo_orden_metrics_display.columns = ['Tipo de orden', 'Cantidad de ordenes', 'Gasto', 'Valor OT media']
+
+    # Redondear valor_ot_media a 0 decimales
+    tipo_orden_metrics_display['Valor OT media'] = tipo_orden_metrics_display['Valor OT media'].round(0).astype(int)
+
+    return tipo_orden_metrics_display
+
+
+# Función para obtener los 5 mayores gastos de las filas de detalle filtradas
+def top_5_gastos(data0, opcion_año, opcion_proceso, opcion_fam_cuenta, opcion_clase_coste, opcion_recinto):
+    data0 = aplicar_filtros(data0, opcion_año, opcion_proceso, opcion_fam_cuenta, opcion_clase_coste, opcion_recinto, 'Ejercicio')
+
+    # Filtrar filas con 'Centro de coste' no vacío
+    data0_filtered = data0[data0['Centro de coste'].notna() & (data0['Centro de coste'] != '')]
+
+    # Filtrar y ordenar data0 para obtener los 5 mayores gastos
+    data0_sorted = data0_filtered.sort_values(by='Valor/mon.inf.', ascending=False)
+    top_5_gastos = data0_sorted.head(5)
+
+    # Seleccionar columnas específicas para mostrar
+    return top_5_gastos[['Centro de coste', 'Denominación del objeto', 'Grupo_Ceco', 'Fe.contabilización', 'Valor/mon.inf.']]
+
+
+# Función para calcular las tablas del reporte de una combinación de filtros
+# usando solo el cubo agregado
+def generar_reporte(cubo, opcion_año, opcion_proceso, opcion_fam_cuenta, opcion_clase_coste, opcion_recinto):
+    consulta = consultar_cubo(cubo, opcion_año, opcion_proceso, opcion_fam_cuenta, opcion_clase_coste, opcion_recinto)
+    gasto_real, gasto_presupuestado = preparar_gasto(consulta)
+    acumulado = gasto_acumulado(gasto_real, gasto_presupuestado)
+    return {
+        'gasto_vs_presupuesto': tabla_gasto_vs_presupuesto(gasto_real, gasto_presupuestado),
+        'gasto_acumulado': pd.DataFrame([acumulado]),
+        'tipos_orden': tabla_tipos_orden(consulta),
+    }
+
+
+# Función para obtener la lista de combinaciones de filtros a partir de una
+# lista de valores por filtro. El valor '*' se reemplaza por todas las opciones
+# del filtro; el resto se busca entre las opciones según su texto.
+def combinaciones_filtros(opciones, valores):
+    listas = []
+    for filtro in FILTROS:
+        disponibles = list(dict.fromkeys(opciones[filtro]))
+        seleccion = []
+        for valor in valores.get(filtro, ['Todos']):
+            if valor == '*':
+                seleccion.extend(opcion for opcion in disponibles if opcion != 'Todos')
+                continue
+            if valor == 'Todos':
+                seleccion.append(valor)
+                continue
+            coincidencias = [opcion for opcion in disponibles if _coincide(opcion, valor)]
+            if not coincidencias:
+                raise ValueError(f"{valor!r} no es una opción de {filtro}")
+            seleccion.extend(coincidencias)
+        listas.append(list(dict.fromkeys(seleccion)))
+    return list(itertools.product(*listas))
+
+
+# Función auxiliar para comparar una opción con el texto recibido; las clases
+# de coste numéricas aceptan también el número sin decimales
+def _coincide(opcion, valor):
+    if str(opcion) == str(valor):
+        return True
+    return isinstance(opcion, float) and opcion.is_integer() and str(int(opcion)) == str(valor)
+
+
+# Función para leer una lista de combinaciones desde un CSV separado por ';'
+# con una columna por filtro; los filtros que faltan valen 'Todos'
+def leer_combinaciones(ruta, opciones):
+    tabla = pd.read_csv(ruta, sep=';', dtype=str).fillna('Todos')
+    combinaciones = []
+    for fila in tabla.to_dict('records'):
+        combinaciones.extend(combinaciones_filtros(opciones, {filtro: [fila.get(filtro, 'Todos')] for filtro in FILTROS}))
+    return combinaciones
+
+
+# Cubo compartido por los procesos del pool; se copia una vez por proceso
+_cubo_trabajador = None
+
+
+def _iniciar_trabajador(cubo):
+    global _cubo_trabajador
+    _cubo_trabajador = cubo
+
+
+def _reporte_combinacion(combinacion):
+    return generar_reporte(_cubo_trabajador, *combinacion)
+
+
+# Función para calcular los reportes de varias combinaciones de filtros en
+# paralelo. Devuelve, por tabla, un DataFrame con las filas de todas las
+# combinaciones precedidas por las columnas 'Filtro <filtro>'.
+def generar_reportes(cubo, combinaciones, procesos=None):
+    if procesos == 1:
+        _iniciar_trabajador(cubo)
+        reportes = [_reporte_combinacion(combinacion) for combinacion in combinaciones]
+    else:
+        with ProcessPoolExecutor(max_workers=procesos, initializer=_iniciar_trabajador, initargs=(cubo,)) as pool:
+            reportes = list(pool.map(_reporte_combinacion, combinaciones, chunksize=max(1, len(combinaciones) // 64)))
+
+    columnas = [f"Filtro {filtro}" for filtro in FILTROS]
+    resultado = {}
+    for tabla in TABLAS:
+        partes = []
+        for combinacion, reporte in zip(combinaciones, reportes):
+            filtros = pd.DataFrame([[str(valor) for valor in combinacion]] * len(reporte[tabla]), columns=columnas, index=reporte[tabla].index)
+            partes.append(pd.concat([filtros, reporte[tabla]], axis=1))
+        resultado[tabla] = pd.concat(partes, ignore_index=True) if partes else pd.DataFrame(columns=columnas)
+    return resultado
+
+
+# Función para escribir las tablas de los reportes en `destino`, en CSV con
+# separador ';' o en Parquet
+def escribir_reportes(reportes, destino, formato='csv'):
+    os.makedirs(destino, exist_ok=True)
+    for tabla, data in reportes.items():
+        ruta = os.path.join(destino, f"{tabla}.{formato}")
+        if formato == 'parquet':
+            data.to_parquet(ruta, index=False)
+        else:
+            with open(ruta, 'w', encoding='utf-8', newline='') as archivo:
+                archivo.write(convertir_a_csv(data))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Genera los reportes del monitor para varias combinaciones de filtros sin abrir la aplicación")
+    parser.add_argument('destino', help="Directorio donde se escriben las tablas")
+    parser.add_argument('--origen', default=URL_BASE, help="URL base o directorio local con los archivos CSV")
+    parser.add_argument('--snapshot', help="Directorio con un snapshot Parquet (reemplaza a --origen)")
+    parser.add_argument('--incremental', help="Directorio con el resultado del último procesamiento")
+    parser.add_argument('--año', nargs='+', default=['Todos'], help="Años a reportar ('*' = todos por separado)")
+    parser.add_argument('--proceso', nargs='+', default=['Todos'], help="Procesos a reportar ('*' = todos por separado)")
+    parser.add_argument('--familia-cuenta', nargs='+', default=['Todos'], help="Familias de cuenta a reportar ('*' = todas por separado)")
+    parser.add_argument('--clase-coste', nargs='+', default=['Todos'], help="Clases de coste a reportar ('*' = todas por separado)")
+    parser.add_argument('--recinto', nargs='+', default=['Todos'], help="Recintos a reportar ('*' = todos por separado)")
+    parser.add_argument('--combinaciones', help="CSV separado por ';' con una combinación de filtros por fila (reemplaza a la grilla)")
+    parser.add_argument('--formato', choices=['csv', 'parquet'], default='csv')
+    parser.add_argument('--procesos', type=int, help="Cantidad de procesos en paralelo; con más de 1 también se procesa el gasto por particiones (por defecto, reportes con uno por CPU y procesamiento en serie)")
+    args = parser.parse_args()
+
+    rutas = rutas_snapshot(args.snapshot) if args.snapshot else rutas_fuentes(args.origen)
+    datos = construir_datos(cargar_fuentes(rutas), args.incremental, procesos=args.procesos)
+    opciones = dict(datos['opciones'], Familia_Cuenta=OPCIONES_FAM_CUENTA)
+
+    try:
+        if args.combinaciones:
+            combinaciones = leer_combinaciones(args.combinaciones, opciones)
+        else:
+            combinaciones = combinaciones_filtros(opciones, {
+                'Año': args.año,
+                'Proceso': args.proceso,
+                'Familia_Cuenta': args.familia_cuenta,
+                'Clase de coste': args.clase_coste,
+                'Recinto': args.recinto,
+            })
+    except ValueError as error:
+        parser.error(str(error))
+
+    escribir_reportes(generar_reportes(datos['cubo'], combinaciones, args.procesos), args.destino, args.formato)
+    print(f"{len(combinaciones)} combinaciones escritas en {args.destino}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,149 @@
+import argparse
+import functools
+import hashlib
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+from fuentes import ARCHIVOS, cargar_fuentes, leer_csv, rutas_fuentes
+
+
+# Servidor HTTP que sirve un directorio como lo haría S3: responde con ETag y
+# Last-Modified, y con 304 a los GET condicionales cuyo archivo no cambió.
+# `demora` agrega una espera a cada respuesta para simular la latencia de red y
+# `falla` responde a todos los pedidos con ese código de error.
+class ManejadorCondicional(SimpleHTTPRequestHandler):
+    demora = 0
+    falla = None
+    pedidos = None
+
+    def send_head(self):
+        time.sleep(self.demora)
+        if self.falla:
+            self.send_error(self.falla)
+            return None
+        self._etag = None
+        ruta = self.translate_path(self.path)
+        if os.path.isfile(ruta):
+            with open(ruta, 'rb') as archivo:
+                self._etag = '"' + hashlib.md5(archivo.read()).hexdigest() + '"'
+            if self.headers.get('If-None-Match') == self._etag:
+                self.send_response(304)
+                self.end_headers()
+                return None
+        # SimpleHTTPRequestHandler ya responde 304 según If-Modified-Since
+        return super().send_head()
+
+    def send_response(self, code, message=None):
+        if self.pedidos is not None:
+            self.pedidos.append((os.path.basename(self.path), int(code)))
+        super().send_response(code, message)
+
+    def end_headers(self):
+        if getattr(self, '_etag', None):
+            self.send_header('ETag', self._etag)
+        super().end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+# Función para iniciar el servidor en un hilo. Devuelve el servidor, su URL base
+# y la lista donde se anota cada respuesta como (archivo, código).
+def iniciar_servidor(directorio, puerto=0, demora=0, falla=None):
+    pedidos = []
+    manejador = type('Manejador', (ManejadorCondicional,), {'demora': demora, 'falla': falla, 'pedidos': pedidos})
+    servidor = ThreadingHTTPServer(('127.0.0.1', puerto), functools.partial(manejador, directory=directorio))
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    return servidor, f'http://127.0.0.1:{servidor.server_address[1]}/', pedidos
+
+
+# Función para comprobar la carga en paralelo y la caché de descargas contra el
+# servidor local, usando los CSV de `origen`. Devuelve la lista de problemas.
+def verificar_descargas(origen, demora=0.5):
+    problemas = []
+    with tempfile.TemporaryDirectory() as temporal:
+        archivos = os.path.join(temporal, 'origen')
+        cache = os.path.join(temporal, 'cache')
+        shutil.copytree(origen, archivos)
+        esperado = {nombre: leer_csv(ruta) for nombre, ruta in rutas_fuentes(archivos).items()}
+        servidor, url, pedidos = iniciar_servidor(archivos, demora=demora)
+
+        def cargar(descripcion, resultados_esperados):
+            pedidos.clear()
+            registro = []
+            inicio = time.perf_counter()
+            fuentes = cargar_fuentes(rutas_fuentes(url), cache, registro)
+            segundos = time.perf_counter() - inicio
+            resultados = {medida['etapa'].split()[-1]: medida.get('cache') for medida in registro}
+            for nombre, data in zip(ARCHIVOS, fuentes):
+                if not data.equals(esperado[nombre]):
+                    problemas.append(f"{descripcion}: {nombre} no coincide con el CSV")
+                if resultados.get(nombre) != resultados_esperados.get(nombre):
+                    problemas.append(f"{descripcion}: {nombre} dio {resultados.get(nombre)!r} en lugar de {resultados_esperados.get(nombre)!r}")
+            print(f"{descripcion}: {segundos:.2f} s, {sorted(pedidos)}")
+            return segundos
+
+        try:
+            # Arranque en frío: todo se descarga, en paralelo
+            segundos = cargar('descarga inicial', dict.fromkeys(ARCHIVOS, 'descargado'))
+            if demora and segundos > 2.5 * demora:
+                problemas.append(f"descarga inicial: {segundos:.2f} s con {demora} s de demora por archivo; no parece paralela")
+
+            # Reinicio sin cambios: 304 en todos y sin volver a interpretar los CSV
+            cargar('sin cambios', dict.fromkeys(ARCHIVOS, 'no modificado'))
+
+            # Cambia un archivo: solo ese se vuelve a descargar
+            nombre = 'orders_data'
+            ruta = rutas_fuentes(archivos)[nombre]
+            with open(ruta, 'a', encoding='ISO-8859-1') as archivo:
+                archivo.write('OTNUEVA;U0;PM01\n')
+            esperado[nombre] = leer_csv(ruta)
+            cargar('un archivo modificado', dict(dict.fromkeys(ARCHIVOS, 'no modificado'), **{nombre: 'descargado'}))
+        finally:
+            servidor.shutdown()
+            servidor.server_close()
+
+        # El servidor responde 503 en la misma URL: se usa la copia guardada
+        servidor, _, pedidos = iniciar_servidor(archivos, servidor.server_address[1], falla=503)
+        try:
+            cargar('error del servidor', dict.fromkeys(ARCHIVOS, 'error del servidor'))
+        finally:
+            servidor.shutdown()
+            servidor.server_close()
+
+        # Sin servidor: se usa la copia guardada
+        cargar('sin conexión', dict.fromkeys(ARCHIVOS, 'sin conexión'))
+    return problemas
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Servidor HTTP local con ETag para probar la descarga de los archivos de origen")
+    parser.add_argument('accion', choices=['servir', 'verificar'])
+    parser.add_argument('directorio', help="Directorio con los archivos CSV de origen")
+    parser.add_argument('--puerto', type=int, default=8000)
+    parser.add_argument('--demora', type=float, default=0.5, help="Segundos de espera agregados a cada respuesta")
+    args = parser.parse_args()
+
+    if args.accion == 'servir':
+        servidor, url, _ = iniciar_servidor(args.directorio, args.puerto, args.demora)
+        print(f"Sirviendo {args.directorio} en {url} (MONITOR_ORIGEN={url})")
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            servidor.shutdown()
+        return 0
+
+    problemas = verificar_descargas(args.directorio, args.demora)
+    for problema in problemas:
+        print(problema)
+    print("Descargas y caché correctas" if not problemas else "Se encontraron problemas")
+    return 1 if problemas else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
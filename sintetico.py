@@ -0,0 +1,162 @@
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+from fuentes import ARCHIVOS, ruta_snapshot, tipar_fuente
+
+# Procesos y recintos de los datos sintéticos (además de 'Overhead')
+PROCESOS = ['Mina', 'Planta', 'Puerto', 'Mantenimiento']
+RECINTOS = ['R1', 'R2', 'R3', 'R4']
+FAMILIAS = ['Servicios', 'Materiales']
+GRUPOS_CECO = ['Operación', 'Mantención', 'Abastecimiento y contratos', 'Finanzas', 'Servicios generales']
+CLASES_ORDEN = ['PM01', 'PM02', 'PM03', 'PM04']
+EJERCICIOS = (2023, 2024)
+
+
+# Función para generar las cinco tablas de origen con datos sintéticos
+#
+# Las tablas tienen las columnas de ESQUEMAS y los tipos que produce `leer_csv`.
+# Los parámetros controlan la forma de los datos:
+#   - `pares`: proporción de filas que forman pares de importes opuestos
+#   - `overhead`: proporción de Utec y Ceco asignados al proceso 'Overhead'
+#   - `sin_utec`: proporción de filas con una 'Orden partner' que no está en la base de órdenes
+#   - `ceco`: proporción de filas sin 'Orden partner', que se mapean por Ceco
+def generar_fuentes(filas, pares=0.1, overhead=0.1, sin_utec=0.05, ceco=0.3, ejercicios=EJERCICIOS, semilla=0):
+    rng = np.random.default_rng(semilla)
+    ejercicios = np.asarray(ejercicios)
+
+    # Tamaño de las dimensiones según la cantidad de filas
+    n_centros = int(np.clip(filas // 2000, 20, 5000))
+    n_clases = int(np.clip(filas // 5000, 10, 300))
+    n_ordenes = int(np.clip(filas // 20, 50, 500000))
+    n_utec = int(np.clip(n_ordenes // 50, 10, 10000))
+
+    centros = np.array([f'CC{i:05d}' for i in range(n_centros)], dtype=object)
+    clases = 61000000 + np.arange(n_clases) * 10
+    ordenes = np.array([f'OT{i:07d}' for i in range(n_ordenes)], dtype=object)
+    utecs = np.array([f'U{i:05d}' for i in range(n_utec)], dtype=object)
+
+    # Filas de gasto: una parte se genera como pares positivo/negativo del mismo
+    # grupo e importe, con el negativo en el mismo período o en uno posterior
+    n_pares = int(filas * pares) // 2
+    n_sueltas = filas - 2 * n_pares
+    ejercicio = rng.choice(ejercicios, n_sueltas + n_pares)
+    periodo = rng.integers(1, 13, n_sueltas + n_pares)
+    centro = rng.integers(0, n_centros, n_sueltas + n_pares)
+    clase = rng.integers(0, n_clases, n_sueltas + n_pares)
+    importe = rng.integers(1, 1000000, n_sueltas + n_pares) * 10
+    signo = np.where(rng.random(n_sueltas) < 0.9, 1, -1)
+
+    periodo_cierre = np.minimum(periodo[n_sueltas:] + rng.integers(0, 3, n_pares), 12)
+    ejercicio = np.concatenate([ejercicio, ejercicio[n_sueltas:]])
+    periodo = np.concatenate([periodo, periodo_cierre])
+    centro = np.concatenate([centro, centro[n_sueltas:]])
+    clase = np.concatenate([clase, clase[n_sueltas:]])
+    valor = np.concatenate([importe[:n_sueltas] * signo, importe[n_sueltas:], -importe[n_sueltas:]])
+
+    # Orden partner: sin orden (mapeo por Ceco), orden desconocida o una orden de la base
+    sorteo = rng.random(filas)
+    orden = ordenes[rng.integers(0, n_ordenes, filas)]
+    desconocidas = np.array([f'OTX{i:04d}' for i in range(1000)], dtype=object)
+    sin_base = sorteo < ceco + sin_utec
+    orden[sin_base] = desconocidas[rng.integers(0, 1000, sin_base.sum())]
+    orden[sorteo < ceco] = None
+
+    # Fecha de contabilización dentro del período
+    indice_ejercicio = np.searchsorted(np.sort(ejercicios), ejercicio)
+    dia = rng.integers(1, 29, filas)
+    fechas = np.array([f'{d:02d}.{m:02d}.{a}' for a in np.sort(ejercicios) for m in range(1, 13) for d in range(1, 29)], dtype=object)
+    fecha = fechas[(indice_ejercicio * 12 + periodo - 1) * 28 + dia - 1]
+
+    data0 = pd.DataFrame({
+        'Ejercicio': ejercicio,
+        'Período': periodo,
+        'Clase de coste': clases[clase],
+        'Centro de coste': centros[centro],
+        'Valor/mon.inf.': valor.astype(float),
+        'Orden partner': orden,
+        'Grupo_Ceco': rng.choice(GRUPOS_CECO, filas, p=[0.55, 0.3, 0.05, 0.05, 0.05]),
+        'Familia_Cuenta': rng.choice(FAMILIAS, filas),
+        'Denominación del objeto': np.array([f'Objeto {i}' for i in range(n_centros)], dtype=object)[centro],
+        'Fe.contabilización': fecha,
+    })
+    # El extracto viene ordenado por período
+    data0 = data0.iloc[rng.permutation(filas)].sort_values(['Ejercicio', 'Período'], kind='stable').reset_index(drop=True)
+
+    orders_data = pd.DataFrame({
+        'Orden': ordenes,
+        'Utec': utecs[rng.integers(0, n_utec, n_ordenes)],
+        'Clase de orden': rng.choice(CLASES_ORDEN, n_ordenes),
+    })
+    base_utec_data = pd.DataFrame({
+        'Utec': utecs,
+        'Proceso': _procesos(rng, n_utec, overhead),
+        'Recinto': rng.choice(RECINTOS, n_utec),
+    })
+    # Algunos Ceco no están en la base y sus filas quedan sin mapear
+    cecos = centros[rng.random(n_centros) < 0.95]
+    base_ceco_data = pd.DataFrame({
+        'Ceco': cecos,
+        'Proceso': _procesos(rng, len(cecos), overhead),
+        'Recinto': rng.choice(RECINTOS, len(cecos)),
+    })
+
+    # Presupuesto mensual, en millones, por proceso, familia, clase de coste y recinto
+    claves = pd.MultiIndex.from_product(
+        [np.sort(ejercicios), range(1, 13), PROCESOS + ['Overhead'], FAMILIAS, clases, RECINTOS],
+        names=['Año', 'Mes', 'Proceso', 'Familia_Cuenta', 'Clase de coste', 'Recinto'],
+    ).to_frame(index=False)
+    gasto_mensual = np.abs(valor).sum() / (len(ejercicios) * 12 * 1000000)
+    claves['Presupuesto'] = rng.random(len(claves)) * 2 * gasto_mensual / (len(claves) / (len(ejercicios) * 12))
+    budget_data = claves
+
+    return [data0, budget_data, orders_data, base_utec_data, base_ceco_data]
+
+
+# Función auxiliar para sortear el proceso de cada Utec o Ceco
+def _procesos(rng, cantidad, overhead):
+    procesos = rng.choice(PROCESOS, cantidad).astype(object)
+    procesos[rng.random(cantidad) < overhead] = 'Overhead'
+    return procesos
+
+
+# Función para escribir las tablas en CSV con el formato de los archivos de
+# origen: separador ';', codificación ISO-8859-1 e importes con separador de miles
+def escribir_csv(fuentes, destino):
+    os.makedirs(destino, exist_ok=True)
+    for (nombre, archivo), data in zip(ARCHIVOS.items(), fuentes):
+        if 'Valor/mon.inf.' in data.columns:
+            data = data.assign(**{'Valor/mon.inf.': data['Valor/mon.inf.'].map('{:,.0f}'.format)})
+        data.to_csv(os.path.join(destino, archivo), sep=';', index=False, encoding='ISO-8859-1')
+
+
+# Función para escribir las tablas como snapshot Parquet (ver fuentes.py)
+def escribir_parquet(fuentes, destino):
+    os.makedirs(destino, exist_ok=True)
+    for nombre, data in zip(ARCHIVOS, fuentes):
+        tipar_fuente(nombre, data).to_parquet(ruta_snapshot(destino, nombre), index=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Genera las cinco tablas de origen con datos sintéticos")
+    parser.add_argument('destino', help="Directorio donde se escriben los archivos")
+    parser.add_argument('--filas', type=int, default=100000, help="Cantidad de filas de gasto real")
+    parser.add_argument('--pares', type=float, default=0.1, help="Proporción de filas que forman pares opuestos")
+    parser.add_argument('--overhead', type=float, default=0.1, help="Proporción de Utec y Ceco con proceso Overhead")
+    parser.add_argument('--sin-utec', type=float, default=0.05, help="Proporción de filas con una orden que no está en la base")
+    parser.add_argument('--ceco', type=float, default=0.3, help="Proporción de filas sin orden, mapeadas por Ceco")
+    parser.add_argument('--semilla', type=int, default=0)
+    parser.add_argument('--formato', choices=['csv', 'parquet'], default='csv')
+    args = parser.parse_args()
+
+    fuentes = generar_fuentes(args.filas, args.pares, args.overhead, args.sin_utec, args.ceco, semilla=args.semilla)
+    if args.formato == 'parquet':
+        escribir_parquet(fuentes, args.destino)
+    else:
+        escribir_csv(fuentes, args.destino)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+import gc
+import json
+import os
+
+import pandas as pd
+import pytest
+import streamlit as st
+from streamlit.testing.v1 import AppTest
+
+from consultas_duckdb import DUCKDB_DISPONIBLE
+from sintetico import escribir_csv, generar_fuentes
+
+APP = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'App.py')
+
+
+# Función para obtener los mapas de calor de la página
+def mapas_de_calor(pagina):
+    graficos = [json.loads(grafico.proto.spec) for grafico in pagina.get('plotly_chart')]
+    return [grafico for grafico in graficos if any(traza['type'] == 'heatmap' for traza in grafico['data'])]
+
+
+# Página con datos sintéticos solo de 2023: la opción '2024', que es la primera
+# del filtro de año, no tiene gasto real
+@pytest.fixture
+def pagina(tmp_path, monkeypatch):
+    escribir_csv(generar_fuentes(3000, ejercicios=(2023,)), str(tmp_path))
+    monkeypatch.setenv('MONITOR_ORIGEN', str(tmp_path))
+    for variable in ['MONITOR_SNAPSHOT', 'MONITOR_INCREMENTAL', 'MONITOR_MOTOR', 'MONITOR_ACTUALIZAR']:
+        monkeypatch.delenv(variable, raising=False)
+    return AppTest.from_file(APP, default_timeout=300).run()
+
+
+# Sin gasto en la selección, el mapa de cumplimiento se reemplaza por un aviso
+# y el resto de la página se muestra igual
+def test_cumplimiento_sin_gasto_en_la_seleccion(pagina):
+    assert not pagina.exception
+    assert pagina.sidebar.selectbox[0].value == '2024'
+    assert any('No hay gasto real' in aviso.value for aviso in pagina.info)
+    assert not [selector for selector in pagina.selectbox if selector.label == 'Detalle']
+    assert not mapas_de_calor(pagina)
+
+
+# Con gasto en la selección se muestra el mapa y el detalle de una celda
+def test_cumplimiento_con_gasto(pagina):
+    pagina.sidebar.selectbox[0].set_value('2023').run()
+    assert not pagina.exception
+    assert not pagina.info
+    assert mapas_de_calor(pagina)
+
+    detalle = next(selector for selector in pagina.selectbox if selector.label == 'Detalle')
+    cantidad_tablas = len(pagina.dataframe)
+    detalle.set_value(detalle.options[0]).run()
+    assert not pagina.exception
+    assert len(pagina.dataframe) == cantidad_tablas + 1
+
+
+# Con el motor DuckDB las tablas de origen se descartan después de escribir los
+# Parquet: no queda ninguna tabla con las columnas del gasto de origen
+@pytest.mark.skipif(not DUCKDB_DISPONIBLE, reason="requiere duckdb")
+def test_duckdb_no_conserva_tablas_de_origen(tmp_path, monkeypatch):
+    fuentes = generar_fuentes(3000, ejercicios=(2023,))
+    escribir_csv(fuentes, str(tmp_path / 'origen'))
+    monkeypatch.setenv('MONITOR_ORIGEN', str(tmp_path / 'origen'))
+    monkeypatch.setenv('MONITOR_MOTOR', 'duckdb')
+    monkeypatch.setenv('MONITOR_PARQUET', str(tmp_path / 'parquet'))
+    monkeypatch.setenv('MONITOR_CACHE', '')
+    for variable in ['MONITOR_SNAPSHOT', 'MONITOR_INCREMENTAL', 'MONITOR_ACTUALIZAR']:
+        monkeypatch.delenv(variable, raising=False)
+    # Las cachés de Streamlit son del proceso: se descartan las tablas de las otras pruebas
+    st.cache_resource.clear()
+    st.cache_data.clear()
+
+    pagina = AppTest.from_file(APP, default_timeout=300).run()
+    assert not pagina.exception
+    assert mapas_de_calor(pagina.sidebar.selectbox[0].set_value('2023').run())
+
+    columnas = set(fuentes[0].columns)
+    del fuentes
+    gc.collect()
+    assert not [objeto for objeto in gc.get_objects() if isinstance(objeto, pd.DataFrame) and set(objeto.columns) == columnas]
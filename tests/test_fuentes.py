@@ -0,0 +1,49 @@
+import urllib.error
+
+import pytest
+
+from fuentes import descargar_con_cache, leer_csv
+from servidor_prueba import iniciar_servidor
+
+
+# Función para descargar `archivo` de un servidor local que responde siempre con
+# `falla` (o normalmente si es None) en el puerto `puerto`
+def descargar(directorio, cache, archivo, puerto=0, falla=None):
+    servidor, url, _ = iniciar_servidor(str(directorio), puerto, falla=falla)
+    try:
+        return servidor.server_address[1], descargar_con_cache(url + archivo, str(cache))
+    finally:
+        servidor.shutdown()
+        servidor.server_close()
+
+
+@pytest.fixture
+def origen(tmp_path):
+    directorio = tmp_path / 'origen'
+    directorio.mkdir()
+    (directorio / 'tabla.csv').write_text('Orden;Utec;Clase de orden\nOT1;U1;PM01\n', encoding='ISO-8859-1')
+    return directorio
+
+
+# Con un error 5xx se usa la copia guardada
+@pytest.mark.parametrize('falla', [500, 503])
+def test_error_del_servidor_usa_la_copia_guardada(origen, tmp_path, falla):
+    puerto, (_, resultado) = descargar(origen, tmp_path / 'cache', 'tabla.csv')
+    assert resultado == 'descargado'
+
+    _, (data, resultado) = descargar(origen, tmp_path / 'cache', 'tabla.csv', puerto, falla)
+    assert resultado == 'error del servidor'
+    assert data.equals(leer_csv(str(origen / 'tabla.csv')))
+
+
+# Un error 4xx no se oculta aunque haya una copia guardada
+def test_error_del_cliente_se_propaga(origen, tmp_path):
+    puerto, _ = descargar(origen, tmp_path / 'cache', 'tabla.csv')
+    with pytest.raises(urllib.error.HTTPError):
+        descargar(origen, tmp_path / 'cache', 'tabla.csv', puerto, 403)
+
+
+# Sin copia guardada el error 5xx se propaga
+def test_error_del_servidor_sin_copia(origen, tmp_path):
+    with pytest.raises(urllib.error.HTTPError):
+        descargar(origen, tmp_path / 'cache', 'tabla.csv', falla=503)
@@ -0,0 +1,75 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from procesamiento import CLAVES_PARES, eliminar_pares_opuestos
+
+
+# Implementación original fila a fila, conservada como referencia para verificar
+# `eliminar_pares_opuestos`. Usa un ordenamiento estable para que las filas del
+# mismo período se procesen en el orden de entrada.
+def eliminar_pares_opuestos_iterativo(data):
+    filtered_df = pd.DataFrame()
+    removed_df = pd.DataFrame()
+    groups = data.groupby(CLAVES_PARES, observed=True)
+
+    for name, group in groups:
+        seen_values = {}
+        rows_to_remove = set()
+
+        group = group.sort_values(by='Período', kind='stable')
+
+        for index, row in group.iterrows():
+            value = row['Valor/mon.inf.']
+            period = row['Período']
+
+            if value < 0:
+                if (period, -value) in seen_values:
+                    opposite_index = seen_values[(period, -value)]
+                    rows_to_remove.add(index)
+                    rows_to_remove.add(opposite_index)
+                    del seen_values[(period, -value)]
+                else:
+                    for past_period in range(period - 1, 0, -1):
+                        if (past_period, -value) in seen_values:
+                            opposite_index = seen_values[(past_period, -value)]
+                            rows_to_remove.add(index)
+                            rows_to_remove.add(opposite_index)
+                            del seen_values[(past_period, -value)]
+                            break
+                    else:
+                        seen_values[(period, value)] = index
+            else:
+                seen_values[(period, value)] = index
+
+        rows_to_remove_list = list(rows_to_remove)
+        group_filtered = group.drop(rows_to_remove_list)
+        removed_rows = group.loc[rows_to_remove_list]
+        removed_df = pd.concat([removed_df, removed_rows])
+        filtered_df = pd.concat([filtered_df, group_filtered])
+
+    return filtered_df, removed_df
+
+
+# Datos aleatorios con pocos importes y grupos, para que haya muchos pares,
+# empates y claves de grupo nulas
+def datos_aleatorios(rng, n_filas):
+    return pd.DataFrame({
+        'Clase de coste': rng.choice(['6100', '6200', '6300', None], size=n_filas, p=[0.4, 0.3, 0.25, 0.05]),
+        'Centro de coste': rng.choice(['CC01', 'CC02', 'CC03'], size=n_filas),
+        'Período': rng.integers(0, 13, size=n_filas),
+        'Valor/mon.inf.': rng.choice([-300, -200, -100, 0, 100, 200, 300], size=n_filas).astype(float),
+    })
+
+
+# `eliminar_pares_opuestos` conserva y elimina exactamente las mismas filas que
+# la implementación fila a fila
+@pytest.mark.parametrize('semilla', range(50))
+def test_eliminar_pares_opuestos_igual_a_iterativo(semilla):
+    data = datos_aleatorios(np.random.default_rng(semilla), 400)
+
+    esperado_filtrado, esperado_removido = eliminar_pares_opuestos_iterativo(data)
+    filtrado, removido = eliminar_pares_opuestos(data)
+
+    assert set(filtrado.index) == set(esperado_filtrado.index)
+    assert set(removido.index) == set(esperado_removido.index)